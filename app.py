@@ -1,16 +1,49 @@
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, has_request_context, Response, stream_with_context, g, copy_current_request_context, after_this_request
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from functools import wraps
 from flask_login import UserMixin
 import mysql.connector
-from mysql.connector import pooling
-from datetime import datetime
+from mysql.connector.errors import PoolError
+from datetime import datetime, timedelta
 import os
+import stat
+import sys
+import click
 from dotenv import load_dotenv
-import uuid
+import json
+import csv
+import io
+import base64
 import logging
-from decimal import Decimal
+import random
+import re
+import time
+import threading
+import multiprocessing
+import select
+import signal
+import socket
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+import tempfile
+import hashlib
+import pickle
+import gzip
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+try:
+    import brotli
+except ImportError:  # optional: responses fall back to gzip
+    brotli = None
 from flask_login import current_user
 
 # Configure logging
@@ -23,24 +56,251 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
-# Database connection pool configuration
-dbconfig = {
-    "pool_name": "mypool",
-    "pool_size": 5,
-    "host": os.getenv('DB_HOST', 'localhost'),
-    "user": os.getenv('DB_USER', 'root'),
-    "password": os.getenv('DB_PASSWORD', ''),
-    "database": os.getenv('DB_NAME', 'drugdatabase'),
-    "connect_timeout": 30
-}
 
-# Initialize connection pool
-try:
-    connection_pool = pooling.MySQLConnectionPool(**dbconfig)
-    logger.info("Database connection pool created successfully")
-except Exception as e:
-    logger.error(f"Failed to create connection pool: {e}")
-    raise
+def setting(name, default=None):
+    """A setting from app.config (see create_app), else the environment."""
+    return app.config.get(name, os.getenv(name, default))
+
+
+def database_config():
+    """Database connection configuration."""
+    return {
+        "host": setting('DB_HOST', 'localhost'),
+        "user": setting('DB_USER', 'root'),
+        "password": setting('DB_PASSWORD', ''),
+        "database": setting('DB_NAME', 'drugdatabase'),
+        "connect_timeout": 30
+    }
+
+
+dbconfig = database_config()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class PoolExhausted(PoolError):
+    """Raised when no connection frees up within the acquire timeout."""
+
+
+class ConnectionPool:
+    """Blocking MySQL connection pool.
+
+    Callers wait (bounded by max_waiters and timeout) instead of failing
+    when every connection is busy. Connections are pinged on checkout and
+    replaced once they are older than max_age.
+    """
+
+    WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+    # Bound at import, so recording_statements() wrapping
+    # mysql.connector.connect for the background jobs never reaches the pool
+    connect = staticmethod(mysql.connector.connect)
+
+    def __init__(self, config, size, max_waiters, timeout, max_age):
+        self.config = config
+        self.size = size
+        self.max_waiters = max_waiters
+        self.timeout = timeout
+        self.max_age = max_age
+        self._cond = threading.Condition()
+        self._idle = []
+        self._in_use = {}
+        self._total = 0
+        self._waiters = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._wait = Histogram(self.WAIT_BUCKETS)
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._cond:
+            while not self._idle and self._total >= self.size:
+                remaining = deadline - time.monotonic()
+                if self._waiters >= self.max_waiters or remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolExhausted(
+                        f"No connection available ({self._total} in use, "
+                        f"{self._waiters} waiting)")
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+
+            if self._idle:
+                # LIFO so the most recently used connections stay warm
+                conn, created_at = self._idle.pop()
+            else:
+                conn, created_at = None, None
+                self._total += 1
+            self._wait.observe(time.monotonic() - started)
+
+        try:
+            conn, created_at = self._checkout(conn, created_at)
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use[id(conn)] = created_at
+            self._acquired += 1
+        return conn
+
+    def _checkout(self, conn, created_at):
+        if conn is not None and time.monotonic() - created_at > self.max_age:
+            self._recycled += 1
+            self._close_quietly(conn)
+            conn = None
+        if conn is not None:
+            try:
+                conn.ping(reconnect=True, attempts=1, delay=0)
+                return conn, created_at
+            except Exception as e:
+                logger.warning(f"Dropping unhealthy pooled connection: {e}")
+                self._close_quietly(conn)
+        return self.connect(**self.config), time.monotonic()
+
+    def release(self, conn):
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+            if created_at is None:
+                return
+            self._idle.append((conn, created_at))
+            self._cond.notify()
+
+    def discard(self, conn):
+        """Close a checked-out connection that should not be reused."""
+        with self._cond:
+            if self._in_use.pop(id(conn), None) is None:
+                return
+            self._total -= 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    def reset_after_fork(self):
+        """Forget the parent's connections in a freshly forked child.
+
+        They are dropped, not closed: closing would send COM_QUIT on
+        sockets the parent process is still using.
+        """
+        self._cond = threading.Condition()
+        self._idle = []
+        self._in_use = {}
+        self._total = 0
+        self._waiters = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._wait = Histogram(self.WAIT_BUCKETS)
+
+    def warm(self, count):
+        """Open up to count connections ahead of the first requests."""
+        conns = []
+        try:
+            for _ in range(min(count, self.size)):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                self.release(conn)
+        return len(conns)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiters': self._waiters,
+                'acquired': self._acquired,
+                'timeouts': self._timeouts,
+                'recycled': self._recycled,
+                'wait_seconds_sum': self._wait.sum,
+                'wait_histogram': self._wait.cumulative(),
+            }
+
+
+# Connection pools. Nothing connects until the first checkout, so importing
+# the app (or building it in tests) does not need a reachable database.
+
+
+def create_pools():
+    """Build the primary pool and, when DB_REPLICA_HOST is set, a replica pool."""
+    pool_options = {
+        'size': int(setting('DB_POOL_SIZE', 5)),
+        'max_waiters': int(setting('DB_POOL_MAX_WAITERS', 50)),
+        'timeout': float(setting('DB_POOL_TIMEOUT', 5)),
+        'max_age': float(setting('DB_POOL_MAX_AGE', 1800)),
+    }
+    primary = ConnectionPool(dbconfig, **pool_options)
+
+    # Optional read replica; read-only connections fall back to the primary
+    # when it is not configured or cannot be reached
+    replica = None
+    if setting('DB_REPLICA_HOST'):
+        replica_config = {
+            **dbconfig,
+            "host": setting('DB_REPLICA_HOST'),
+            "user": setting('DB_REPLICA_USER', dbconfig['user']),
+            "password": setting('DB_REPLICA_PASSWORD', dbconfig['password']),
+            "database": setting('DB_REPLICA_NAME', dbconfig['database']),
+        }
+        replica = ConnectionPool(replica_config, **{
+            **pool_options,
+            'size': int(setting('DB_REPLICA_POOL_SIZE', pool_options['size'])),
+        })
+    return primary, replica
+
+
+def _reset_pools_after_fork():
+    # Looked up at fork time: create_app may have replaced the pools
+    connection_pool.reset_after_fork()
+    if replica_pool is not None:
+        replica_pool.reset_after_fork()
+
+
+connection_pool, replica_pool = create_pools()
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+# A replica that failed a checkout is skipped for this long
+REPLICA_RETRY_SECONDS = float(os.getenv('REPLICA_RETRY_SECONDS', 30))
+
+# After a write, a session keeps reading from the primary for this long
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
 
 # Login manager setup
 login_manager = LoginManager()
@@ -56,28 +316,386 @@ class User(UserMixin):
         self.role = role
 
     def get_id(self):
-        return str(self.id)
+        # The role travels with the session identity so load_user only
+        # has to look at one table
+        return f"{self.role}:{self.id}"
+
+
+# Session identities are "<role>:<id>", so ids must never contain a colon
+USER_ID_PATTERN = re.compile(r'[A-Za-z0-9_.-]{1,20}')
+USER_ID_RULE = 'IDs may only use letters, digits, ".", "_" and "-" (at most 20)'
+
+
+def valid_user_id(user_id):
+    return USER_ID_PATTERN.fullmatch(user_id) is not None
+
+
+class UserCache:
+    """Bounded in-process cache of User objects with TTL and LRU eviction."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, identity):
+        with self._lock:
+            entry = self._entries.get(identity)
+            if entry and entry[1] > time.monotonic():
+                self._entries.move_to_end(identity)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self._entries[identity]
+            self.misses += 1
+            return None
+
+    def put(self, identity, user):
+        with self._lock:
+            self._entries[identity] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(identity)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def reset_after_fork(self):
+        # The lock may have been held by a parent thread at fork time
+        self._lock = threading.Lock()
+
+    def invalidate(self, role, user_id):
+        """Drop a user whose seller/customer record changed."""
+        with self._lock:
+            self._entries.pop(f"{role}:{user_id}", None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+user_cache = UserCache(
+    max_size=int(os.getenv('USER_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('USER_CACHE_TTL', 300)))
+os.register_at_fork(after_in_child=user_cache.reset_after_fork)
+
+# Password hashing offloaded to a bounded process pool
+
+# Any werkzeug method spec, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', os.cpu_count() or 1))
+HASH_MAX_PENDING = int(os.getenv('HASH_MAX_PENDING', HASH_WORKERS * 4))
+HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', 10))
+
+
+class HashPoolBusy(Exception):
+    """Raised when too many hash jobs are already queued."""
+
+
+def canonical_hash_method(method):
+    """A werkzeug method spec with its default costs filled in, as stored
+    in front of the hash ("pbkdf2" -> "pbkdf2:sha256:<iterations>")."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = args or (2 ** 15, 8, 1)
+        return f"scrypt:{int(n)}:{int(r)}:{int(p)}"
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    return method
+
+
+class PasswordHasher:
+    """Runs werkzeug hashing in worker processes so request threads never
+    hold the GIL for the duration of a key derivation."""
+
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashPoolBusy('Password hashing queue is full')
+        try:
+            return self._pool().submit(fn, *args).result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+    def verify(self, stored_hash, password):
+        return self._run(check_password_hash, stored_hash, password)
+
+    @staticmethod
+    def needs_rehash(stored_hash):
+        """True when a hash was made with a different method or cost."""
+        return canonical_hash_method(stored_hash.split('$', 1)[0]) != \
+            canonical_hash_method(PASSWORD_HASH_METHOD)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def reset_after_fork(self):
+        # The parent's worker processes belong to the parent; start our own
+        # on first use
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+
+password_hasher = PasswordHasher(HASH_WORKERS, HASH_MAX_PENDING, HASH_TIMEOUT)
+os.register_at_fork(after_in_child=password_hasher.reset_after_fork)
+
+# Request and SQL instrumentation
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+slow_query_logger = logging.getLogger('app.slow_queries')
+
+
+class RequestMetrics:
+    """Per-route request latency and database cost, kept per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.requests = {}
+        self.queries = {}
+        self.db_seconds = {}
+        self.rows = {}
+        self.slow_queries = 0
+
+    def reset_after_fork(self):
+        # Each worker reports its own numbers, starting from zero
+        self.__init__()
+
+    def observe(self, route, status, seconds, queries, db_seconds, rows):
+        with self._lock:
+            if route not in self.latency:
+                self.latency[route] = Histogram(LATENCY_BUCKETS)
+            self.latency[route].observe(seconds)
+            key = (route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.queries[route] = self.queries.get(route, 0) + queries
+            self.db_seconds[route] = self.db_seconds.get(route, 0.0) + db_seconds
+            self.rows[route] = self.rows.get(route, 0) + rows
+
+    def count_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+
+request_metrics = RequestMetrics()
+os.register_at_fork(after_in_child=request_metrics.reset_after_fork)
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times statements and counts rows for the request."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, operation, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, **kwargs)
+        finally:
+            self._record(operation, time.perf_counter() - started)
+
+    def _record(self, operation, seconds):
+        route = None
+        if has_request_context():
+            route = request.endpoint
+            g.db_queries = g.get('db_queries', 0) + 1
+            g.db_seconds = g.get('db_seconds', 0.0) + seconds
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            request_metrics.count_slow_query()
+            slow_query_logger.warning(
+                f"Slow query ({seconds * 1000:.1f} ms) in {route or 'cli'}: "
+                f"{' '.join(operation.split())[:500]}")
+
+    def _count(self, rows):
+        if has_request_context():
+            g.db_rows = g.get('db_rows', 0) + rows
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._count(1 if row is not None else 0)
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count(len(rows))
+        return rows
+
+    def fetchmany(self, size=1):
+        rows = self._cursor.fetchmany(size)
+        self._count(len(rows))
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    queries = g.get('db_queries', 0)
+    db_seconds = g.get('db_seconds', 0.0)
+    request_metrics.observe(
+        request.endpoint or 'unmatched', response.status_code,
+        time.perf_counter() - started, queries, db_seconds, g.get('db_rows', 0))
+    # Make N+1 regressions visible from any browser or curl
+    response.headers['X-DB-Queries'] = str(queries)
+    response.headers['X-DB-Time-Ms'] = f"{db_seconds * 1000:.1f}"
+    return response
+
+
+# Time-ordered ID generation for orders and products
+
+
+class IdGenerator:
+    """Monotonic, time-ordered IDs unique across threads and processes.
+
+    Each ID is a prefix plus 17 Crockford base32 characters (85 bits): a
+    48-bit millisecond timestamp, a 27-bit node id and a 10-bit
+    per-millisecond sequence. The node id is the host's ID_HOST (0-31, one
+    per host sharing a database) followed by the 22-bit process id, which
+    Linux never exceeds; it is rebuilt after fork. Two live processes thus
+    never share a node id. IDs sort by creation time, and "ORD" + 17 fits
+    VARCHAR(20).
+    """
+
+    ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+    HOST_BITS = 5
+    PID_BITS = 22
+    NODE_BITS = HOST_BITS + PID_BITS
+    SEQUENCE_BITS = 10
+    WIDTH = 17
+
+    def __init__(self):
+        self.reseed()
+
+    def reseed(self):
+        self._lock = threading.Lock()
+        host = int(setting('ID_HOST', 0))
+        if not 0 <= host < 1 << self.HOST_BITS:
+            raise ValueError(
+                f"ID_HOST must be between 0 and {(1 << self.HOST_BITS) - 1}")
+        self.node = (host << self.PID_BITS) | \
+            (os.getpid() & ((1 << self.PID_BITS) - 1))
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _next_value(self):
+        with self._lock:
+            now = time.time_ns() // 1_000_000
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                # Same millisecond or the clock stepped back: keep counting
+                self._sequence += 1
+                if self._sequence >> self.SEQUENCE_BITS:
+                    # Sequence exhausted: borrow the next millisecond
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << (self.NODE_BITS + self.SEQUENCE_BITS)) | \
+                (self.node << self.SEQUENCE_BITS) | self._sequence
+
+    def new_id(self, prefix):
+        value = self._next_value()
+        chars = []
+        for _ in range(self.WIDTH):
+            chars.append(self.ALPHABET[value & 31])
+            value >>= 5
+        return prefix + "".join(reversed(chars))
+
+
+id_generator = IdGenerator()
+os.register_at_fork(after_in_child=id_generator.reseed)
 
 # Database context manager with improved error handling
 
 
 class DatabaseConnection:
-    def __init__(self):
+    def __init__(self, read_only=False, buffered=True):
+        self.read_only = read_only
+        self.buffered = buffered
+        self.pool = None
         self.conn = None
         self.cursor = None
 
+    replica_down_until = 0.0
+
+    def _choose_pool(self):
+        if not self.read_only or replica_pool is None:
+            return connection_pool
+        if DatabaseConnection.replica_down_until > time.monotonic():
+            return connection_pool
+        # Read your own writes: stay on the primary right after a write
+        if has_request_context() and session.get('_primary_until', 0) > time.time():
+            return connection_pool
+        return replica_pool
+
     def __enter__(self):
         try:
-            self.conn = connection_pool.get_connection()
-            self.cursor = self.conn.cursor(dictionary=True, buffered=True)
+            self.pool = self._choose_pool()
+            try:
+                self.conn = self.pool.acquire()
+            except Exception as e:
+                if self.pool is connection_pool:
+                    raise
+                logger.warning(f"Replica checkout failed, using primary: {e}")
+                DatabaseConnection.replica_down_until = \
+                    time.monotonic() + REPLICA_RETRY_SECONDS
+                self.pool = connection_pool
+                self.conn = self.pool.acquire()
+            # Unbuffered cursors stream rows off the socket as they are fetched
+            self.cursor = InstrumentedCursor(
+                self.conn.cursor(dictionary=True, buffered=self.buffered))
             return self.cursor
         except Exception as e:
             logger.error(f"Database connection error: {e}")
             if self.conn:
-                self.conn.close()
+                self.pool.discard(self.conn)
             raise
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self._result_unread():
+            self._abandon()
+            return
+        healthy = True
         try:
             if exc_type is not None:
                 logger.error(f"Database operation failed: {exc_val}")
@@ -86,193 +704,2905 @@ class DatabaseConnection:
             else:
                 if self.conn:
                     self.conn.commit()
+                    self._mark_write()
+        except Exception:
+            healthy = False
+            raise
         finally:
             if self.cursor:
-                self.cursor.close()
+                try:
+                    self.cursor.close()
+                except Exception:
+                    healthy = False
             if self.conn:
-                self.conn.close()
+                if healthy:
+                    self.pool.release(self.conn)
+                else:
+                    self.pool.discard(self.conn)
 
-# Role-based access control with multiple roles support
+    def _result_unread(self):
+        return not self.buffered and self.conn is not None and \
+            self.conn.unread_result
 
+    def _abandon(self):
+        # An unbuffered result abandoned halfway, e.g. an aborted download:
+        # rollback() and close() would first read every remaining row into
+        # memory, so the socket is shut down and the connection dropped
+        try:
+            self.conn.shutdown()
+        except Exception:
+            pass
+        self.pool.discard(self.conn)
 
-def role_required(roles):
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            if not current_user.is_authenticated:
-                flash('Please log in to access this page.', 'warning')
-                return redirect(url_for('login'))
-            if current_user.role not in roles:
-                flash('You do not have access to this page.', 'danger')
-                return redirect(url_for('home'))
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
+    def _mark_write(self):
+        # Only form posts write; GET handlers use the primary for reads only
+        if self.read_only or replica_pool is None or not has_request_context():
+            return
+        if request.method != 'GET':
+            session['_primary_until'] = time.time() + READ_YOUR_WRITES_SECONDS
 
+# Shared caching layer: in-process or a local directory shared by workers
 
-@login_manager.user_loader
-def load_user(user_id):
-    try:
-        with DatabaseConnection() as cursor:
-            # Check seller table first
-            cursor.execute(
-                "SELECT *, 'seller' as role FROM seller WHERE seller_id = %s", (user_id,))
-            user_data = cursor.fetchone()
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_DIR = os.getenv(
+    'CACHE_DIR', os.path.join(tempfile.gettempdir(), f"pharmacy-cache-{os.getuid()}"))
 
-            if not user_data:
-                # Check customer table if not found in seller
-                cursor.execute(
-                    "SELECT *, 'customer' as role FROM customer WHERE customer_id = %s", (user_id,))
-                user_data = cursor.fetchone()
 
-            if user_data:
-                role = user_data.pop('role')
-                return User(user_id, user_data['email'], role)
-    except Exception as e:
-        logger.error(f"Error loading user: {e}")
-        return None
+class UnsafeCacheDirectory(Exception):
+    """Raised for a cache directory other users could write to."""
 
-# Enhanced error handling middleware
 
+def private_cache_dir(directory, root=None):
+    """Create directory (and root above it) with mode 0o700, then check both
+    are real directories owned by this user that nobody else can write to.
 
-@app.errorhandler(Exception)
-def handle_error(error):
-    logger.error(f"Unhandled error: {error}")
-    return render_template('500.html'), 500
+    Cache entries are unpickled or unmarshalled, so anyone able to plant a
+    file in them could run code in the app.
+    """
+    for path in filter(None, (root, directory)):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() \
+                or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise UnsafeCacheDirectory(
+                f"Refusing cache directory {path}: it must be a directory "
+                f"owned by uid {os.getuid()} and writable only by it")
+    return directory
 
-# Routes with improved validation and error handling
 
+class MemoryCacheBackend:
+    """Per-process backend; invalidation only reaches this worker.
 
-@app.route('/')
-def home():
-    try:
-        with DatabaseConnection() as cursor:
-            cursor.execute("""
-                SELECT p.*, s.company_name 
-                FROM product p 
-                JOIN seller s ON p.seller_id = s.seller_id 
-                WHERE p.status = 'available' 
-                LIMIT 10
-            """)
-            featured_products = cursor.fetchall()
-        return render_template('home.html', featured_products=featured_products)
-    except Exception as e:
-        logger.error(f"Error loading home page: {e}")
-        return render_template('home.html')
+    With max_entries set, the least recently written entries are evicted.
+    With drop_expired set, expired entries are dropped on write; Cache keeps
+    them to serve stale values, so only stores that never do should set it.
+    """
 
+    def __init__(self, max_entries=None, drop_expired=False):
+        self.max_entries = max_entries
+        self.drop_expired = drop_expired
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.reset_after_fork)
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        user_id = request.form['user_id']
-        password = request.form['password']
-        role = request.form['role']
+    def reset_after_fork(self):
+        # Refreshes running in the parent never finish here
+        self._refreshing = set()
+        self._lock = threading.Lock()
 
-        try:
-            with DatabaseConnection() as cursor:
-                if role == 'seller':
-                    cursor.execute(
-                        "SELECT * FROM seller WHERE seller_id = %s", (user_id,))
-                elif role == 'customer':
-                    cursor.execute(
-                        "SELECT * FROM customer WHERE customer_id = %s", (user_id,))
-                else:
-                    flash('Invalid role selected', 'error')
-                    return redirect(url_for('login'))
+    def get(self, key):
+        return self._entries.get(key)
 
-                user_data = cursor.fetchone()
-                if user_data and check_password_hash(user_data['password'], password):
-                    user = User(user_id, user_data['email'], role)
-                    login_user(user)
-                    flash('Login successful', 'success')
-                    if role == 'seller':
-                        return redirect(url_for('seller_dashboard'))
-                    elif role == 'customer':
-                        return redirect(url_for('customer_dashboard'))
-                else:
-                    flash('Invalid user ID or password', 'error')
-                    return redirect(url_for('login'))
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            if self.drop_expired:
+                self._drop_expired()
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
 
-        except Exception as e:
-            logger.error(f"Login error: {e}")
-            flash('An error occurred during login', 'error')
-            return redirect(url_for('login'))
+    def _drop_expired(self):
+        # Entries are in write order, so with one TTL the expired ones lead
+        now = time.time()
+        while self._entries and next(iter(self._entries.values()))[1] <= now:
+            self._entries.popitem(last=False)
 
-    return render_template('login.html')
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
 
+    def try_lock(self, key, timeout):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
 
-@app.route('/register_seller', methods=['GET', 'POST'])
-def register_seller():
-    if request.method == 'POST':
-        try:
-            # Validate required fields
-            required_fields = ['seller_id', 'company_name',
-                               'license_number', 'email', 'phone', 'address', 'password']
-            if not all(request.form.get(field) for field in required_fields):
-                flash('All fields are required', 'error')
-                return render_template('register_seller.html')
+    def unlock(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
 
-            hashed_password = generate_password_hash(request.form['password'])
 
-            with DatabaseConnection() as cursor:
-                # Check for existing email
-                cursor.execute(
-                    "SELECT 1 FROM seller WHERE email = %s", (request.form['email'],))
-                if cursor.fetchone():
-                    flash('Email already registered', 'error')
-                    return render_template('register_seller.html')
+class FileCacheBackend:
+    """Pickle files in a local directory, shared by every worker on the host.
 
-                cursor.execute("""
-                    INSERT INTO seller (
-                        seller_id, password, company_name, license_number, 
-                        email, phone, address, status
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    request.form['seller_id'],
-                    hashed_password,
-                    request.form['company_name'],
-                    request.form['license_number'],
-                    request.form['email'],
-                    request.form['phone'],
-                    request.form['address'],
-                    request.form.get('status', 'active')
-                ))
+    max_entries and drop_expired work as in MemoryCacheBackend, but are
+    applied by a sweep every SWEEP_EVERY writes of this process, so the
+    directory can briefly hold that many extra files per worker.
+    """
 
-                flash('Registration successful', 'success')
-                return redirect(url_for('login'))
+    # Sweeping lists the whole directory, so it is not done on every write
+    SWEEP_EVERY = 100
 
-        except Exception as e:
-            logger.error(f"Error registering seller: {e}")
-            flash('An error occurred during registration', 'error')
-            return render_template('register_seller.html')
+    def __init__(self, directory, root=None, max_entries=None,
+                 drop_expired=False):
+        self.directory = private_cache_dir(directory, root)
+        self.max_entries = max_entries
+        self.drop_expired = drop_expired
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.reset_after_fork)
 
-    return render_template('register_seller.html')
+    def reset_after_fork(self):
+        self._writes = 0
+        self._lock = threading.Lock()
 
+    def _path(self, key, suffix):
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, name + suffix)
 
-@app.route('/register_customer', methods=['GET', 'POST'])
-def register_customer():
-    if request.method == 'POST':
+    def get(self, key):
         try:
-            # Validate required fields
-            required_fields = ['customer_id', 'first_name',
-                               'last_name', 'email', 'phone', 'address', 'password']
-            if not all(request.form.get(field) for field in required_fields):
-                flash('All fields are required', 'error')
-                return render_template('register_customer.html')
+            with open(self._path(key, '.pickle'), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
 
-            hashed_password = generate_password_hash(request.form['password'])
+    def set(self, key, value, expires_at):
+        path = self._path(key, '.pickle')
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump((value, expires_at), f, pickle.HIGHEST_PROTOCOL)
+        # The mtime carries the expiry, so sweeps need not unpickle anything
+        os.utime(tmp, (expires_at, expires_at))
+        os.replace(tmp, path)
+        if self.max_entries or self.drop_expired:
+            with self._lock:
+                self._writes += 1
+                due = self._writes >= self.SWEEP_EVERY
+                if due:
+                    self._writes = 0
+            if due:
+                self._sweep()
 
-            with DatabaseConnection() as cursor:
-                # Check for existing email
-                cursor.execute(
-                    "SELECT 1 FROM customer WHERE email = %s", (request.form['email'],))
-                if cursor.fetchone():
-                    flash('Email already registered', 'error')
-                    return render_template('register_customer.html')
+    def _sweep(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.pickle'):
+                    continue
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        # With one TTL per backend, the soonest to expire were written first
+        entries.sort()
+        excess = len(entries) - self.max_entries if self.max_entries else 0
+        now = time.time()
+        for i, (expires_at, path) in enumerate(entries):
+            if i >= excess and not (self.drop_expired and expires_at <= now):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
 
-                cursor.execute("""
-                    INSERT INTO customer (
-                        customer_id, password, first_name, last_name, 
+    def delete(self, key):
+        try:
+            os.remove(self._path(key, '.pickle'))
+        except FileNotFoundError:
+            pass
+
+    def try_lock(self, key, timeout):
+        path = self._path(key, '.lock')
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                # A worker that died mid-refresh leaves its lock behind
+                try:
+                    if time.time() - os.path.getmtime(path) < timeout:
+                        return False
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def unlock(self, key):
+        try:
+            os.remove(self._path(key, '.lock'))
+        except FileNotFoundError:
+            pass
+
+
+def make_cache_backend(namespace, kind=None, max_entries=None,
+                       drop_expired=False):
+    if (kind or setting('CACHE_BACKEND', CACHE_BACKEND)) == 'file':
+        root = setting('CACHE_DIR', CACHE_DIR)
+        return FileCacheBackend(os.path.join(root, namespace), root,
+                                max_entries, drop_expired)
+    return MemoryCacheBackend(max_entries, drop_expired)
+
+
+class Cache:
+    """TTL cache with a stampede guard.
+
+    When an entry expires, one caller takes the refresh lock and reloads it
+    while everyone else keeps serving the stale value.
+    """
+
+    def __init__(self, backend, lock_timeout=30):
+        self.backend = backend
+        self.lock_timeout = lock_timeout
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.reset_after_fork)
+
+    def reset_after_fork(self):
+        # The lock may have been held by a parent thread at fork time
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get_or_refresh(self, key, ttl, loader):
+        entry = self.backend.get(key)
+        if entry and entry[1] > time.time():
+            self._count('hits')
+            return entry[0]
+
+        if self.backend.try_lock(key, self.lock_timeout):
+            self._count('misses')
+            try:
+                value = loader()
+                self.backend.set(key, value, time.time() + ttl)
+                return value
+            finally:
+                self.backend.unlock(key)
+
+        if entry:
+            self._count('stale_hits')
+            return entry[0]
+        # Cold cache while another worker refreshes: load without storing
+        self._count('misses')
+        return loader()
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale_hits
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            }
+
+
+FEATURED_PRODUCTS_TTL = int(os.getenv('FEATURED_PRODUCTS_TTL', 60))
+featured_cache = Cache(make_cache_backend('featured'))
+
+
+# Catalog version: bumped inside every transaction that changes what the
+# JSON catalog shows, cached so conditional requests need no query
+
+CATALOG_VERSION_TTL = int(os.getenv('CATALOG_VERSION_TTL', 5))
+CATALOG_API_PAGE_SIZE = int(os.getenv('CATALOG_API_PAGE_SIZE', 100))
+CATALOG_API_MAX_PAGE_SIZE = int(os.getenv('CATALOG_API_MAX_PAGE_SIZE', 1000))
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+catalog_cache = Cache(make_cache_backend('catalog'))
+
+
+def bump_catalog_version(cursor):
+    cursor.execute("""
+        UPDATE catalog_version SET version = version + 1
+        WHERE name = 'catalog'
+    """)
+
+
+def load_catalog_version():
+    with DatabaseConnection() as cursor:
+        cursor.execute("SELECT version FROM catalog_version WHERE name = 'catalog'")
+        return cursor.fetchone()['version']
+
+
+def current_catalog_version():
+    return catalog_cache.get_or_refresh(
+        'catalog_version', CATALOG_VERSION_TTL, load_catalog_version)
+
+
+def _drop_catalog_caches():
+    featured_cache.invalidate('featured_products')
+    catalog_cache.invalidate('catalog_version')
+
+
+def catalog_changed():
+    """Drop cached catalog state once a product write has committed.
+
+    Inside a request this is deferred until the view has returned, so no
+    reader can cache the pre-commit version in between. With
+    CACHE_BACKEND=memory other workers notice within CATALOG_VERSION_TTL
+    seconds; the file backend shares the invalidation.
+    """
+    if not has_request_context():
+        _drop_catalog_caches()
+        return
+
+    @after_this_request
+    def drop_after_commit(response):
+        _drop_catalog_caches()
+        return response
+
+
+# Rendered page fragments. {% cache name, version %}...{% endcache %} keeps a
+# block's HTML under name and reuses it while version is unchanged. Versions
+# are per-scope counters ('seller:<id>', 'customer:<id>') bumped in the same
+# transaction as the writes the fragment shows; the TTL bounds how long
+# anything not covered by a version (sitewide averages) can lag.
+
+FRAGMENT_CACHE_TTL = int(os.getenv('FRAGMENT_CACHE_TTL', 300))
+FRAGMENT_CACHE_ENTRIES = int(os.getenv('FRAGMENT_CACHE_ENTRIES', 10000))
+TEMPLATE_CACHE_DIR = os.getenv(
+    'TEMPLATE_CACHE_DIR', os.path.join(CACHE_DIR, 'templates'))
+
+
+def bump_data_versions(cursor, scopes):
+    """Advance each scope's data version inside the caller's transaction.
+
+    Rows are upserted in sorted order so concurrent writers lock them in
+    the same sequence.
+    """
+    scopes = sorted(set(scopes))
+    if not scopes:
+        return
+    cursor.execute(f"""
+        INSERT INTO data_version (scope, version)
+        VALUES {", ".join(["(%s, 1)"] * len(scopes))}
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, scopes)
+
+
+def load_data_version(cursor, scope):
+    # Read before the fragment's data, so data is never older than its key
+    cursor.execute("SELECT version FROM data_version WHERE scope = %s", (scope,))
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+
+class LazyResult:
+    """Query result loaded the first time a template touches it.
+
+    Views pass these instead of rows so that a fragment served from the
+    cache never runs the queries behind it.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._loaded = False
+        self._value = None
+
+    def get(self):
+        if not self._loaded:
+            self._value = self._loader()
+            self._loaded = True
+        return self._value
+
+    def __iter__(self):
+        return iter(self.get() or ())
+
+    def __len__(self):
+        return len(self.get() or ())
+
+    def __bool__(self):
+        return bool(self.get())
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self.get()[name]
+        except (KeyError, TypeError):
+            raise AttributeError(name) from None
+
+
+def skip_fragment_cache():
+    """Keep the fragment being rendered out of the cache (partial data)."""
+    g.skip_fragment_cache = True
+
+
+class FragmentCache:
+    """Rendered fragments stored with their data version and render cost."""
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.fragments = {}
+
+    def _stats(self, name):
+        # Fragments are counted per family: the name up to the first ':'
+        family = name.split(':', 1)[0]
+        stats = self.fragments.get(family)
+        if stats is None:
+            stats = self.fragments.setdefault(family, {
+                'hits': 0, 'misses': 0,
+                'render_seconds': 0.0, 'saved_seconds': 0.0})
+        return stats
+
+    def render(self, name, version, caller):
+        stats = self._stats(name)
+        entry = self.backend.get(name)
+        if entry and entry[1] > time.time() and entry[0][0] == version:
+            _, html, cost = entry[0]
+            stats['hits'] += 1
+            stats['saved_seconds'] += cost
+            return Markup(html)
+
+        g.pop('skip_fragment_cache', None)
+        started = time.perf_counter()
+        html = caller()
+        cost = time.perf_counter() - started
+        stats['misses'] += 1
+        stats['render_seconds'] += cost
+        if not g.pop('skip_fragment_cache', False):
+            self.backend.set(name, (version, str(html), cost),
+                             time.time() + self.ttl)
+        return html
+
+    def stats(self):
+        hits = sum(s['hits'] for s in self.fragments.values())
+        misses = sum(s['misses'] for s in self.fragments.values())
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+
+fragment_cache = FragmentCache(
+    make_cache_backend('fragments', max_entries=FRAGMENT_CACHE_ENTRIES),
+    FRAGMENT_CACHE_TTL)
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja tag for fragment_cache: {% cache name, version %}."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        parser.stream.expect('comma')
+        args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args),
+                               [], [], body).set_lineno(lineno)
+
+    def _render(self, name, version, caller):
+        return fragment_cache.render(name, version, caller)
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """Compiled templates on disk, reused by new workers and restarts.
+
+    Entries are keyed on the template source checksum, so an edited
+    template is simply recompiled.
+    """
+
+    def __init__(self, directory, root=None):
+        # Bytecode is unmarshalled into code objects: a directory others can
+        # write to disables the cache rather than the app
+        try:
+            self.directory_ok = bool(private_cache_dir(directory, root))
+        except UnsafeCacheDirectory as e:
+            logger.error(f"Template bytecode cache disabled: {e}")
+            self.directory_ok = False
+        super().__init__(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def load_bytecode(self, bucket):
+        if not self.directory_ok:
+            self.misses += 1
+            return
+        super().load_bytecode(bucket)
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def dump_bytecode(self, bucket):
+        if self.directory_ok:
+            super().dump_bytecode(bucket)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+template_bytecode_cache = TemplateBytecodeCache(
+    TEMPLATE_CACHE_DIR,
+    CACHE_DIR if os.path.dirname(TEMPLATE_CACHE_DIR) == CACHE_DIR else None)
+# Must be set before anything touches app.jinja_env
+app.jinja_options = {
+    **app.jinja_options,
+    'bytecode_cache': template_bytecode_cache,
+    'extensions': [*app.jinja_options.get('extensions', ()),
+                   FragmentCacheExtension],
+}
+
+
+# Server-side carts, keyed by the customer id already in the session
+
+class CartFull(Exception):
+    """Raised when a cart already holds the maximum number of products."""
+
+
+class CartStore:
+    """Carts keyed by customer, mapping each product_id to its quantity.
+
+    Prices and sellers are not stored: the cart page reads them from
+    product with priced_cart_items, and checkout from the locked rows.
+    """
+
+    def __init__(self, backend, max_items, ttl, lock_timeout=2):
+        self.backend = backend
+        self.max_items = max_items
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    @staticmethod
+    def key(customer_id):
+        return f"cart:{customer_id}"
+
+    def get(self, customer_id):
+        entry = self.backend.get(self.key(customer_id))
+        if not entry or entry[1] <= time.time():
+            return {}
+        # Older versions stored (quantity, unit_price, seller_id) per line
+        return {product_id: line[0] if isinstance(line, tuple) else line
+                for product_id, line in entry[0].items()}
+
+    def add(self, customer_id, product_id, quantity):
+        """Merge a line into the cart and return the product count."""
+        key = self.key(customer_id)
+        deadline = time.monotonic() + self.lock_timeout
+        # Two tabs adding at once must not lose each other's lines
+        while not self.backend.try_lock(key, self.lock_timeout):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Cart {key} is locked")
+            time.sleep(0.01)
+        try:
+            cart = self.get(customer_id)
+            if product_id not in cart and len(cart) >= self.max_items:
+                raise CartFull(
+                    f"Your cart can hold at most {self.max_items} products")
+            cart[product_id] = cart.get(product_id, 0) + quantity
+            self.backend.set(key, cart, time.time() + self.ttl)
+            return len(cart)
+        finally:
+            self.backend.unlock(key)
+
+    def items(self, customer_id):
+        """Cart lines in the shape checkout expects."""
+        return [{'product_id': product_id, 'quantity': quantity}
+                for product_id, quantity
+                in sorted(self.get(customer_id).items())]
+
+    def clear(self, customer_id):
+        self.backend.delete(self.key(customer_id))
+
+
+def priced_cart_items(cursor, items):
+    """Add current prices and sellers to cart lines for display.
+
+    Lines whose product is gone keep a unit_price of None; checkout
+    rejects them.
+    """
+    if not items:
+        return []
+    product_ids = [item['product_id'] for item in items]
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    cursor.execute(f"""
+        SELECT product_id, unit_price, seller_id
+        FROM product
+        WHERE product_id IN ({placeholders})
+    """, product_ids)
+    products = {row['product_id']: row for row in cursor.fetchall()}
+    priced = []
+    for item in items:
+        product = products.get(item['product_id'])
+        unit_price = product['unit_price'] if product else None
+        priced.append({
+            **item,
+            'unit_price': unit_price,
+            'subtotal': None if unit_price is None
+            else item['quantity'] * unit_price,
+            'seller_id': product['seller_id'] if product else None,
+        })
+    return priced
+
+
+def make_cart_store():
+    return CartStore(
+        make_cache_backend('carts', setting('CART_BACKEND'),
+                           max_entries=int(setting('CART_MAX_CARTS', 100000)),
+                           drop_expired=True),
+        max_items=int(setting('CART_MAX_ITEMS', 100)),
+        ttl=int(setting('CART_TTL', 7 * 24 * 3600)))
+
+
+cart_store = make_cart_store()
+
+
+# Product validation shared by the product form and bulk import
+
+PRODUCT_REQUIRED_FIELDS = [
+    'name', 'manufacturer', 'mfg_date', 'exp_date', 'unit_price', 'stock_quantity']
+
+
+class ProductValidationError(ValueError):
+    """A product row broke one of the product form rules."""
+
+
+def validate_product(fields, allow_past_mfg_date=False):
+    """Check raw string fields against the product rules.
+
+    Returns the parsed product including its initial status.
+    """
+    if not all(fields.get(field) for field in PRODUCT_REQUIRED_FIELDS):
+        raise ProductValidationError('All required fields must be filled')
+
+    try:
+        # Validate dates
+        mfg_date = datetime.strptime(fields['mfg_date'], '%Y-%m-%d')
+        exp_date = datetime.strptime(fields['exp_date'], '%Y-%m-%d')
+
+        # Validate numeric values
+        unit_price = Decimal(fields['unit_price'])
+        stock_quantity = int(fields['stock_quantity'])
+        min_stock_level = int(fields.get('min_stock_level') or 10)
+    except (ValueError, InvalidOperation) as e:
+        logger.error(f"Product validation error: {e}")
+        raise ProductValidationError('Invalid input values')
+
+    # Ensure dates are not in the past and expiry is after manufacture
+    if not allow_past_mfg_date and mfg_date.date() < datetime.now().date():
+        raise ProductValidationError('Manufacturing date cannot be in the past')
+    if exp_date <= mfg_date:
+        raise ProductValidationError(
+            'Expiration date must be after manufacturing date')
+    if unit_price <= 0:
+        raise ProductValidationError('Unit price must be greater than 0')
+    if stock_quantity < 0:
+        raise ProductValidationError('Stock quantity cannot be negative')
+    if min_stock_level < 0:
+        raise ProductValidationError('Minimum stock level cannot be negative')
+
+    # Determine initial status based on stock quantity
+    status = 'out_of_stock' if stock_quantity == 0 else \
+        'low_stock' if stock_quantity <= min_stock_level else \
+        'available'
+
+    return {
+        'name': fields['name'],
+        'description': fields.get('description') or '',
+        'manufacturer': fields['manufacturer'],
+        'mfg_date': mfg_date,
+        'exp_date': exp_date,
+        'unit_price': unit_price,
+        'stock_quantity': stock_quantity,
+        'min_stock_level': min_stock_level,
+        'status': status,
+    }
+
+
+# Bulk product import/upsert
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', 1000))
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+
+def iter_product_rows(stream, fmt):
+    """Yield (row_number, fields) from a CSV or JSON Lines text stream.
+
+    fields is None for a line that could not be parsed at all.
+    """
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            yield number, {key.strip(): (value or '').strip()
+                           for key, value in row.items() if key}
+    elif fmt == 'jsonl':
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                yield number, None
+                continue
+            # Same raw string shape as form fields and CSV cells
+            yield number, {key: '' if value is None else str(value)
+                           for key, value in row.items()}
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+class ProductImporter:
+    """Streams product rows into one seller's catalog in batches.
+
+    A row whose name (case-insensitive) already exists for the seller
+    updates that product; any other row inserts a new one. Each batch costs
+    one duplicate lookup and one multi-row INSERT ... ON DUPLICATE KEY
+    UPDATE in its own short transaction.
+    """
+
+    def __init__(self, seller_id, batch_size=IMPORT_BATCH_SIZE):
+        self.seller_id = seller_id
+        self.batch_size = batch_size
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+        self.elapsed = 0.0
+        self._seen_names = set()
+
+    def _error(self, number, message):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({'row': number, 'error': message})
+
+    def run(self, rows):
+        started = time.perf_counter()
+        batch = []
+        for number, fields in rows:
+            self.rows += 1
+            if fields is None:
+                self._error(number, 'Malformed row')
+                continue
+            # The past-date rule only applies to new products; see _write
+            try:
+                product = validate_product(fields, allow_past_mfg_date=True)
+            except ProductValidationError as e:
+                self._error(number, str(e))
+                continue
+
+            name_key = product['name'].lower()
+            if name_key in self._seen_names:
+                self._error(number, 'Duplicate product name in this import')
+                continue
+            self._seen_names.add(name_key)
+
+            batch.append((number, product))
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    def _write(self, batch):
+        names = [product['name'].lower() for _, product in batch]
+        placeholders = ", ".join(["%s"] * len(names))
+        today = datetime.now().date()
+        # Rows already reported here must not be reported again if the
+        # batch fails
+        rejected = set()
+        try:
+            with DatabaseConnection() as cursor:
+                # One set-based duplicate lookup for the whole batch
+                cursor.execute(f"""
+                    SELECT product_id, LOWER(name) as name_key, stock_slots
+                    FROM product
+                    WHERE seller_id = %s AND LOWER(name) IN ({placeholders})
+                """, (self.seller_id, *names))
+                existing = {row['name_key'].lower(): row
+                            for row in cursor.fetchall()}
+
+                inserted = updated = 0
+                params = []
+                hot_stock = {}
+                for number, product in batch:
+                    row = existing.get(product['name'].lower())
+                    if row is None:
+                        if product['mfg_date'].date() < today:
+                            self._error(
+                                number, 'Manufacturing date cannot be in the past')
+                            rejected.add(number)
+                            continue
+                        product_id = id_generator.new_id('P')
+                        inserted += 1
+                    else:
+                        product_id = row['product_id']
+                        if row['stock_slots']:
+                            hot_stock[product_id] = product['stock_quantity']
+                        updated += 1
+                    params.extend((
+                        product_id, self.seller_id, product['name'],
+                        product['description'], product['manufacturer'],
+                        product['mfg_date'], product['exp_date'],
+                        product['unit_price'], product['stock_quantity'],
+                        product['min_stock_level'], product['status']))
+
+                if params:
+                    values = ", ".join(
+                        ["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())"]
+                        * (inserted + updated))
+                    cursor.execute(f"""
+                        INSERT INTO product (
+                            product_id, seller_id, name, description,
+                            manufacturer, mfg_date, exp_date, unit_price,
+                            stock_quantity, min_stock_level, status, created_at
+                        ) VALUES {values}
+                        ON DUPLICATE KEY UPDATE
+                            name = VALUES(name),
+                            description = VALUES(description),
+                            manufacturer = VALUES(manufacturer),
+                            mfg_date = VALUES(mfg_date),
+                            exp_date = VALUES(exp_date),
+                            unit_price = VALUES(unit_price),
+                            stock_quantity = IF(stock_slots > 0, stock_quantity,
+                                                VALUES(stock_quantity)),
+                            min_stock_level = VALUES(min_stock_level)
+                    """, params)
+                    # Hot products keep their stock in the sub-counters; the
+                    # imported level replaces it there, as in update_product
+                    for product_id, total in sorted(hot_stock.items()):
+                        rebalance_hot_stock(cursor, product_id, total=total)
+                    bump_catalog_version(cursor)
+                    bump_data_versions(cursor, [f"seller:{self.seller_id}"])
+        except Exception as e:
+            for number, _ in batch:
+                if number not in rejected:
+                    self._error(number, f"Batch failed: {e}")
+            return
+        self.inserted += inserted
+        self.updated += updated
+
+    def report(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows / self.elapsed, 1) if self.elapsed else 0.0,
+        }
+
+
+# Hot products: stock split over sub-counters decremented without locking reads
+
+HOT_STOCK_SLOTS = int(os.getenv('HOT_STOCK_SLOTS', 8))
+HOT_STOCK_MAX_SLOTS = 64
+HOT_STOCK_REBALANCE_SECONDS = float(os.getenv('HOT_STOCK_REBALANCE_SECONDS', 5))
+
+
+def _spread_stock(total, slots):
+    base, extra = divmod(total, slots)
+    return [base + (1 if slot < extra else 0) for slot in range(slots)]
+
+
+SLOT_SALES_COLUMNS = ("sold_quantity, sold_lines, sold_revenue, sold_price_sum, "
+                      "seller_orders, last_sold_at")
+
+
+def fold_slot_sales(cursor, product_id, seller_id, slots):
+    """Move the sales counted on a hot product's locked slot rows into the
+    sales rollups. Returns whether there was anything to fold."""
+    lines = sum(r['sold_lines'] for r in slots)
+    orders = sum(r['seller_orders'] for r in slots)
+    if not lines and not orders:
+        return False
+
+    # Same lock order as checkout: slots, then the rollup rows
+    if lines:
+        cursor.execute("""
+            INSERT INTO product_sales_rollup (
+                product_id, seller_id, total_quantity, order_count,
+                total_revenue, unit_price_sum, last_order_date
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                total_quantity = total_quantity + VALUES(total_quantity),
+                order_count = order_count + VALUES(order_count),
+                total_revenue = total_revenue + VALUES(total_revenue),
+                unit_price_sum = unit_price_sum + VALUES(unit_price_sum),
+                last_order_date = GREATEST(COALESCE(last_order_date, VALUES(last_order_date)),
+                                           VALUES(last_order_date))
+        """, (product_id, seller_id, sum(r['sold_quantity'] for r in slots), lines,
+              sum(r['sold_revenue'] for r in slots),
+              sum(r['sold_price_sum'] for r in slots),
+              max(r['last_sold_at'] for r in slots if r['last_sold_at'])))
+    if orders:
+        cursor.execute("""
+            INSERT INTO seller_sales_rollup (seller_id, order_count)
+            VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count)
+        """, (seller_id, orders))
+    cursor.execute("""
+        UPDATE product_stock_slot
+        SET sold_quantity = 0, sold_lines = 0, sold_revenue = 0,
+            sold_price_sum = 0, seller_orders = 0
+        WHERE product_id = %s
+    """, (product_id,))
+    return True
+
+
+def set_stock_slots(cursor, product_id, slots):
+    """Move a product into hot mode (slots > 0) or back to a single counter.
+
+    The product row is locked first, then its slots, the same order the
+    rebalancer uses. Returns the stock total, or None for unknown products.
+    """
+    cursor.execute("""
+        SELECT stock_quantity, stock_slots, seller_id FROM product
+        WHERE product_id = %s
+        FOR UPDATE
+    """, (product_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+
+    total = row['stock_quantity']
+    if row['stock_slots']:
+        cursor.execute(f"""
+            SELECT slot, quantity, {SLOT_SALES_COLUMNS} FROM product_stock_slot
+            WHERE product_id = %s
+            ORDER BY slot
+            FOR UPDATE
+        """, (product_id,))
+        current = cursor.fetchall()
+        total = sum(r['quantity'] for r in current)
+        # Unfolded sales would go with the rows
+        if fold_slot_sales(cursor, product_id, row['seller_id'], current):
+            bump_data_versions(cursor, [f"seller:{row['seller_id']}"])
+        cursor.execute(
+            "DELETE FROM product_stock_slot WHERE product_id = %s", (product_id,))
+
+    if slots:
+        values = ", ".join(["(%s, %s, %s)"] * slots)
+        params = []
+        for slot, quantity in enumerate(_spread_stock(total, slots)):
+            params.extend((product_id, slot, quantity))
+        cursor.execute(f"""
+            INSERT INTO product_stock_slot (product_id, slot, quantity)
+            VALUES {values}
+        """, params)
+
+    cursor.execute("""
+        UPDATE product SET stock_slots = %s, stock_quantity = %s
+        WHERE product_id = %s
+    """, (slots, total, product_id))
+    return total
+
+
+def rebalance_hot_stock(cursor, product_id, total=None):
+    """Even out a hot product's slots and mirror their sum into the product.
+
+    product.stock_quantity of a hot product is only as fresh as the last
+    rebalance; listings and the status trigger read it from there. Passing
+    total replaces the stock level instead of redistributing it.
+    """
+    cursor.execute("""
+        SELECT stock_slots, stock_quantity, seller_id FROM product
+        WHERE product_id = %s
+        FOR UPDATE
+    """, (product_id,))
+    row = cursor.fetchone()
+    if not row or not row['stock_slots']:
+        return None
+    slots = row['stock_slots']
+
+    cursor.execute(f"""
+        SELECT slot, quantity, {SLOT_SALES_COLUMNS} FROM product_stock_slot
+        WHERE product_id = %s
+        ORDER BY slot
+        FOR UPDATE
+    """, (product_id,))
+    rows = cursor.fetchall()
+    folded = fold_slot_sales(cursor, product_id, row['seller_id'], rows)
+    current = {r['slot']: r['quantity'] for r in rows}
+    if total is None:
+        total = sum(current.values())
+
+    target = _spread_stock(total, slots)
+    if target != [current.get(slot) for slot in range(slots)]:
+        values = ", ".join(["(%s, %s, %s)"] * slots)
+        params = []
+        for slot, quantity in enumerate(target):
+            params.extend((product_id, slot, quantity))
+        cursor.execute(f"""
+            INSERT INTO product_stock_slot (product_id, slot, quantity)
+            VALUES {values}
+            ON DUPLICATE KEY UPDATE quantity = VALUES(quantity)
+        """, params)
+
+    if row['stock_quantity'] != total:
+        cursor.execute("""
+            UPDATE product SET stock_quantity = %s WHERE product_id = %s
+        """, (total, product_id))
+        if (row['stock_quantity'] > 0) != (total > 0):
+            bump_catalog_version(cursor)
+    if folded or row['stock_quantity'] != total:
+        bump_data_versions(cursor, [f"seller:{row['seller_id']}"])
+    return total
+
+
+class StockRebalancer:
+    """Daemon thread rebalancing every hot product each interval.
+
+    Started lazily by the first hot checkout in each worker process; each
+    product is rebalanced in its own short transaction. A MySQL named lock
+    lets only one process rebalance per interval, however many workers run
+    a rebalancer thread.
+    """
+
+    LOCK_NAME = 'pharmacy_stock_rebalance'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.runs = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def reset_after_fork(self):
+        # Threads do not survive fork; the next hot checkout starts one
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='stock-rebalancer', daemon=True)
+                self._thread.start()
+
+    def run_once(self):
+        """Rebalance every hot product once.
+
+        Returns the number of products, or None if another process holds
+        the lock.
+        """
+        # The lock lives on its own session so pooled connections never
+        # go back to the pool holding it
+        conn = mysql.connector.connect(**dbconfig)
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT GET_LOCK(%s, 0) as locked", (self.LOCK_NAME,))
+            if not cursor.fetchone()['locked']:
+                return None
+            with DatabaseConnection() as cursor:
+                cursor.execute("SELECT product_id FROM product WHERE stock_slots > 0")
+                product_ids = [row['product_id'] for row in cursor.fetchall()]
+            for product_id in product_ids:
+                with DatabaseConnection() as cursor:
+                    rebalance_hot_stock(cursor, product_id)
+        finally:
+            # Closing the session also releases the named lock
+            conn.close()
+        self.runs += 1
+        return len(product_ids)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Stock rebalance failed: {e}")
+
+
+stock_rebalancer = StockRebalancer(HOT_STOCK_REBALANCE_SECONDS)
+os.register_at_fork(after_in_child=stock_rebalancer.reset_after_fork)
+
+# Set-based checkout: one ordered lock, one decrement, one multi-row insert
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be placed (missing product, low stock)."""
+
+
+class CartCheckout:
+    """Places a whole cart in a constant number of round trips.
+
+    Products are locked in primary-key order so concurrent checkouts always
+    acquire row locks in the same sequence and cannot deadlock each other.
+    Hot products (stock_slots > 0) are never locked: their stock is taken
+    from one of several sub-counters with a conditional decrement, and their
+    sales are counted on that sub-counter until the rebalancer folds them
+    into the rollups.
+    """
+
+    def __init__(self, cursor, order_id, customer_id, shipping_address=None):
+        self.cursor = cursor
+        self.order_id = order_id
+        self.customer_id = customer_id
+        self.shipping_address = shipping_address
+        self.round_trips = 0
+        self.line_count = 0
+        self.hot_lines = 0
+        self.sold_out = []
+        self.lock_hold_ms = 0.0
+
+    def _execute(self, query, params=()):
+        self.round_trips += 1
+        self.cursor.execute(query, params)
+
+    @staticmethod
+    def merge_lines(cart):
+        # The session cart may list the same product more than once
+        quantities = {}
+        for item in cart:
+            quantity = int(item['quantity'])
+            if quantity <= 0:
+                raise CheckoutError(
+                    f"Invalid quantity for product {item['product_id']}")
+            quantities[item['product_id']] = \
+                quantities.get(item['product_id'], 0) + quantity
+        return dict(sorted(quantities.items()))
+
+    def place(self, cart):
+        quantities = self.merge_lines(cart)
+        if not quantities:
+            raise CheckoutError('Your cart is empty')
+        product_ids = list(quantities)
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        self.line_count = len(product_ids)
+
+        self._execute("START TRANSACTION")
+        locked_at = time.perf_counter()
+
+        # Plain read first: hot products must not take the row lock below
+        self._execute(f"""
+            SELECT product_id, unit_price, seller_id, stock_slots
+            FROM product
+            WHERE product_id IN ({placeholders})
+        """, product_ids)
+        locked = {row['product_id']: row for row in self.cursor.fetchall()}
+        hot = [pid for pid in product_ids
+               if pid in locked and locked[pid]['stock_slots']]
+        cold = [pid for pid in product_ids if pid not in hot]
+        self.hot_lines = len(hot)
+
+        if cold:
+            self._take_stock(cold, quantities, locked)
+        if hot:
+            self._take_hot_stock(hot, quantities, locked, cold)
+
+        # Write all order lines with one multi-row insert; prices and
+        # sellers come from the locked rows, not from the client cart. One
+        # explicit timestamp keeps lines and header in the same month
+        # partition
+        order_date = datetime.now().replace(microsecond=0)
+        values = ", ".join(
+            ["(%s, %s, %s, %s, %s, %s, %s, %s, 'processing')"] * len(product_ids))
+        params = []
+        total = 0
+        for product_id, quantity in quantities.items():
+            row = locked[product_id]
+            total += row['unit_price'] * quantity
+            params.extend((
+                self.order_id, product_id, quantity, row['unit_price'],
+                row['unit_price'] * quantity, self.customer_id,
+                row['seller_id'], order_date))
+        self._execute(f"""
+            INSERT INTO order_item (
+                order_id, product_id, quantity, unit_price, subtotal,
+                customer_id, seller_id, order_date, status
+            ) VALUES {values}
+        """, params)
+
+        # Built here rather than with INSERT ... SELECT FROM order_item, whose
+        # shared next-key locks would block the next checkout's lines
+        self._execute("""
+            INSERT INTO orders (
+                order_id, customer_id, order_date, line_count, total, shipping_address
+            ) VALUES (%s, %s, %s, %s, %s, %s)
+        """, (self.order_id, self.customer_id, order_date, len(product_ids),
+              total, self.shipping_address))
+
+        if cold:
+            self._update_sales_rollups(cold, quantities, locked)
+        # Keys the cached seller product tables and order history; sellers
+        # of hot lines are bumped when their sales are folded in
+        self.round_trips += 1
+        bump_data_versions(self.cursor, [
+            f"customer:{self.customer_id}",
+            *(f"seller:{locked[pid]['seller_id']}" for pid in cold)])
+        if self.sold_out:
+            # The catalog shows whether a product is in stock
+            self.round_trips += 1
+            bump_catalog_version(self.cursor)
+
+        self._execute("COMMIT")
+        self.lock_hold_ms = (time.perf_counter() - locked_at) * 1000
+        return self.round_trips
+
+    def _take_stock(self, product_ids, quantities, locked):
+        placeholders = ", ".join(["%s"] * len(product_ids))
+
+        # Lock every product of the cart in one ordered statement
+        self._execute(f"""
+            SELECT product_id, stock_quantity, unit_price, seller_id, stock_slots
+            FROM product
+            WHERE product_id IN ({placeholders})
+            ORDER BY product_id
+            FOR UPDATE
+        """, product_ids)
+        rows = {row['product_id']: row for row in self.cursor.fetchall()}
+
+        for product_id in product_ids:
+            row = rows.get(product_id)
+            if not row or row['stock_quantity'] < quantities[product_id]:
+                raise CheckoutError(
+                    f"Insufficient stock for product {product_id}")
+            if row['stock_slots']:
+                # Switched to hot mode since the plain read above
+                raise CheckoutError(
+                    f"Stock for product {product_id} changed, please try again")
+            if row['stock_quantity'] == quantities[product_id]:
+                self.sold_out.append(product_id)
+            locked[product_id] = row
+
+        # Apply all decrements in a single statement
+        cases = " ".join(["WHEN %s THEN %s"] * len(product_ids))
+        case_params = [v for pid in product_ids for v in (pid, quantities[pid])]
+        self._execute(f"""
+            UPDATE product
+            SET stock_quantity = stock_quantity - CASE product_id {cases} END
+            WHERE product_id IN ({placeholders})
+        """, (*case_params, *product_ids))
+
+    def _take_hot_stock(self, product_ids, quantities, locked, cold):
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        # The order counts once per seller: on a cold line's seller rollup
+        # if there is one, else on the seller's first hot line
+        counted = {locked[pid]['seller_id'] for pid in cold}
+
+        # Snapshot read, no locks: only used to pick which slots to try
+        self._execute(f"""
+            SELECT product_id, slot, quantity FROM product_stock_slot
+            WHERE product_id IN ({placeholders})
+        """, product_ids)
+        slots = {}
+        for row in self.cursor.fetchall():
+            slots.setdefault(row['product_id'], {})[row['slot']] = row['quantity']
+
+        for product_id in product_ids:
+            quantity = quantities[product_id]
+            available = slots.get(product_id, {})
+            if sum(available.values()) < quantity:
+                raise CheckoutError(
+                    f"Insufficient stock for product {product_id}")
+
+            # A random slot that covers the whole line spreads concurrent
+            # checkouts; any further slots are drained in ascending order so
+            # two checkouts spanning several slots lock them in one sequence
+            covering = [slot for slot, q in available.items() if q >= quantity]
+            first = [random.choice(covering)] if covering else []
+            order = first + sorted(slot for slot in available if slot not in first)
+
+            row = locked[product_id]
+            seller_order = 0 if row['seller_id'] in counted else 1
+            counted.add(row['seller_id'])
+            # Recorded with the first decrement, on a row already locked
+            sale = (quantity, row['unit_price'] * quantity, row['unit_price'],
+                    seller_order)
+
+            remaining = quantity
+            for slot in order:
+                amount = min(remaining, available[slot])
+                if amount <= 0:
+                    continue
+                if not self._decrement_slot(product_id, slot, amount, sale):
+                    # Partly drained by a concurrent checkout since the
+                    # snapshot: lock the slot and take what it still holds
+                    self._execute("""
+                        SELECT quantity FROM product_stock_slot
+                        WHERE product_id = %s AND slot = %s
+                        FOR UPDATE
+                    """, (product_id, slot))
+                    current = self.cursor.fetchone()
+                    amount = min(remaining, current['quantity'] if current else 0)
+                    if amount <= 0 or \
+                            not self._decrement_slot(product_id, slot, amount, sale):
+                        continue
+                sale = None
+                remaining -= amount
+                if not remaining:
+                    break
+            if remaining:
+                raise CheckoutError(
+                    f"Insufficient stock for product {product_id}")
+
+    def _decrement_slot(self, product_id, slot, amount, sale):
+        # The condition, not the snapshot, decides: a slot drained by a
+        # concurrent checkout matches no row
+        if sale:
+            self._execute("""
+                UPDATE product_stock_slot
+                SET quantity = quantity - %s,
+                    sold_quantity = sold_quantity + %s,
+                    sold_lines = sold_lines + 1,
+                    sold_revenue = sold_revenue + %s,
+                    sold_price_sum = sold_price_sum + %s,
+                    seller_orders = seller_orders + %s,
+                    last_sold_at = NOW()
+                WHERE product_id = %s AND slot = %s AND quantity >= %s
+            """, (amount, *sale, product_id, slot, amount))
+        else:
+            self._execute("""
+                UPDATE product_stock_slot
+                SET quantity = quantity - %s
+                WHERE product_id = %s AND slot = %s AND quantity >= %s
+            """, (amount, product_id, slot, amount))
+        return self.cursor.rowcount
+
+    def _update_sales_rollups(self, product_ids, quantities, locked):
+        # Fold the cold lines into the rollups inside the checkout transaction
+        values = ", ".join(["(%s, %s, %s, 1, %s, %s, NOW())"] * len(product_ids))
+        params = []
+        for product_id in product_ids:
+            quantity = quantities[product_id]
+            row = locked[product_id]
+            params.extend((
+                product_id, row['seller_id'], quantity,
+                row['unit_price'] * quantity, row['unit_price']))
+        self._execute(f"""
+            INSERT INTO product_sales_rollup (
+                product_id, seller_id, total_quantity, order_count,
+                total_revenue, unit_price_sum, last_order_date
+            ) VALUES {values}
+            ON DUPLICATE KEY UPDATE
+                total_quantity = total_quantity + VALUES(total_quantity),
+                order_count = order_count + 1,
+                total_revenue = total_revenue + VALUES(total_revenue),
+                unit_price_sum = unit_price_sum + VALUES(unit_price_sum),
+                last_order_date = VALUES(last_order_date)
+        """, params)
+
+        seller_ids = sorted({locked[pid]['seller_id'] for pid in product_ids})
+        self._execute(f"""
+            INSERT INTO seller_sales_rollup (seller_id, order_count)
+            VALUES {", ".join(["(%s, 1)"] * len(seller_ids))}
+            ON DUPLICATE KEY UPDATE order_count = order_count + 1
+        """, seller_ids)
+
+
+def rebuild_sales_rollups(cursor):
+    """Recompute both sales rollups from the uncancelled lines of
+    order_item and its archive.
+
+    Intended for maintenance windows (or after bulk loads) since it scans
+    every order line, archived ones included.
+    """
+    # Hot sales still waiting on their slots are in the lines counted below;
+    # slots first, the order checkout locks them in
+    cursor.execute("""
+        UPDATE product_stock_slot
+        SET sold_quantity = 0, sold_lines = 0, sold_revenue = 0,
+            sold_price_sum = 0, seller_orders = 0
+        WHERE sold_lines <> 0 OR seller_orders <> 0
+    """)
+    cursor.execute("DELETE FROM product_sales_rollup")
+    cursor.execute(f"""
+        INSERT INTO product_sales_rollup (
+            product_id, seller_id, total_quantity, order_count,
+            total_revenue, unit_price_sum, last_order_date
+        )
+        SELECT p.product_id, p.seller_id, SUM(oi.quantity), COUNT(*),
+               SUM(oi.subtotal), SUM(oi.unit_price), MAX(oi.order_date)
+        FROM {SOLD_ORDER_LINES} oi
+        JOIN product p ON oi.product_id = p.product_id
+        GROUP BY p.product_id, p.seller_id
+    """)
+    products = cursor.rowcount
+
+    cursor.execute("DELETE FROM seller_sales_rollup")
+    cursor.execute(f"""
+        INSERT INTO seller_sales_rollup (seller_id, order_count)
+        SELECT seller_id, COUNT(DISTINCT order_id)
+        FROM {SOLD_ORDER_LINES} oi
+        WHERE seller_id IS NOT NULL
+        GROUP BY seller_id
+    """)
+    return products, cursor.rowcount
+
+# Bulk order status transitions: one transition applied to many of a
+# seller's order lines, a chunk of lines per short transaction
+
+ORDER_STATUS_TRANSITIONS = {
+    'pending': ('processing', 'cancelled'),
+    'processing': ('shipped', 'cancelled'),
+    'shipped': ('delivered',),
+    'delivered': (),
+    'cancelled': (),
+}
+BULK_STATUS_CHUNK = int(os.getenv('BULK_STATUS_CHUNK', 1000))
+# Optional breather between chunks for replicas and concurrent checkouts
+BULK_STATUS_PAUSE = float(os.getenv('BULK_STATUS_PAUSE', 0))
+BULK_STATUS_MAX_ORDERS = int(os.getenv('BULK_STATUS_MAX_ORDERS', 10000))
+
+
+class OrderStatusError(Exception):
+    """Raised for an unknown status or a transition the lifecycle forbids."""
+
+
+def status_sources(status):
+    """Statuses from which an order line may move to status."""
+    if status not in ORDER_STATUS_TRANSITIONS:
+        raise OrderStatusError(f"Unknown status: {status}")
+    sources = [source for source, targets in ORDER_STATUS_TRANSITIONS.items()
+               if status in targets]
+    if not sources:
+        raise OrderStatusError(f"Order lines cannot be moved to {status}")
+    return sources
+
+
+class OrderStatusUpdate:
+    """Moves a seller's order lines to one status, chunk by chunk.
+
+    Candidate lines come from plain, non-locking reads. Each chunk then
+    locks only its own rows by primary key and re-checks their status in
+    the UPDATE itself, so a chunk holds its locks for a few statements and
+    never takes gap locks that would stall checkouts inserting new lines.
+    Cancelling a line puts its quantity back into stock and takes it back
+    out of the sales rollups and monthly_sales in the same transaction.
+    """
+
+    def __init__(self, seller_id, status, chunk_size=BULK_STATUS_CHUNK,
+                 pause=BULK_STATUS_PAUSE):
+        self.seller_id = seller_id
+        self.status = status
+        self.sources = status_sources(status)
+        self.chunk_size = max(1, chunk_size)
+        self.pause = pause
+        self.updated = 0
+        self.chunks = 0
+        self.skipped = {}
+        self.restocked = {}
+        self.back_in_stock = False
+        self.hot_restocked = False
+        self.max_chunk_ms = 0.0
+        self.elapsed = 0.0
+
+    def run_for_orders(self, order_ids):
+        """Move every line of the given orders that belongs to this seller."""
+        started = time.perf_counter()
+        order_ids = sorted(set(order_ids))
+        for start in range(0, len(order_ids), self.chunk_size):
+            batch = order_ids[start:start + self.chunk_size]
+            placeholders = ", ".join(["%s"] * len(batch))
+            with DatabaseConnection() as cursor:
+                cursor.execute(f"""
+                    SELECT order_date, order_id, product_id, customer_id, status
+                    FROM order_item
+                    WHERE seller_id = %s AND order_id IN ({placeholders})
+                """, (self.seller_id, *batch))
+                lines = cursor.fetchall()
+            for line in lines:
+                if line['status'] not in self.sources:
+                    self.skipped[line['status']] = \
+                        self.skipped.get(line['status'], 0) + 1
+            self._apply([line for line in lines if line['status'] in self.sources])
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    def run_for_status(self, from_status, placed_before=None):
+        """Move every line of this seller currently in from_status."""
+        if from_status not in self.sources:
+            raise OrderStatusError(
+                f"Order lines cannot move from {from_status} to {self.status}")
+        started = time.perf_counter()
+        cutoff = "AND order_date < %s" if placed_before else ""
+        cutoff_params = [placed_before] if placed_before else []
+        after = None
+        while True:
+            # Walks idx_order_item_seller_date, whose entries end with the
+            # primary key, so the keyset needs no sort
+            seek = ""
+            params = []
+            if after:
+                order_date, order_id, product_id = after
+                seek = """AND (order_date > %s
+                          OR (order_date = %s AND order_id > %s)
+                          OR (order_date = %s AND order_id = %s AND product_id > %s))"""
+                params = [order_date, order_date, order_id,
+                          order_date, order_id, product_id]
+            with DatabaseConnection() as cursor:
+                cursor.execute(f"""
+                    SELECT order_date, order_id, product_id, customer_id
+                    FROM order_item
+                    WHERE seller_id = %s AND status = %s
+                    {cutoff}
+                    {seek}
+                    ORDER BY order_date, order_id, product_id
+                    LIMIT %s
+                """, (self.seller_id, from_status, *cutoff_params, *params,
+                      self.chunk_size))
+                lines = cursor.fetchall()
+            if not lines:
+                break
+            self._apply(lines)
+            last = lines[-1]
+            after = (last['order_date'], last['order_id'], last['product_id'])
+            if len(lines) < self.chunk_size:
+                break
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    def _apply(self, lines):
+        sources = ", ".join(["%s"] * len(self.sources))
+        for start in range(0, len(lines), self.chunk_size):
+            chunk = lines[start:start + self.chunk_size]
+            started = time.perf_counter()
+            with DatabaseConnection() as cursor:
+                if self.status == 'cancelled':
+                    # Lines up to the watermark are already in monthly_sales.
+                    # Read it before locking any line, the same order
+                    # refresh_monthly_sales takes its locks in
+                    cursor.execute("""
+                        SELECT high_water FROM aggregate_watermark
+                        WHERE name = 'monthly_sales'
+                        LOCK IN SHARE MODE
+                    """)
+                    mark = cursor.fetchone()
+                    high_water = mark['high_water'] if mark else None
+
+                    # Lock first: the restock must match exactly the lines
+                    # this chunk cancels
+                    cursor.execute(f"""
+                        SELECT order_date, order_id, product_id, customer_id,
+                               quantity, unit_price, subtotal
+                        FROM order_item
+                        WHERE (order_id, product_id, order_date) IN ({", ".join(["(%s, %s, %s)"] * len(chunk))})
+                        AND seller_id = %s AND status IN ({sources})
+                        ORDER BY order_id, product_id, order_date
+                        FOR UPDATE
+                    """, (*(v for line in chunk for v in self._key(line)),
+                          self.seller_id, *self.sources))
+                    chunk = cursor.fetchall()
+                    if not chunk:
+                        continue
+
+                # The full primary key lets each row go straight to its
+                # order_item partition
+                cursor.execute(f"""
+                    UPDATE order_item SET status = %s
+                    WHERE (order_id, product_id, order_date) IN ({", ".join(["(%s, %s, %s)"] * len(chunk))})
+                    AND seller_id = %s AND status IN ({sources})
+                """, (self.status,
+                      *(v for line in chunk for v in self._key(line)),
+                      self.seller_id, *self.sources))
+                updated = cursor.rowcount
+
+                scopes = [f"customer:{line['customer_id']}" for line in chunk]
+                if self.status == 'cancelled':
+                    self._restock(cursor, chunk)
+                    self._unroll_sales(cursor, chunk, high_water)
+                    scopes.append(f"seller:{self.seller_id}")
+                if updated:
+                    bump_data_versions(cursor, scopes)
+            self.updated += updated
+            self.chunks += 1
+            self.max_chunk_ms = max(self.max_chunk_ms,
+                                    (time.perf_counter() - started) * 1000)
+            if self.pause:
+                time.sleep(self.pause)
+
+    @staticmethod
+    def _key(line):
+        return line['order_id'], line['product_id'], line['order_date']
+
+    def _restock(self, cursor, lines):
+        quantities = {}
+        for line in lines:
+            quantities[line['product_id']] = \
+                quantities.get(line['product_id'], 0) + line['quantity']
+        product_ids = sorted(quantities)
+        placeholders = ", ".join(["%s"] * len(product_ids))
+
+        # Same primary-key lock order as checkout, so the two cannot deadlock
+        cursor.execute(f"""
+            SELECT product_id, stock_quantity, stock_slots FROM product
+            WHERE product_id IN ({placeholders})
+            ORDER BY product_id
+            FOR UPDATE
+        """, product_ids)
+        products = cursor.fetchall()
+        cold = [row['product_id'] for row in products if not row['stock_slots']]
+        hot = [row['product_id'] for row in products if row['stock_slots']]
+
+        if cold:
+            cases = " ".join(["WHEN %s THEN %s"] * len(cold))
+            cursor.execute(f"""
+                UPDATE product
+                SET stock_quantity = stock_quantity + CASE product_id {cases} END
+                WHERE product_id IN ({", ".join(["%s"] * len(cold))})
+            """, (*(v for pid in cold for v in (pid, quantities[pid])), *cold))
+            if any(row['stock_quantity'] <= 0 for row in products
+                   if not row['stock_slots']):
+                # The catalog shows whether a product is in stock
+                bump_catalog_version(cursor)
+                self.back_in_stock = True
+        if hot:
+            # Returned to the first sub-counter; the rebalancer spreads it
+            # and mirrors the total into product.stock_quantity
+            cases = " ".join(["WHEN %s THEN %s"] * len(hot))
+            cursor.execute(f"""
+                UPDATE product_stock_slot
+                SET quantity = quantity + CASE product_id {cases} END
+                WHERE slot = 0 AND product_id IN ({", ".join(["%s"] * len(hot))})
+            """, (*(v for pid in hot for v in (pid, quantities[pid])), *hot))
+            self.hot_restocked = True
+
+        for row in products:
+            product_id = row['product_id']
+            self.restocked[product_id] = \
+                self.restocked.get(product_id, 0) + quantities[product_id]
+
+    def _unroll_sales(self, cursor, lines, high_water):
+        # Rollup rows are locked in product order after the product rows,
+        # as checkout does
+        totals = {}
+        for line in lines:
+            total = totals.setdefault(line['product_id'], [0, 0, 0, 0])
+            total[0] += line['quantity']
+            total[1] += line['subtotal']
+            total[2] += line['unit_price']
+            total[3] += 1
+        product_ids = sorted(totals)
+        cases = " ".join(["WHEN %s THEN %s"] * len(product_ids))
+        params = []
+        for column in range(4):
+            params.extend(v for pid in product_ids
+                          for v in (pid, totals[pid][column]))
+        cursor.execute(f"""
+            UPDATE product_sales_rollup
+            SET total_quantity = total_quantity - CASE product_id {cases} END,
+                total_revenue = total_revenue - CASE product_id {cases} END,
+                unit_price_sum = unit_price_sum - CASE product_id {cases} END,
+                order_count = order_count - CASE product_id {cases} END
+            WHERE product_id IN ({", ".join(["%s"] * len(product_ids))})
+        """, (*params, *product_ids))
+
+        # An order leaves the seller's count with its last live line; the
+        # locking read sees lines other chunks have just cancelled
+        order_ids = sorted({line['order_id'] for line in lines})
+        placeholders = ", ".join(["%s"] * len(order_ids))
+        cursor.execute(f"""
+            SELECT DISTINCT order_id FROM order_item
+            WHERE seller_id = %s AND order_id IN ({placeholders})
+            AND status <> 'cancelled'
+            LOCK IN SHARE MODE
+        """, (self.seller_id, *order_ids))
+        emptied = len(order_ids) - len(cursor.fetchall())
+        if emptied:
+            cursor.execute("""
+                UPDATE seller_sales_rollup SET order_count = order_count - %s
+                WHERE seller_id = %s
+            """, (emptied, self.seller_id))
+
+        months = {}
+        for line in lines:
+            if high_water is None or line['order_date'] > high_water:
+                continue
+            key = (line['product_id'], line['order_date'].strftime('%Y-%m-01'))
+            month = months.setdefault(key, [0, 0, 0])
+            month[0] += 1
+            month[1] += line['quantity']
+            month[2] += line['subtotal']
+        if months:
+            params = []
+            for (product_id, month), (count, quantity, sales) in sorted(months.items()):
+                params.extend((self.seller_id, product_id, month,
+                               -count, -quantity, -sales))
+            cursor.execute(f"""
+                INSERT INTO monthly_sales (
+                    seller_id, product_id, month, order_count, total_quantity, total_sales
+                ) VALUES {", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(months))}
+                ON DUPLICATE KEY UPDATE
+                    order_count = order_count + VALUES(order_count),
+                    total_quantity = total_quantity + VALUES(total_quantity),
+                    total_sales = total_sales + VALUES(total_sales)
+            """, params)
+
+    def report(self):
+        return {
+            'status': self.status,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'chunks': self.chunks,
+            'restocked': self.restocked,
+            'restocked_units': sum(self.restocked.values()),
+            'max_chunk_ms': round(self.max_chunk_ms, 1),
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+            'lines_per_second': round(self.updated / self.elapsed, 1)
+            if self.elapsed else 0.0,
+        }
+
+# Order headers, time-partitioned order lines and their archive
+
+# order_item is range-partitioned by month. History pages read the last
+# ORDER_RECENT_MONTHS partitions first and only reach further back, or into
+# order_item_archive, when a page runs past them.
+ORDER_RECENT_MONTHS = int(os.getenv('ORDER_RECENT_MONTHS', 3))
+# archive-orders never moves orders younger than this, so history pages
+# newer than the horizon never have to look at the archive
+ORDER_ARCHIVE_MONTHS = int(os.getenv('ORDER_ARCHIVE_MONTHS', 12))
+ORDER_PARTITIONS_AHEAD = int(os.getenv('ORDER_PARTITIONS_AHEAD', 3))
+ORDER_ARCHIVE_BATCH = int(os.getenv('ORDER_ARCHIVE_BATCH', 500))
+ORDER_ARCHIVE_PAUSE = float(os.getenv('ORDER_ARCHIVE_PAUSE', 0.05))
+
+ORDER_LINE_COLUMNS = ("order_id, product_id, quantity, unit_price, subtotal, "
+                      "customer_id, seller_id, order_date, status")
+# Statuses an order line never leaves
+FINAL_ORDER_STATUSES = tuple(status for status, targets
+                             in ORDER_STATUS_TRANSITIONS.items() if not targets)
+
+
+def month_start(months_back=0, now=None):
+    """Midnight on the first of the month months_back months before now.
+
+    History tiers start on these boundaries so each one covers whole
+    order_item partitions. Negative values count months ahead.
+    """
+    now = now or datetime.now()
+    month = now.year * 12 + now.month - 1 - months_back
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def order_lines_union(where=None):
+    """Derived table of live and archived order lines.
+
+    The condition is repeated inside both branches so each table is
+    filtered through its own indexes; callers pass its parameters twice.
+    """
+    condition = f"WHERE {where}" if where else ""
+    return f"""(
+        SELECT {ORDER_LINE_COLUMNS} FROM order_item {condition}
+        UNION ALL
+        SELECT {ORDER_LINE_COLUMNS} FROM order_item_archive {condition}
+    )"""
+
+
+ALL_ORDER_LINES = order_lines_union()
+# What the rollups and monthly_sales count: cancelling takes a line out
+SOLD_ORDER_LINES = order_lines_union("status <> 'cancelled'")
+
+
+def customer_order_history(cursor, customer_id, after, size):
+    """One page of a customer's order lines, newest first.
+
+    after is the (order_date, order_id, product_id) of the previous page's
+    last line. Most pages are answered from the recent partitions alone;
+    older partitions and the archive are read only when the page runs past
+    the recent window and the customer's order headers show there is
+    something there. Returns (lines, next_cursor).
+    """
+    recent = month_start(ORDER_RECENT_MONTHS)
+    horizon = month_start(ORDER_ARCHIVE_MONTHS)
+    seek = ""
+    seek_params = []
+    after_date = None
+    if after:
+        try:
+            after_date = datetime.fromisoformat(str(after[0]))
+        except ValueError:
+            after = None
+    if after:
+        order_date, order_id, product_id = after
+        seek = """AND (oi.order_date < %s
+                  OR (oi.order_date = %s AND oi.order_id < %s)
+                  OR (oi.order_date = %s AND oi.order_id = %s AND oi.product_id < %s))"""
+        seek_params = [order_date, order_date, order_id,
+                       order_date, order_id, product_id]
+    limit = size + 1
+
+    def read(table, window="", window_params=()):
+        cursor.execute(f"""
+            SELECT
+                oi.order_id, oi.product_id, oi.quantity, oi.unit_price,
+                oi.subtotal, oi.customer_id, oi.seller_id, oi.order_date,
+                oi.status,
+                p.name as product_name,
+                s.company_name as seller_name
+            FROM {table} oi
+            JOIN product p ON oi.product_id = p.product_id
+            JOIN seller s ON oi.seller_id = s.seller_id
+            WHERE oi.customer_id = %s
+            {window}
+            {seek}
+            ORDER BY oi.order_date DESC, oi.order_id DESC, oi.product_id DESC
+            LIMIT %s
+        """, (customer_id, *window_params, *seek_params, limit))
+        return cursor.fetchall()
+
+    lines = []
+    if after_date is None or after_date >= recent:
+        lines = read('order_item', "AND oi.order_date >= %s", (recent,))
+    if len(lines) < limit:
+        # One probe of the headers decides which older tiers hold anything
+        cursor.execute("""
+            SELECT EXISTS (
+                       SELECT 1 FROM orders
+                       WHERE customer_id = %s AND archived = 0 AND order_date < %s
+                   ) as older,
+                   EXISTS (
+                       SELECT 1 FROM orders
+                       WHERE customer_id = %s AND archived = 1
+                   ) as archived
+        """, (customer_id, recent, customer_id))
+        tiers = cursor.fetchone()
+        if tiers['older']:
+            lines += read('order_item', "AND oi.order_date < %s", (recent,))
+        # Archived lines all predate the horizon, but old lines that were
+        # never delivered stay in order_item, so the two are merged
+        if tiers['archived'] and (len(lines) < limit
+                                  or lines[-1]['order_date'] < horizon):
+            lines += read('order_item_archive')
+            lines.sort(key=lambda line: (line['order_date'], line['order_id'],
+                                         line['product_id']), reverse=True)
+    return keyset_page(lines[:limit], size,
+                       ('order_date', 'order_id', 'product_id'))
+
+
+def order_item_partitions(cursor):
+    """order_item's partitions in order, with each one's exclusive upper bound
+    (None for MAXVALUE). Empty when the table is not partitioned."""
+    cursor.execute("""
+        SELECT PARTITION_NAME as name,
+               IF(PARTITION_DESCRIPTION = 'MAXVALUE', NULL,
+                  FROM_UNIXTIME(PARTITION_DESCRIPTION)) as upper_bound
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'order_item'
+        AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    return cursor.fetchall()
+
+
+def ensure_order_partitions(cursor, ahead=ORDER_PARTITIONS_AHEAD):
+    """Split monthly partitions off the MAXVALUE catch-all until the current
+    month and the next `ahead` months each have their own.
+
+    A table that still has only the catch-all first gets one partition for
+    everything older than the archive horizon. Partitions are never
+    hardcoded in the schema, so this runs on every migrate and archive
+    run. Returns the names of the partitions added.
+    """
+    partitions = order_item_partitions(cursor)
+    if not partitions or partitions[-1]['upper_bound'] is not None:
+        return []
+    catch_all = partitions[-1]['name']
+    bounded = [p['upper_bound'] for p in partitions if p['upper_bound']]
+    target = month_start(-(ahead + 1))
+
+    added = []
+    definitions = []
+    if bounded:
+        upper = max(bounded)
+    else:
+        upper = month_start(ORDER_ARCHIVE_MONTHS)
+        added.append('p_history')
+        definitions.append(
+            f"PARTITION p_history VALUES LESS THAN "
+            f"(UNIX_TIMESTAMP('{upper:%Y-%m-%d %H:%M:%S}'))")
+    while upper < target:
+        name = f"p{upper:%Y%m}"
+        upper = month_start(-1, now=upper)
+        added.append(name)
+        definitions.append(
+            f"PARTITION {name} VALUES LESS THAN "
+            f"(UNIX_TIMESTAMP('{upper:%Y-%m-%d %H:%M:%S}'))")
+    if definitions:
+        cursor.execute(f"""
+            ALTER TABLE order_item REORGANIZE PARTITION {catch_all} INTO (
+                {", ".join(definitions)},
+                PARTITION {catch_all} VALUES LESS THAN MAXVALUE
+            )
+        """)
+    return added
+
+
+def drop_empty_order_partitions(cursor, before):
+    """Drop monthly partitions entirely older than `before` that hold no
+    lines any more. The first partition, which catches everything older
+    than the monthly ones, is always kept. Returns the dropped names."""
+    dropped = []
+    for partition in order_item_partitions(cursor)[1:]:
+        if partition['upper_bound'] is None or partition['upper_bound'] > before:
+            break
+        cursor.execute(
+            f"SELECT 1 FROM order_item PARTITION ({partition['name']}) LIMIT 1")
+        if cursor.fetchall():
+            continue
+        cursor.execute(f"ALTER TABLE order_item DROP PARTITION {partition['name']}")
+        dropped.append(partition['name'])
+    return dropped
+
+
+class OrderArchiver:
+    """Moves settled orders older than a cutoff into order_item_archive.
+
+    Candidates come from the orders headers in (order_date, order_id) order.
+    An order qualifies once every line has reached a final status, delivered
+    or cancelled, so fully cancelled orders leave too instead of being
+    rescanned every run. Final lines never change again, so the move needs
+    no locks beyond the rows it writes. Each batch copies the lines
+    to the archive, deletes them from order_item and flags the headers in
+    one short transaction. Afterwards monthly partitions are added ahead of
+    time and emptied old ones are dropped. Like the inventory sweep, a
+    MySQL named lock keeps concurrent runs apart.
+    """
+
+    LOCK_NAME = 'pharmacy_order_archive'
+
+    def __init__(self, months=ORDER_ARCHIVE_MONTHS,
+                 batch_size=ORDER_ARCHIVE_BATCH, pause=ORDER_ARCHIVE_PAUSE):
+        self.months = max(months, ORDER_ARCHIVE_MONTHS)
+        self.batch_size = max(1, batch_size)
+        self.pause = pause
+
+    def run_once(self):
+        """Archive every qualifying order once.
+
+        Returns the run stats, or None if another archiver holds the lock.
+        """
+        # A dedicated connection: a run must not hold a request pool slot
+        conn = mysql.connector.connect(**dbconfig)
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT GET_LOCK(%s, 0) as locked", (self.LOCK_NAME,))
+            if not cursor.fetchone()['locked']:
+                return None
+            return self._archive(conn, cursor)
+        finally:
+            # Closing the session also releases the named lock
+            conn.close()
+
+    def _archive(self, conn, cursor):
+        started = time.perf_counter()
+        cutoff = month_start(self.months)
+        stats = {'cutoff': cutoff.date().isoformat(), 'orders_scanned': 0,
+                 'orders_archived': 0, 'lines_archived': 0, 'batches': 0}
+        stats['partitions_added'] = ensure_order_partitions(cursor)
+
+        final = ", ".join(["%s"] * len(FINAL_ORDER_STATUSES))
+        after = None
+        while True:
+            seek = ""
+            params = []
+            if after:
+                seek = "AND (order_date > %s OR (order_date = %s AND order_id > %s))"
+                params = [after[0], *after]
+            cursor.execute(f"""
+                SELECT order_id, order_date FROM orders
+                WHERE archived = 0 AND order_date < %s
+                {seek}
+                ORDER BY order_date, order_id
+                LIMIT %s
+            """, (cutoff, *params, self.batch_size))
+            headers = cursor.fetchall()
+            if not headers:
+                break
+
+            order_ids = [header['order_id'] for header in headers]
+            placeholders = ", ".join(["%s"] * len(order_ids))
+            # Lines are matched by order id alone: a line written after its
+            # header's date must move with the rest of the order
+            cursor.execute(f"""
+                SELECT order_id FROM order_item
+                WHERE order_id IN ({placeholders})
+                GROUP BY order_id
+                HAVING SUM(status NOT IN ({final})) = 0
+            """, (*order_ids, *FINAL_ORDER_STATUSES))
+            eligible = [row['order_id'] for row in cursor.fetchall()]
+            if eligible:
+                placeholders = ", ".join(["%s"] * len(eligible))
+                cursor.execute(f"""
+                    INSERT INTO order_item_archive ({ORDER_LINE_COLUMNS})
+                    SELECT {ORDER_LINE_COLUMNS} FROM order_item
+                    WHERE order_id IN ({placeholders})
+                """, eligible)
+                cursor.execute(
+                    f"DELETE FROM order_item WHERE order_id IN ({placeholders})",
+                    eligible)
+                stats['lines_archived'] += cursor.rowcount
+                cursor.execute(
+                    f"UPDATE orders SET archived = 1 WHERE order_id IN ({placeholders})",
+                    eligible)
+                conn.commit()
+
+            stats['orders_scanned'] += len(headers)
+            stats['orders_archived'] += len(eligible)
+            stats['batches'] += 1
+            after = (headers[-1]['order_date'], headers[-1]['order_id'])
+            if len(headers) < self.batch_size:
+                break
+            time.sleep(self.pause)
+
+        stats['partitions_dropped'] = drop_empty_order_partitions(cursor, cutoff)
+        stats['duration_ms'] = int((time.perf_counter() - started) * 1000)
+        return stats
+
+# Incrementally refreshed monthly sales aggregate backing /analytics
+
+# Order lines younger than this are left for the next refresh so that rows
+# from still-open checkout transactions are never skipped by the watermark
+ANALYTICS_SETTLE_SECONDS = int(os.getenv('ANALYTICS_SETTLE_SECONDS', 60))
+ANALYTICS_REFRESH_INTERVAL = int(os.getenv('ANALYTICS_REFRESH_INTERVAL', 300))
+
+
+def refresh_monthly_sales(cursor):
+    """Fold order lines newer than the stored watermark into monthly_sales.
+
+    Only the (watermark, now - settle] window is aggregated, so the cost of
+    a refresh depends on new orders, not on the size of the order history.
+    Cancelled lines are skipped; cancelling one already folded in takes it
+    back out (see OrderStatusUpdate).
+    Returns the number of aggregate rows touched.
+    """
+    cursor.execute("""
+        SELECT high_water, NOW() - INTERVAL %s SECOND as upper_bound
+        FROM aggregate_watermark
+        WHERE name = 'monthly_sales'
+        FOR UPDATE
+    """, (ANALYTICS_SETTLE_SECONDS,))
+    mark = cursor.fetchone()
+    if not mark:
+        cursor.execute("""
+            INSERT INTO aggregate_watermark (name, high_water)
+            VALUES ('monthly_sales', NULL)
+        """)
+        return refresh_monthly_sales(cursor)
+
+    lower, upper = mark['high_water'], mark['upper_bound']
+    if lower is not None and lower >= upper:
+        return 0
+
+    window = "oi.order_date <= %s AND oi.status <> 'cancelled'"
+    params = [upper]
+    # The first refresh also folds in lines archive-orders has moved out
+    source = ALL_ORDER_LINES
+    if lower is not None:
+        window = "oi.order_date > %s AND " + window
+        params.insert(0, lower)
+        source = "order_item"
+
+    cursor.execute(f"""
+        INSERT INTO monthly_sales (
+            seller_id, product_id, month, order_count, total_quantity, total_sales
+        )
+        SELECT oi.seller_id, oi.product_id,
+               DATE_FORMAT(oi.order_date, '%%Y-%%m-01') as month,
+               COUNT(*), SUM(oi.quantity), SUM(oi.subtotal)
+        FROM {source} oi
+        WHERE {window}
+        GROUP BY oi.seller_id, oi.product_id, month
+        ON DUPLICATE KEY UPDATE
+            order_count = order_count + VALUES(order_count),
+            total_quantity = total_quantity + VALUES(total_quantity),
+            total_sales = total_sales + VALUES(total_sales)
+    """, params)
+    touched = cursor.rowcount
+
+    cursor.execute("""
+        UPDATE aggregate_watermark SET high_water = %s
+        WHERE name = 'monthly_sales'
+    """, (upper,))
+    return touched
+
+
+def rebuild_monthly_sales(cursor):
+    """Empty monthly_sales and fold every order line in again.
+
+    For bulk loads: lines inserted behind the watermark are never picked up
+    by an incremental refresh. Returns the number of aggregate rows written.
+    """
+    # The watermark row first, as refresh_monthly_sales locks it
+    cursor.execute("""
+        UPDATE aggregate_watermark SET high_water = NULL
+        WHERE name = 'monthly_sales'
+    """)
+    cursor.execute("DELETE FROM monthly_sales")
+    return refresh_monthly_sales(cursor)
+
+
+MONTHLY_SALES_LOCK = 'pharmacy_monthly_sales'
+
+
+def try_refresh_monthly_sales():
+    """Run refresh_monthly_sales in its own transaction unless another
+    session is already refreshing.
+
+    Returns the number of aggregate rows touched, or None if skipped, so
+    concurrent refresh-analytics runs never queue behind the watermark row
+    lock.
+    """
+    # The lock lives on its own session and is held until the refresh has
+    # committed, so the next caller never waits on the FOR UPDATE
+    conn = mysql.connector.connect(**dbconfig)
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT GET_LOCK(%s, 0) as locked", (MONTHLY_SALES_LOCK,))
+        if not cursor.fetchone()['locked']:
+            return None
+        with DatabaseConnection() as cursor:
+            return refresh_monthly_sales(cursor)
+    finally:
+        # Closing the session also releases the named lock
+        conn.close()
+
+
+# Inventory alerts swept into inventory_alert by a background worker
+
+INVENTORY_SWEEP_BATCH = int(os.getenv('INVENTORY_SWEEP_BATCH', 1000))
+INVENTORY_SWEEP_PAUSE = float(os.getenv('INVENTORY_SWEEP_PAUSE', 0.05))
+INVENTORY_SWEEP_INTERVAL = int(os.getenv('INVENTORY_SWEEP_INTERVAL', 300))
+EXPIRY_ALERT_DAYS = int(os.getenv('EXPIRY_ALERT_DAYS', 30))
+
+
+def product_alerts(product, expiry_horizon):
+    """Alert kinds raised by one product row."""
+    kinds = []
+    if product['stock_quantity'] <= 0:
+        kinds.append('out_of_stock')
+    elif product['min_stock_level'] is not None and \
+            product['stock_quantity'] <= product['min_stock_level']:
+        kinds.append('low_stock')
+    if product['exp_date'] <= expiry_horizon:
+        kinds.append('expiring')
+    return kinds
+
+
+class InventorySweeper:
+    """Walks product in primary-key order and mirrors its alerts.
+
+    Each batch is a short transaction: alerts of the batch's key range are
+    upserted with the current sweep id, and alerts left over from an older
+    sweep in that range are resolved (deleted). A MySQL named lock keeps
+    concurrent sweepers, e.g. one per host, from doing the work twice.
+    """
+
+    LOCK_NAME = 'pharmacy_inventory_sweep'
+
+    def __init__(self, batch_size=INVENTORY_SWEEP_BATCH,
+                 pause=INVENTORY_SWEEP_PAUSE, expiry_days=EXPIRY_ALERT_DAYS):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.expiry_days = expiry_days
+
+    def run_once(self):
+        """Sweep the whole catalog once.
+
+        Returns the sweep stats, or None if another sweeper holds the lock.
+        """
+        # A dedicated connection: a sweep must not hold a request pool slot
+        conn = mysql.connector.connect(**dbconfig)
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT GET_LOCK(%s, 0) as locked", (self.LOCK_NAME,))
+            if not cursor.fetchone()['locked']:
+                return None
+            return self._sweep(conn, cursor)
+        finally:
+            # Closing the session also releases the named lock
+            conn.close()
+
+    def _sweep(self, conn, cursor):
+        started = time.perf_counter()
+        cursor.execute("""
+            UPDATE inventory_sweep SET sweep_id = sweep_id + 1
+            WHERE name = 'inventory_alert'
+        """)
+        cursor.execute("""
+            SELECT sweep_id, NOW() as started_at,
+                   CURDATE() + INTERVAL %s DAY as expiry_horizon
+            FROM inventory_sweep
+            WHERE name = 'inventory_alert'
+        """, (self.expiry_days,))
+        state = cursor.fetchone()
+        conn.commit()
+        sweep_id = state['sweep_id']
+
+        stats = {'products_scanned': 0, 'batches': 0,
+                 'low_stock': 0, 'out_of_stock': 0, 'expiring': 0}
+        last_id = ''
+        while True:
+            cursor.execute("""
+                SELECT product_id, seller_id, name, stock_quantity,
+                       min_stock_level, exp_date
+                FROM product
+                WHERE product_id > %s
+                ORDER BY product_id
+                LIMIT %s
+            """, (last_id, self.batch_size))
+            products = cursor.fetchall()
+            if not products:
+                break
+
+            params = []
+            for product in products:
+                for kind in product_alerts(product, state['expiry_horizon']):
+                    stats[kind] += 1
+                    params.extend((
+                        product['product_id'], kind, product['seller_id'],
+                        product['name'], product['stock_quantity'],
+                        product['min_stock_level'] or 0, product['exp_date'],
+                        sweep_id))
+            if params:
+                values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * (len(params) // 8))
+                cursor.execute(f"""
+                    INSERT INTO inventory_alert (
+                        product_id, kind, seller_id, name, stock_quantity,
+                        min_stock_level, exp_date, sweep_id
+                    ) VALUES {values}
+                    ON DUPLICATE KEY UPDATE
+                        seller_id = VALUES(seller_id),
+                        name = VALUES(name),
+                        stock_quantity = VALUES(stock_quantity),
+                        min_stock_level = VALUES(min_stock_level),
+                        exp_date = VALUES(exp_date),
+                        sweep_id = VALUES(sweep_id)
+                """, params)
+
+            # Alerts in this key range not raised again have been resolved
+            cursor.execute("""
+                DELETE FROM inventory_alert
+                WHERE product_id > %s AND product_id <= %s AND sweep_id <> %s
+            """, (last_id, products[-1]['product_id'], sweep_id))
+            conn.commit()
+
+            stats['products_scanned'] += len(products)
+            stats['batches'] += 1
+            last_id = products[-1]['product_id']
+            if len(products) < self.batch_size:
+                break
+            time.sleep(self.pause)
+
+        stats['duration_ms'] = int((time.perf_counter() - started) * 1000)
+        cursor.execute("""
+            UPDATE inventory_sweep
+            SET started_at = %s, finished_at = NOW(), duration_ms = %s,
+                products_scanned = %s, batches = %s,
+                low_stock = %s, out_of_stock = %s, expiring = %s
+            WHERE name = 'inventory_alert'
+        """, (state['started_at'], stats['duration_ms'],
+              stats['products_scanned'], stats['batches'], stats['low_stock'],
+              stats['out_of_stock'], stats['expiring']))
+        conn.commit()
+        return stats
+
+    def run_forever(self, interval=INVENTORY_SWEEP_INTERVAL):
+        while True:
+            try:
+                stats = self.run_once()
+                if stats is None:
+                    logger.info("Inventory sweep skipped: another sweeper is running")
+                else:
+                    logger.info(f"Inventory sweep: {stats}")
+            except Exception as e:
+                logger.error(f"Inventory sweep failed: {e}")
+            time.sleep(interval)
+
+
+# Keyset pagination helpers
+
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 30))
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 20))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 200))
+
+
+def encode_cursor(values):
+    """Pack the sort key of the last row on a page into an opaque token."""
+    raw = json.dumps(values, default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(token, width):
+    """Unpack a cursor token; anything malformed restarts from page one."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != width:
+        return None
+    return values
+
+
+def page_size(arg, default):
+    try:
+        size = int(request.args.get(arg, default))
+    except ValueError:
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_page(rows, size, key):
+    """Trim a LIMIT size + 1 result and return (page, next_cursor)."""
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor([rows[-1][k] for k in key])
+
+
+# Product search and autocomplete backed by MySQL FULLTEXT indexes
+
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_OFFSET = int(os.getenv('SEARCH_MAX_OFFSET', 1000))
+SEARCH_MAX_TERMS = 8
+# innodb_ft_min_token_size of the server
+FULLTEXT_MIN_TOKEN = int(os.getenv('FULLTEXT_MIN_TOKEN', 3))
+# A hit in the product name counts this many times a hit elsewhere
+SEARCH_NAME_WEIGHT = 3
+AUTOCOMPLETE_LIMIT = int(os.getenv('AUTOCOMPLETE_LIMIT', 10))
+AUTOCOMPLETE_MIN_CHARS = 2
+# Word-inside-name suggestions are ranked among this many FULLTEXT matches
+AUTOCOMPLETE_CANDIDATES = 200
+PRODUCT_STATUSES = ('available', 'low_stock', 'out_of_stock')
+
+
+class SearchError(ValueError):
+    """Raised for unusable search parameters (bad price, unknown status)."""
+
+
+def search_terms(text):
+    """Split free text into at most SEARCH_MAX_TERMS lowercase words."""
+    return re.findall(r'\w+', (text or '').lower())[:SEARCH_MAX_TERMS]
+
+
+def fulltext_query(terms):
+    # Every word is required and matched as a prefix, so results narrow as
+    # the user types; boolean operators never survive search_terms. Words
+    # shorter than FULLTEXT_MIN_TOKEN are not indexed whole ("d3" in
+    # "Vitamin D3"), so next to other words they only add to the score.
+    if len(terms) == 1:
+        return f"+{terms[0]}*"
+    return " ".join(f"+{term}*" if len(term) >= FULLTEXT_MIN_TOKEN else f"{term}*"
+                    for term in terms)
+
+
+def search_filters(args):
+    """Read seller_id, status and price range filters from request args."""
+    filters = {'seller_id': args.get('seller_id') or None,
+               'status': args.get('status', 'available')}
+    if filters['status'] == 'any':
+        filters['status'] = None
+    elif filters['status'] not in PRODUCT_STATUSES:
+        raise SearchError(f"Unknown status {filters['status']}")
+    for name in ('min_price', 'max_price'):
+        value = args.get(name)
+        try:
+            filters[name] = Decimal(value) if value else None
+        except InvalidOperation:
+            raise SearchError(f"Invalid {name}")
+    return filters
+
+
+def search_offset(token):
+    """Offset of a ranked result page; relevance order has no keyset."""
+    values = decode_cursor(token, 1)
+    if not values or not isinstance(values[0], int) or values[0] < 0:
+        return 0
+    return values[0]
+
+
+def search_products(cursor, text, seller_id=None, status='available',
+                    min_price=None, max_price=None, in_stock=False,
+                    limit=SEARCH_PAGE_SIZE, offset=0):
+    """Return products matching every word of text, most relevant first."""
+    terms = search_terms(text)
+    if not terms:
+        return []
+    query = fulltext_query(terms)
+
+    filters = []
+    params = []
+    if seller_id:
+        filters.append("AND p.seller_id = %s")
+        params.append(seller_id)
+    if status:
+        filters.append("AND p.status = %s")
+        params.append(status)
+    if min_price is not None:
+        filters.append("AND p.unit_price >= %s")
+        params.append(min_price)
+    if max_price is not None:
+        filters.append("AND p.unit_price <= %s")
+        params.append(max_price)
+    if in_stock:
+        filters.append("AND p.stock_quantity > 0")
+
+    cursor.execute(f"""
+        SELECT p.product_id, p.seller_id, p.name, p.description,
+               p.manufacturer, p.exp_date, p.unit_price, p.stock_quantity,
+               p.status, s.company_name as seller_name,
+               MATCH(p.name) AGAINST (%s IN BOOLEAN MODE) * {SEARCH_NAME_WEIGHT}
+               + MATCH(p.name, p.description, p.manufacturer)
+                 AGAINST (%s IN BOOLEAN MODE) as score
+        FROM product p
+        JOIN seller s ON p.seller_id = s.seller_id
+        WHERE MATCH(p.name, p.description, p.manufacturer)
+              AGAINST (%s IN BOOLEAN MODE)
+        {" ".join(filters)}
+        ORDER BY score DESC, p.product_id
+        LIMIT %s OFFSET %s
+    """, (query, query, query, *params, limit, offset))
+    return cursor.fetchall()
+
+
+def autocomplete_names(cursor, text, seller_id=None, limit=AUTOCOMPLETE_LIMIT):
+    """Suggest distinct names of available products for a partial query.
+
+    Names starting with the text come straight off the (status, name) or
+    (seller_id, LOWER(name)) index. Only if that leaves room are names with
+    a later word starting with the text looked up through FULLTEXT.
+    """
+    prefix = " ".join((text or '').lower().split())
+    if len(prefix) < AUTOCOMPLETE_MIN_CHARS:
+        return []
+    pattern = prefix.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_') + '%'
+
+    if seller_id:
+        cursor.execute("""
+            SELECT MIN(name) as name FROM product
+            WHERE seller_id = %s AND LOWER(name) LIKE %s
+            AND status = 'available'
+            GROUP BY LOWER(name)
+            ORDER BY LOWER(name)
+            LIMIT %s
+        """, (seller_id, pattern, limit))
+    else:
+        cursor.execute("""
+            SELECT DISTINCT name FROM product
+            WHERE status = 'available' AND name LIKE %s
+            ORDER BY name
+            LIMIT %s
+        """, (pattern, limit))
+    names = [row['name'] for row in cursor.fetchall()]
+
+    terms = search_terms(prefix)
+    if len(names) < limit and terms:
+        query = fulltext_query(terms)
+        seller_filter = "AND p.seller_id = %s" if seller_id else ""
+        cursor.execute(f"""
+            SELECT name, MAX(score) as score FROM (
+                SELECT p.name, MATCH(p.name) AGAINST (%s IN BOOLEAN MODE) as score
+                FROM product p
+                WHERE MATCH(p.name) AGAINST (%s IN BOOLEAN MODE)
+                AND p.status = 'available'
+                {seller_filter}
+                LIMIT %s
+            ) candidates
+            GROUP BY name
+            ORDER BY score DESC, name
+            LIMIT %s
+        """, (query, query, *([seller_id] if seller_id else []),
+              AUTOCOMPLETE_CANDIDATES, limit + len(names)))
+        seen = {name.lower() for name in names}
+        for row in cursor.fetchall():
+            if len(names) >= limit:
+                break
+            if row['name'].lower() not in seen:
+                seen.add(row['name'].lower())
+                names.append(row['name'])
+    return names
+
+
+# Versioned schema migrations
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def pending_migrations(cursor):
+    """Return (version, filename) for migrations not yet recorded."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    applied = {row['version'] for row in cursor.fetchall()}
+
+    pending = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not filename.endswith('.sql'):
+            continue
+        version = int(filename.split('_', 1)[0])
+        if version not in applied:
+            pending.append((version, filename))
+    return pending
+
+
+def split_sql(script):
+    # Migration files hold plain statements only (no DELIMITER blocks)
+    lines = [line for line in script.splitlines()
+             if not line.strip().startswith('--')]
+    return [stmt.strip() for stmt in "\n".join(lines).split(';')
+            if stmt.strip()]
+
+
+def apply_migrations(cursor):
+    """Apply pending migrations in version order, recording each one.
+
+    MySQL commits DDL implicitly, so every migration is recorded right after
+    its own statements succeed; a failure stops the run at that version.
+    """
+    applied = []
+    for version, filename in pending_migrations(cursor):
+        with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+            statements = split_sql(f.read())
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute("""
+            INSERT INTO schema_migrations (version, name) VALUES (%s, %s)
+        """, (version, filename))
+        cursor.execute("COMMIT")
+        logger.info(f"Applied migration {filename}")
+        applied.append(filename)
+    return applied
+
+
+# Streaming exports
+
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def stream_export(query, params, columns, fmt, filename):
+    """Stream a query result as CSV or JSON Lines in fetchmany chunks.
+
+    Rows come off an unbuffered cursor and are written out chunk by chunk,
+    so worker memory stays flat however large the export is. If the client
+    goes away mid-download the connection is dropped, not drained.
+    """
+    def generate():
+        with DatabaseConnection(read_only=True, buffered=False) as cursor:
+            cursor.execute(query, params)
+            if fmt == 'csv':
+                yield ",".join(columns) + "\r\n"
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                out = io.StringIO()
+                if fmt == 'csv':
+                    writer = csv.writer(out)
+                    writer.writerows([row[column] for column in columns]
+                                     for row in rows)
+                else:
+                    for row in rows:
+                        out.write(json.dumps(row, default=str))
+                        out.write("\n")
+                yield out.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'})
+
+
+# Concurrent fan-out of independent read queries
+
+DASHBOARD_WORKERS = int(os.getenv('DASHBOARD_WORKERS', 8))
+DASHBOARD_QUERY_TIMEOUT = float(os.getenv('DASHBOARD_QUERY_TIMEOUT', 2))
+
+
+def dashboard_workers():
+    """Fan-out threads per process, one fewer than the smallest pool reads
+    may use, so concurrent dashboards always leave a connection free for
+    every other request."""
+    pool_size = min(pool.size for pool in (connection_pool, replica_pool)
+                    if pool is not None)
+    return max(1, min(DASHBOARD_WORKERS, pool_size - 1))
+
+
+def _create_query_executor():
+    global query_executor
+    query_executor = ThreadPoolExecutor(
+        max_workers=dashboard_workers(), thread_name_prefix='read-query')
+
+
+# Threads do not survive fork, so every worker gets its own executor
+_create_query_executor()
+os.register_at_fork(after_in_child=_create_query_executor)
+
+
+def _run_read_query(query, params, fetch):
+    with DatabaseConnection(read_only=True) as cursor:
+        cursor.execute(query, params)
+        result = cursor.fetchone() if fetch == 'one' else cursor.fetchall()
+    # Each worker has its own g; hand the SQL cost back to the request
+    return result, g.get('db_queries', 0), g.get('db_seconds', 0.0), g.get('db_rows', 0)
+
+
+def run_read_queries(queries, timeout=DASHBOARD_QUERY_TIMEOUT):
+    """Run independent read queries concurrently on separate connections.
+
+    queries maps a name to (sql, params, 'one' | 'all'). Returns
+    (results, unavailable): a query that fails or misses the shared
+    deadline yields None (one) or [] (all) and its name is listed in
+    unavailable, so one slow query degrades a section, not the page.
+    """
+    futures = {
+        name: query_executor.submit(
+            copy_current_request_context(_run_read_query), *query)
+        for name, query in queries.items()
+    }
+    deadline = time.monotonic() + timeout
+    results = {}
+    unavailable = []
+    for name, future in futures.items():
+        try:
+            result, queries_run, db_seconds, rows = future.result(
+                timeout=max(0.0, deadline - time.monotonic()))
+            g.db_queries = g.get('db_queries', 0) + queries_run
+            g.db_seconds = g.get('db_seconds', 0.0) + db_seconds
+            g.db_rows = g.get('db_rows', 0) + rows
+            results[name] = result
+        except Exception as e:
+            # A timed-out query finishes in the background and then
+            # returns its connection to the pool
+            logger.error(f"Read query {name} failed: {e!r}")
+            future.cancel()
+            results[name] = None if queries[name][2] == 'one' else []
+            unavailable.append(name)
+    return results, unavailable
+
+
+# Role-based access control with multiple roles support
+
+
+def role_required(roles):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_user.is_authenticated:
+                flash('Please log in to access this page.', 'warning')
+                return redirect(url_for('login'))
+            if current_user.role not in roles:
+                flash('You do not have access to this page.', 'danger')
+                return redirect(url_for('home'))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+USER_TABLES = {
+    'seller': "SELECT email FROM seller WHERE seller_id = %s",
+    'customer': "SELECT email FROM customer WHERE customer_id = %s",
+}
+
+
+@login_manager.user_loader
+def load_user(identity):
+    user = user_cache.get(identity)
+    if user:
+        return user
+
+    role, sep, user_id = identity.partition(':')
+    if not sep:
+        # Sessions created before the role was encoded carry a bare id
+        roles, user_id = ['seller', 'customer'], identity
+    elif role in USER_TABLES:
+        roles = [role]
+    else:
+        return None
+    try:
+        with DatabaseConnection(read_only=True) as cursor:
+            for role in roles:
+                cursor.execute(USER_TABLES[role], (user_id,))
+                user_data = cursor.fetchone()
+                if user_data:
+                    user = User(user_id, user_data['email'], role)
+                    user_cache.put(identity, user)
+                    return user
+    except Exception as e:
+        logger.error(f"Error loading user: {e}")
+        return None
+
+# Enhanced error handling middleware
+
+
+@app.errorhandler(Exception)
+def handle_error(error):
+    logger.error(f"Unhandled error: {error}")
+    return render_template('500.html'), 500
+
+# Routes with improved validation and error handling
+
+
+def load_featured_products():
+    with DatabaseConnection(read_only=True) as cursor:
+        cursor.execute("""
+            SELECT p.*, s.company_name 
+            FROM product p 
+            JOIN seller s ON p.seller_id = s.seller_id 
+            WHERE p.status = 'available' 
+            LIMIT 10
+        """)
+        return cursor.fetchall()
+
+
+@app.route('/')
+def home():
+    try:
+        featured_products = featured_cache.get_or_refresh(
+            'featured_products', FEATURED_PRODUCTS_TTL, load_featured_products)
+        return render_template('home.html', featured_products=featured_products)
+    except Exception as e:
+        logger.error(f"Error loading home page: {e}")
+        return render_template('home.html')
+
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        user_id = request.form['user_id']
+        password = request.form['password']
+        role = request.form['role']
+
+        try:
+            # Only the lookup holds a pooled connection; the CPU-bound hash
+            # checks below run without one
+            with DatabaseConnection() as cursor:
+                if role == 'seller':
+                    cursor.execute(
+                        "SELECT * FROM seller WHERE seller_id = %s", (user_id,))
+                elif role == 'customer':
+                    cursor.execute(
+                        "SELECT * FROM customer WHERE customer_id = %s", (user_id,))
+                else:
+                    flash('Invalid role selected', 'error')
+                    return redirect(url_for('login'))
+                user_data = cursor.fetchone()
+
+            if user_data and password_hasher.verify(user_data['password'], password):
+                # Transparently upgrade hashes made with an older cost
+                if password_hasher.needs_rehash(user_data['password']):
+                    new_hash = password_hasher.hash(password)
+                    with DatabaseConnection() as cursor:
+                        cursor.execute(
+                            f"UPDATE {role} SET password = %s WHERE {role}_id = %s",
+                            (new_hash, user_id))
+                user = User(user_id, user_data['email'], role)
+                login_user(user)
+                flash('Login successful', 'success')
+                if role == 'seller':
+                    return redirect(url_for('seller_dashboard'))
+                elif role == 'customer':
+                    return redirect(url_for('customer_dashboard'))
+            else:
+                flash('Invalid user ID or password', 'error')
+                return redirect(url_for('login'))
+
+        except HashPoolBusy:
+            flash('The server is busy, please try again in a moment', 'error')
+            return redirect(url_for('login'))
+        except Exception as e:
+            logger.error(f"Login error: {e}")
+            flash('An error occurred during login', 'error')
+            return redirect(url_for('login'))
+
+    return render_template('login.html')
+
+
+@app.route('/register_seller', methods=['GET', 'POST'])
+def register_seller():
+    if request.method == 'POST':
+        try:
+            # Validate required fields
+            required_fields = ['seller_id', 'company_name',
+                               'license_number', 'email', 'phone', 'address', 'password']
+            if not all(request.form.get(field) for field in required_fields):
+                flash('All fields are required', 'error')
+                return render_template('register_seller.html')
+            if not valid_user_id(request.form['seller_id']):
+                flash(USER_ID_RULE, 'error')
+                return render_template('register_seller.html')
+
+            hashed_password = password_hasher.hash(request.form['password'])
+
+            with DatabaseConnection() as cursor:
+                # Check for existing email
+                cursor.execute(
+                    "SELECT 1 FROM seller WHERE email = %s", (request.form['email'],))
+                if cursor.fetchone():
+                    flash('Email already registered', 'error')
+                    return render_template('register_seller.html')
+
+                cursor.execute("""
+                    INSERT INTO seller (
+                        seller_id, password, company_name, license_number, 
+                        email, phone, address, status
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """, (
+                    request.form['seller_id'],
+                    hashed_password,
+                    request.form['company_name'],
+                    request.form['license_number'],
+                    request.form['email'],
+                    request.form['phone'],
+                    request.form['address'],
+                    request.form.get('status', 'active')
+                ))
+                user_cache.invalidate('seller', request.form['seller_id'])
+
+                flash('Registration successful', 'success')
+                return redirect(url_for('login'))
+
+        except Exception as e:
+            logger.error(f"Error registering seller: {e}")
+            flash('An error occurred during registration', 'error')
+            return render_template('register_seller.html')
+
+    return render_template('register_seller.html')
+
+
+@app.route('/register_customer', methods=['GET', 'POST'])
+def register_customer():
+    if request.method == 'POST':
+        try:
+            # Validate required fields
+            required_fields = ['customer_id', 'first_name',
+                               'last_name', 'email', 'phone', 'address', 'password']
+            if not all(request.form.get(field) for field in required_fields):
+                flash('All fields are required', 'error')
+                return render_template('register_customer.html')
+            if not valid_user_id(request.form['customer_id']):
+                flash(USER_ID_RULE, 'error')
+                return render_template('register_customer.html')
+
+            hashed_password = password_hasher.hash(request.form['password'])
+
+            with DatabaseConnection() as cursor:
+                # Check for existing email
+                cursor.execute(
+                    "SELECT 1 FROM customer WHERE email = %s", (request.form['email'],))
+                if cursor.fetchone():
+                    flash('Email already registered', 'error')
+                    return render_template('register_customer.html')
+
+                cursor.execute("""
+                    INSERT INTO customer (
+                        customer_id, password, first_name, last_name, 
                         email, phone, address, membership_level
                     ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 """, (
@@ -285,6 +3615,7 @@ def register_customer():
                     request.form['address'],
                     request.form.get('membership_level', 'basic')
                 ))
+                user_cache.invalidate('customer', request.form['customer_id'])
 
                 flash('Registration successful', 'success')
                 return redirect(url_for('login'))
@@ -308,97 +3639,109 @@ def dashboard():
 @role_required(['seller'])
 def seller_dashboard():
     try:
-        with DatabaseConnection() as cursor:
-            # Recent orders query
+        seller_id = current_user.id
+        # The dashboard body is a cached fragment keyed on the seller's data
+        # version and the last inventory sweep; the fan-out below only runs
+        # when it has to be re-rendered
+        with DatabaseConnection(read_only=True) as cursor:
+            version = load_data_version(cursor, f"seller:{seller_id}")
             cursor.execute("""
+                SELECT finished_at FROM inventory_sweep
+                WHERE name = 'inventory_alert'
+            """)
+            alerts_swept_at = cursor.fetchone()
+
+        queries = {
+            # Recent orders query
+            'recent_orders': ("""
                 SELECT oi.order_date, oi.product_id, p.name as product_name,
                        oi.quantity, oi.unit_price, oi.subtotal, oi.customer_id
                 FROM order_item oi
                 JOIN product p ON oi.product_id = p.product_id
-                WHERE p.seller_id = %s
+                WHERE oi.seller_id = %s AND oi.order_date >= %s
                 ORDER BY oi.order_date DESC
                 LIMIT 5
-            """, (current_user.id,))
-            recent_orders = cursor.fetchall()
-            logger.info(f"Recent orders: {recent_orders}")
+            """, (seller_id, month_start(ORDER_RECENT_MONTHS)), 'all'),
 
-            # Low stock products query
-            cursor.execute("""
-                SELECT product_id, name, stock_quantity, min_stock_level, status
-                FROM product
-                WHERE seller_id = %s AND stock_quantity <= min_stock_level
-            """, (current_user.id,))
-            low_stock_products = cursor.fetchall()
-            logger.info(f"Low stock products: {low_stock_products}")
+            # Stock and expiry alerts as of the last inventory sweep
+            'low_stock_products': ("""
+                SELECT product_id, name, stock_quantity, min_stock_level,
+                       kind as status
+                FROM inventory_alert
+                WHERE seller_id = %s AND kind IN ('low_stock', 'out_of_stock')
+                ORDER BY kind, exp_date
+            """, (seller_id,), 'all'),
+
+            'expiring_products': ("""
+                SELECT product_id, name, stock_quantity, exp_date
+                FROM inventory_alert
+                WHERE seller_id = %s AND kind = 'expiring'
+                ORDER BY exp_date
+            """, (seller_id,), 'all'),
 
             # Product stats query
-            cursor.execute("""
+            'product_stats': ("""
                 SELECT COUNT(*) as total_products,
                        SUM(CASE WHEN status = 'available' THEN 1 ELSE 0 END) as available_products,
                        SUM(CASE WHEN status = 'low_stock' THEN 1 ELSE 0 END) as low_stock_products,
                        SUM(CASE WHEN status = 'out_of_stock' THEN 1 ELSE 0 END) as out_of_stock_products
                 FROM product
                 WHERE seller_id = %s
-            """, (current_user.id,))
-            product_stats = cursor.fetchone()
-            logger.info(f"Product stats: {product_stats}")
+            """, (seller_id,), 'one'),
 
-            # Nested query: Get all products with sales above average
-            cursor.execute("""
-                SELECT p.*, 
-                    (SELECT COUNT(*) 
-                     FROM order_item oi 
-                     WHERE oi.product_id = p.product_id) as total_sales
-                FROM product p
-                WHERE (
-                    SELECT SUM(oi.quantity) 
-                    FROM order_item oi 
-                    WHERE oi.product_id = p.product_id
-                ) > (
-                    SELECT AVG(total_sold)
-                    FROM (
-                        SELECT product_id, SUM(quantity) as total_sold
-                        FROM order_item
-                        GROUP BY product_id
-                    ) as avg_sales
+            # Products with sales above average, read from the sales rollup
+            'products_above_average_sales': ("""
+                SELECT p.*, r.order_count as total_sales
+                FROM product_sales_rollup r
+                JOIN product p ON r.product_id = p.product_id
+                WHERE r.seller_id = %s
+                AND r.total_quantity > (
+                    SELECT AVG(total_quantity)
+                    FROM product_sales_rollup
                 )
-                AND p.seller_id = %s
-            """, (current_user.id,))
-            products_above_average_sales = cursor.fetchall()
-            logger.info(
-                f"Products above average sales: {products_above_average_sales}")
+            """, (seller_id,), 'all'),
 
-            # Aggregate query: Get sales summary by seller
-            cursor.execute("""
+            # Aggregate query: Get sales summary by seller from the rollups
+            'sales_summary': ("""
                 SELECT 
                     s.seller_id,
                     s.company_name,
-                    COUNT(DISTINCT oi.order_id) as total_orders,
-                    SUM(oi.quantity) as total_items_sold,
-                    SUM(oi.subtotal) as total_revenue,
-                    AVG(oi.unit_price) as average_unit_price
+                    COALESCE(sr.order_count, 0) as total_orders,
+                    SUM(r.total_quantity) as total_items_sold,
+                    SUM(r.total_revenue) as total_revenue,
+                    SUM(r.unit_price_sum) / NULLIF(SUM(r.order_count), 0) as average_unit_price
                 FROM seller s
-                LEFT JOIN order_item oi ON s.seller_id = oi.seller_id
+                LEFT JOIN seller_sales_rollup sr ON s.seller_id = sr.seller_id
+                LEFT JOIN product_sales_rollup r ON s.seller_id = r.seller_id
                 WHERE s.seller_id = %s
-                GROUP BY s.seller_id, s.company_name
-                ORDER BY total_revenue DESC
-            """, (current_user.id,))
-            sales_summary = cursor.fetchone()
+                GROUP BY s.seller_id, s.company_name, sr.order_count
+            """, (seller_id,), 'one'),
+        }
+
+        def load_sections():
+            results, unavailable = run_read_queries(queries)
 
             # Initialize default values if None
+            sales_summary = results['sales_summary']
             if sales_summary:
                 sales_summary['total_items_sold'] = sales_summary['total_items_sold'] or 0
                 sales_summary['total_revenue'] = sales_summary['total_revenue'] or 0.0
                 sales_summary['average_unit_price'] = sales_summary['average_unit_price'] or 0.0
 
-            logger.info(f"Sales summary: {sales_summary}")
+            if unavailable:
+                logger.warning(f"Seller dashboard sections unavailable: {unavailable}")
+                skip_fragment_cache()
+            results['unavailable'] = unavailable
+            return results
 
-            return render_template('seller_dashboard.html',
-                                   recent_orders=recent_orders,
-                                   low_stock_products=low_stock_products,
-                                   product_stats=product_stats,
-                                   products_above_average_sales=products_above_average_sales,
-                                   sales_summary=sales_summary)
+        sections = LazyResult(load_sections)
+        return render_template(
+            'seller_dashboard.html',
+            fragment_key=f"seller_dashboard:{seller_id}",
+            fragment_version=(version, alerts_swept_at and alerts_swept_at['finished_at']),
+            alerts_swept_at=alerts_swept_at,
+            **{name: LazyResult(lambda name=name: sections.get()[name])
+               for name in (*queries, 'unavailable')})
     except Exception as e:
         logger.error(f"Error loading seller dashboard: {e}")
         flash('Error loading dashboard', 'error')
@@ -410,17 +3753,17 @@ def seller_dashboard():
 @role_required(['customer'])
 def customer_dashboard():
     try:
-        with DatabaseConnection() as cursor:
+        with DatabaseConnection(read_only=True) as cursor:
             cursor.execute("""
                 SELECT oi.order_id, oi.product_id, oi.quantity, oi.unit_price, oi.subtotal, oi.customer_id, oi.seller_id, oi.order_date,
                        p.name as product_name, s.company_name as seller_name
                 FROM order_item oi
                 JOIN product p ON oi.product_id = p.product_id
                 JOIN seller s ON oi.seller_id = s.seller_id
-                WHERE oi.customer_id = %s
+                WHERE oi.customer_id = %s AND oi.order_date >= %s
                 ORDER BY oi.order_date DESC
                 LIMIT 5
-            """, (current_user.id,))
+            """, (current_user.id, month_start(ORDER_RECENT_MONTHS)))
             recent_orders = cursor.fetchall()
 
             return render_template('customer_dashboard.html', recent_orders=recent_orders)
@@ -435,123 +3778,86 @@ def customer_dashboard():
 @role_required(['seller'])
 def products():
     try:
-        with DatabaseConnection() as cursor:
+        with DatabaseConnection(read_only=request.method == 'GET') as cursor:
             if request.method == 'POST':
-                # Validate input data
-                required_fields = [
-                    'name', 'manufacturer', 'mfg_date', 'exp_date', 'unit_price', 'stock_quantity']
-                if not all(request.form.get(field) for field in required_fields):
-                    flash('All required fields must be filled', 'error')
+                try:
+                    product = validate_product(request.form)
+                except ProductValidationError as e:
+                    flash(str(e), 'error')
                     return redirect(url_for('products'))
 
-                try:
-                    # Validate dates
-                    mfg_date = datetime.strptime(
-                        request.form['mfg_date'], '%Y-%m-%d')
-                    exp_date = datetime.strptime(
-                        request.form['exp_date'], '%Y-%m-%d')
-
-                    # Ensure dates are not in the past and expiry is after manufacture
-                    current_date = datetime.now().date()
-                    if mfg_date.date() < current_date:
-                        flash('Manufacturing date cannot be in the past', 'error')
-                        return redirect(url_for('products'))
-
-                    if exp_date <= mfg_date:
-                        flash(
-                            'Expiration date must be after manufacturing date', 'error')
-                        return redirect(url_for('products'))
-
-                    # Validate numeric values
-                    unit_price = Decimal(request.form['unit_price'])
-                    stock_quantity = int(request.form['stock_quantity'])
-                    min_stock_level = int(
-                        request.form.get('min_stock_level', 10))
-
-                    if unit_price <= 0:
-                        flash('Unit price must be greater than 0', 'error')
-                        return redirect(url_for('products'))
-
-                    if stock_quantity < 0:
-                        flash('Stock quantity cannot be negative', 'error')
-                        return redirect(url_for('products'))
-
-                    if min_stock_level < 0:
-                        flash('Minimum stock level cannot be negative', 'error')
-                        return redirect(url_for('products'))
-
-                    # Generate product ID
-                    product_id = f"P{uuid.uuid4().hex[:19]}"
-
-                    # Determine initial status based on stock quantity
-                    status = 'out_of_stock' if stock_quantity == 0 else \
-                        'low_stock' if stock_quantity <= min_stock_level else \
-                        'available'
-
-                    # Check for duplicate product name for this seller
-                    cursor.execute("""
-                        SELECT 1 FROM product 
-                        WHERE seller_id = %s AND LOWER(name) = LOWER(%s)
-                    """, (current_user.id, request.form['name']))
+                # Generate product ID
+                product_id = id_generator.new_id('P')
 
-                    if cursor.fetchone():
-                        flash('A product with this name already exists', 'error')
-                        return redirect(url_for('products'))
+                # Check for duplicate product name for this seller
+                cursor.execute("""
+                    SELECT 1 FROM product 
+                    WHERE seller_id = %s AND LOWER(name) = LOWER(%s)
+                """, (current_user.id, product['name']))
 
-                    # Insert new product
-                    cursor.execute("""
-                        INSERT INTO product (
-                            product_id, seller_id, name, description,
-                            manufacturer, mfg_date, exp_date, unit_price,
-                            stock_quantity, min_stock_level, status, created_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                    """, (
-                        product_id, current_user.id, request.form['name'],
-                        request.form.get(
-                            'description', ''), request.form['manufacturer'],
-                        mfg_date, exp_date, unit_price, stock_quantity,
-                        min_stock_level, status
-                    ))
-
-                    flash('Product added successfully', 'success')
+                if cursor.fetchone():
+                    flash('A product with this name already exists', 'error')
                     return redirect(url_for('products'))
 
-                except ValueError as e:
-                    logger.error(f"Product validation error: {e}")
-                    flash('Invalid input values', 'error')
-                    return redirect(url_for('products'))
+                # Insert new product
+                cursor.execute("""
+                    INSERT INTO product (
+                        product_id, seller_id, name, description,
+                        manufacturer, mfg_date, exp_date, unit_price,
+                        stock_quantity, min_stock_level, status, created_at
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+                """, (
+                    product_id, current_user.id, product['name'],
+                    product['description'], product['manufacturer'],
+                    product['mfg_date'], product['exp_date'],
+                    product['unit_price'], product['stock_quantity'],
+                    product['min_stock_level'], product['status']
+                ))
+                bump_catalog_version(cursor)
+                bump_data_versions(cursor, [f"seller:{current_user.id}"])
 
-            # GET request - fetch and display products with sales metrics
-            cursor.execute("""
-                SELECT 
-                    p.*,
-                    COALESCE(SUM(oi.quantity), 0) as total_sold,
-                    COALESCE(SUM(oi.subtotal), 0) as total_revenue,
-                    COUNT(DISTINCT oi.order_id) as number_of_orders,
-                    MAX(oi.order_date) as last_ordered_date
-                FROM product p
-                LEFT JOIN order_item oi ON p.product_id = oi.product_id
-                WHERE p.seller_id = %s
-                GROUP BY p.product_id
-                ORDER BY p.created_at DESC
-            """, (current_user.id,))
-            products = cursor.fetchall()
+                catalog_changed()
+                flash('Product added successfully', 'success')
+                return redirect(url_for('products'))
 
-            # Get total product count
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_products,
-                    SUM(CASE WHEN status = 'available' THEN 1 ELSE 0 END) as available_products,
-                    SUM(CASE WHEN status = 'low_stock' THEN 1 ELSE 0 END) as low_stock_products,
-                    SUM(CASE WHEN status = 'out_of_stock' THEN 1 ELSE 0 END) as out_of_stock_products
-                FROM product
-                WHERE seller_id = %s
-            """, (current_user.id,))
-            product_stats = cursor.fetchone()
+            # GET request - the product table is a cached fragment keyed on
+            # the seller's data version; its queries run only on a miss
+            version = load_data_version(cursor, f"seller:{current_user.id}")
+
+            def load_products():
+                # Fetch and display products with sales metrics
+                cursor.execute("""
+                    SELECT 
+                        p.*,
+                        COALESCE(r.total_quantity, 0) as total_sold,
+                        COALESCE(r.total_revenue, 0) as total_revenue,
+                        COALESCE(r.order_count, 0) as number_of_orders,
+                        r.last_order_date as last_ordered_date
+                    FROM product p
+                    LEFT JOIN product_sales_rollup r ON p.product_id = r.product_id
+                    WHERE p.seller_id = %s
+                    ORDER BY p.created_at DESC
+                """, (current_user.id,))
+                return cursor.fetchall()
+
+            def load_product_stats():
+                # Get total product count
+                cursor.execute("""
+                    SELECT 
+                        COUNT(*) as total_products,
+                        SUM(CASE WHEN status = 'available' THEN 1 ELSE 0 END) as available_products,
+                        SUM(CASE WHEN status = 'low_stock' THEN 1 ELSE 0 END) as low_stock_products,
+                        SUM(CASE WHEN status = 'out_of_stock' THEN 1 ELSE 0 END) as out_of_stock_products
+                    FROM product
+                    WHERE seller_id = %s
+                """, (current_user.id,))
+                return cursor.fetchone()
 
             return render_template('products.html',
-                                   products=products,
-                                   product_stats=product_stats)
+                                   products=LazyResult(load_products),
+                                   product_stats=LazyResult(load_product_stats),
+                                   fragment_key=f"seller_products:{current_user.id}",
+                                   fragment_version=version)
 
     except Exception as e:
         logger.error(f"Error in products route: {e}")
@@ -559,6 +3865,32 @@ def products():
         return redirect(url_for('dashboard'))
 
 
+@app.route('/products/import', methods=['POST'])
+@login_required
+@role_required(['seller'])
+def import_products():
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    fmt = request.form.get('format') or (
+        'jsonl' if upload.filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': f"Unsupported format: {fmt}"}), 400
+
+    try:
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        report = ProductImporter(current_user.id).run(iter_product_rows(stream, fmt))
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'error': f"Could not read file: {e}"}), 400
+
+    catalog_changed()
+    logger.info(
+        f"Product import for {current_user.id}: {report['rows']} rows, "
+        f"{report['rows_per_second']} rows/s, {report['error_count']} errors")
+    return jsonify(report)
+
+
 @app.route('/update_product/<product_id>', methods=['POST'])
 @login_required
 @role_required(['seller'])
@@ -567,11 +3899,12 @@ def update_product(product_id):
         with DatabaseConnection() as cursor:
             # Verify product ownership
             cursor.execute("""
-                SELECT 1 FROM product 
+                SELECT stock_slots FROM product 
                 WHERE product_id = %s AND seller_id = %s
             """, (product_id, current_user.id))
 
-            if not cursor.fetchone():
+            product = cursor.fetchone()
+            if not product:
                 flash('Product not found or access denied', 'error')
                 return redirect(url_for('products'))
 
@@ -589,15 +3922,40 @@ def update_product(product_id):
                 updates['min_stock_level'] = int(
                     request.form['min_stock_level'])
 
-            if updates:
-                # Construct dynamic UPDATE query
-                query = "UPDATE product SET " + \
-                        ", ".join(f"{k} = %s" for k in updates.keys()) + \
-                        " WHERE product_id = %s AND seller_id = %s"
+            stock_slots = product['stock_slots']
+            if 'stock_slots' in request.form:
+                stock_slots = int(request.form['stock_slots'])
+                if not 0 <= stock_slots <= HOT_STOCK_MAX_SLOTS:
+                    raise ValueError('stock_slots out of range')
+            # Hot products keep their stock in sub-counters
+            hot_stock = updates.pop('stock_quantity', None) \
+                if stock_slots else None
+
+            if hot_stock is not None and hot_stock < 0:
+                raise ValueError('negative stock')
+
+            if updates or stock_slots != product['stock_slots'] or \
+                    hot_stock is not None:
+                # Switch modes first so a new stock level lands in the
+                # counter(s) of the mode the product ends up in
+                if stock_slots != product['stock_slots']:
+                    set_stock_slots(cursor, product_id, stock_slots)
+                if updates:
+                    # Construct dynamic UPDATE query
+                    query = "UPDATE product SET " + \
+                            ", ".join(f"{k} = %s" for k in updates.keys()) + \
+                            " WHERE product_id = %s AND seller_id = %s"
 
-                cursor.execute(query,
-                               (*updates.values(), product_id, current_user.id))
+                    cursor.execute(query,
+                                   (*updates.values(), product_id, current_user.id))
+                if hot_stock is not None:
+                    rebalance_hot_stock(cursor, product_id, total=hot_stock)
+                if stock_slots:
+                    stock_rebalancer.ensure_started()
+                bump_catalog_version(cursor)
+                bump_data_versions(cursor, [f"seller:{current_user.id}"])
 
+                catalog_changed()
                 flash('Product updated successfully', 'success')
             else:
                 flash('No changes to update', 'info')
@@ -619,16 +3977,35 @@ def update_product(product_id):
 def delete_product(product_id):
     try:
         with DatabaseConnection() as cursor:
-            # Verify product ownership and delete
+            # Verify product ownership and delete; the delete locks the
+            # product and its stock slots, so no checkout can add a line
+            # for it before the check below
             cursor.execute("""
                 DELETE FROM product 
                 WHERE product_id = %s AND seller_id = %s
             """, (product_id, current_user.id))
-
-            if cursor.rowcount > 0:
-                flash('Product deleted successfully', 'success')
-            else:
+            if cursor.rowcount == 0:
                 flash('Product not found or access denied', 'error')
+                return redirect(url_for('products'))
+
+            # order_item is partitioned and has no foreign key to product;
+            # sold products stay for the order history and exports
+            cursor.execute("""
+                SELECT EXISTS (
+                           SELECT 1 FROM order_item WHERE product_id = %s
+                       ) OR EXISTS (
+                           SELECT 1 FROM order_item_archive WHERE product_id = %s
+                       ) as sold
+            """, (product_id, product_id))
+            if cursor.fetchone()['sold']:
+                cursor.execute("ROLLBACK")
+                flash('Products with orders cannot be deleted; set their stock to 0 instead', 'error')
+                return redirect(url_for('products'))
+
+            bump_catalog_version(cursor)
+            bump_data_versions(cursor, [f"seller:{current_user.id}"])
+            catalog_changed()
+            flash('Product deleted successfully', 'success')
 
         return redirect(url_for('products'))
     except Exception as e:
@@ -637,44 +4014,398 @@ def delete_product(product_id):
         return redirect(url_for('products'))
 
 
+@app.route('/orders/status', methods=['POST'])
+@login_required
+@role_required(['seller'])
+def bulk_order_status():
+    """Move many of the seller's order lines to one status.
+
+    Takes a JSON body (or form fields) with status and either order_ids
+    (form: repeated order_id) or from_status plus an optional
+    placed_before datetime. Responds with a JSON report.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {
+            'status': request.form.get('status'),
+            'order_ids': request.form.getlist('order_id'),
+            'from_status': request.form.get('from_status'),
+            'placed_before': request.form.get('placed_before'),
+        }
+
+    try:
+        update = OrderStatusUpdate(current_user.id, data.get('status'))
+        order_ids = data.get('order_ids')
+        if order_ids:
+            if not isinstance(order_ids, list) or \
+                    not all(isinstance(order_id, str) for order_id in order_ids):
+                raise OrderStatusError('order_ids must be a list of order ids')
+            if len(order_ids) > BULK_STATUS_MAX_ORDERS:
+                raise OrderStatusError(
+                    f"At most {BULK_STATUS_MAX_ORDERS} orders per request")
+            run = lambda: update.run_for_orders(order_ids)
+        elif data.get('from_status'):
+            placed_before = data.get('placed_before')
+            placed_before = datetime.fromisoformat(placed_before) \
+                if placed_before else None
+            run = lambda: update.run_for_status(data['from_status'], placed_before)
+        else:
+            raise OrderStatusError('Give order_ids or from_status')
+    except (OrderStatusError, ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        report = run()
+    except OrderStatusError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        # Chunks already committed stay applied; report how far it got
+        logger.error(f"Bulk status update for {current_user.id} failed: {e}")
+        return jsonify({'error': 'Status update stopped early',
+                        **update.report()}), 500
+    finally:
+        if update.back_in_stock:
+            catalog_changed()
+        if update.hot_restocked:
+            stock_rebalancer.ensure_started()
+
+    logger.info(
+        f"Bulk status update for {current_user.id}: {report['updated']} lines "
+        f"to {report['status']} in {report['chunks']} chunks, "
+        f"max chunk {report['max_chunk_ms']} ms")
+    return jsonify(report)
+
+
 @app.route('/orders', methods=['GET'])
 @login_required
 @role_required(['customer'])
 def orders():
     try:
-        with DatabaseConnection() as cursor:
-            # Get available products with seller information
+        products_size = page_size('per_page', CATALOG_PAGE_SIZE)
+        history_size = page_size('history_per_page', HISTORY_PAGE_SIZE)
+        search = request.args.get('q', '').strip()
+        products_after = None if search else \
+            decode_cursor(request.args.get('products_after'), 2)
+        history_after = decode_cursor(request.args.get('history_after'), 3)
+
+        with DatabaseConnection(read_only=True) as cursor:
+            history_version = load_data_version(
+                cursor, f"customer:{current_user.id}")
+
+            if search:
+                # Ranked results page by offset, capped at SEARCH_MAX_OFFSET
+                offset = min(search_offset(request.args.get('products_after')),
+                             SEARCH_MAX_OFFSET)
+                products = search_products(
+                    cursor, search, in_stock=True,
+                    limit=products_size + 1, offset=offset)
+                next_products = None
+                if len(products) > products_size:
+                    products = products[:products_size]
+                    if offset + products_size <= SEARCH_MAX_OFFSET:
+                        next_products = encode_cursor([offset + products_size])
+            else:
+                # Get available products with seller information, seeking
+                # past the last (name, product_id) of the previous page
+                seek = ""
+                params = []
+                if products_after:
+                    seek = "AND (p.name > %s OR (p.name = %s AND p.product_id > %s))"
+                    params = [products_after[0], *products_after]
+                cursor.execute(f"""
+                    SELECT p.*, s.company_name as seller_name
+                    FROM product p
+                    JOIN seller s ON p.seller_id = s.seller_id
+                    WHERE p.status = 'available'
+                    AND p.stock_quantity > 0
+                    {seek}
+                    ORDER BY p.name, p.product_id
+                    LIMIT %s
+                """, (*params, products_size + 1))
+                products, next_products = keyset_page(
+                    cursor.fetchall(), products_size, ('name', 'product_id'))
+
+            def load_history():
+                # Get customer's order history, newest first; product_id
+                # breaks ties between lines of the same order
+                orders, next_page = customer_order_history(
+                    cursor, current_user.id, history_after, history_size)
+                return {'orders': orders, 'next_page': next_page}
+
+            # The history table and its links are a cached fragment per
+            # customer and history page, keyed on the customer's data
+            # version; the catalog's arguments are filled into the cached
+            # links afterwards, so searching and paging the catalog reuse it
+            history_key = hashlib.sha1(
+                request.args.get('history_after', '').encode()).hexdigest()[:16]
+            page_args = urllib.parse.urlencode({
+                name: request.args[name]
+                for name in ('q', 'products_after', 'per_page')
+                if request.args.get(name)})
+            return render_template('orders.html',
+                                   products=products,
+                                   search=search,
+                                   history=LazyResult(load_history),
+                                   history_fragment=f"order_history:{current_user.id}:{history_size}:{history_key}",
+                                   history_version=history_version,
+                                   history_size=history_size,
+                                   history_page_args=f"&{page_args}" if page_args else "",
+                                   next_products=next_products,
+                                   cart=priced_cart_items(
+                                       cursor, cart_store.items(current_user.id)))
+    except Exception as e:
+        logger.error(f"Error loading orders page: {e}")
+        flash('Error loading orders page', 'error')
+        return redirect(url_for('dashboard'))
+
+
+def _search_result(row):
+    return {
+        'product_id': row['product_id'],
+        'name': row['name'],
+        'description': row['description'],
+        'manufacturer': row['manufacturer'],
+        'seller_id': row['seller_id'],
+        'seller_name': row['seller_name'],
+        'unit_price': str(row['unit_price']),
+        'stock_quantity': row['stock_quantity'],
+        'status': row['status'],
+        'exp_date': row['exp_date'].isoformat(),
+        'score': round(float(row['score']), 4),
+    }
+
+
+@app.route('/products/search')
+@login_required
+def search_products_api():
+    try:
+        filters = search_filters(request.args)
+    except SearchError as e:
+        return jsonify({'error': str(e)}), 400
+    size = page_size('per_page', SEARCH_PAGE_SIZE)
+    offset = search_offset(request.args.get('after'))
+    if offset > SEARCH_MAX_OFFSET:
+        return jsonify({'error': 'Refine the query to see more results'}), 400
+
+    with DatabaseConnection(read_only=True) as cursor:
+        rows = search_products(cursor, request.args.get('q'), **filters,
+                               limit=size + 1, offset=offset)
+    next_page = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_page = encode_cursor([offset + size])
+    return jsonify({'query': request.args.get('q', ''),
+                    'results': [_search_result(row) for row in rows],
+                    'next': next_page})
+
+
+@app.route('/products/autocomplete')
+@login_required
+def autocomplete_products_api():
+    with DatabaseConnection(read_only=True) as cursor:
+        names = autocomplete_names(cursor, request.args.get('q'),
+                                   seller_id=request.args.get('seller_id'))
+    return jsonify({'query': request.args.get('q', ''), 'suggestions': names})
+
+
+def negotiate_encoding(accept_encodings):
+    """Pick br (when the brotli package is installed), gzip or identity."""
+    if brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return 'identity'
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def catalog_etag(version, params, encoding):
+    # Strong validator: one per catalog version, page and content coding,
+    # computable before any query runs
+    digest = hashlib.sha1(json.dumps(params).encode()).hexdigest()[:12]
+    return f"catalog-{version}-{digest}-{encoding}"
+
+
+def _catalog_item(row):
+    return {
+        'product_id': row['product_id'],
+        'name': row['name'],
+        'description': row['description'],
+        'manufacturer': row['manufacturer'],
+        'seller_id': row['seller_id'],
+        'seller_name': row['seller_name'],
+        'unit_price': str(row['unit_price']),
+        'exp_date': row['exp_date'].isoformat(),
+        'in_stock': row['stock_quantity'] > 0,
+    }
+
+
+@app.route('/api/catalog/version')
+def catalog_version_api():
+    return jsonify({'version': current_catalog_version()})
+
+
+@app.route('/api/catalog')
+def catalog_api():
+    try:
+        size = int(request.args.get('per_page', CATALOG_API_PAGE_SIZE))
+    except ValueError:
+        size = CATALOG_API_PAGE_SIZE
+    size = max(1, min(size, CATALOG_API_MAX_PAGE_SIZE))
+    after = decode_cursor(request.args.get('after'), 1)
+    params = [after, size]
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    # Any coding of the client's copy is still valid for this version
+    version = current_catalog_version()
+    if any(request.if_none_match.contains(catalog_etag(version, params, coding))
+           for coding in {encoding, 'identity'}):
+        response = Response(status=304)
+        response.set_etag(catalog_etag(version, params, encoding))
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    seek = "WHERE p.product_id > %s" if after else ""
+    with DatabaseConnection(read_only=True) as cursor:
+        # Read the version in the same snapshot as the page it labels
+        cursor.execute("SELECT version FROM catalog_version WHERE name = 'catalog'")
+        version = cursor.fetchone()['version']
+        cursor.execute(f"""
+            SELECT p.product_id, p.name, p.description, p.manufacturer,
+                   p.seller_id, s.company_name as seller_name, p.unit_price,
+                   p.exp_date, p.stock_quantity
+            FROM product p
+            JOIN seller s ON p.seller_id = s.seller_id
+            {seek}
+            ORDER BY p.product_id
+            LIMIT %s
+        """, (*(after or []), size + 1))
+        rows = cursor.fetchall()
+
+    next_page = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_page = encode_cursor([rows[-1]['product_id']])
+    body = json.dumps({'version': version,
+                       'products': [_catalog_item(row) for row in rows],
+                       'next': next_page}, separators=(',', ':')).encode()
+    if len(body) < COMPRESS_MIN_BYTES:
+        encoding = 'identity'
+
+    response = Response(compress_body(body, encoding), mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(catalog_etag(version, params, encoding))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/orders/export')
+@login_required
+@role_required(['customer'])
+def export_orders():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        flash('Unsupported export format', 'error')
+        return redirect(url_for('orders'))
+
+    return stream_export(f"""
+        SELECT oi.order_id, oi.order_date, oi.product_id, p.name as product_name,
+               oi.quantity, oi.unit_price, oi.subtotal, oi.seller_id, oi.status
+        FROM {order_lines_union("customer_id = %s")} oi
+        JOIN product p ON oi.product_id = p.product_id
+        ORDER BY oi.order_date DESC, oi.order_id DESC, oi.product_id DESC
+    """, (current_user.id, current_user.id),
+        ['order_id', 'order_date', 'product_id', 'product_name', 'quantity',
+         'unit_price', 'subtotal', 'seller_id', 'status'],
+        fmt, 'order_history')
+
+
+@app.route('/sales/export')
+@login_required
+@role_required(['seller'])
+def export_sales():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        flash('Unsupported export format', 'error')
+        return redirect(url_for('seller_dashboard'))
+
+    return stream_export(f"""
+        SELECT oi.order_id, oi.order_date, oi.product_id, p.name as product_name,
+               oi.quantity, oi.unit_price, oi.subtotal, oi.customer_id, oi.status
+        FROM {order_lines_union("seller_id = %s")} oi
+        JOIN product p ON oi.product_id = p.product_id
+        ORDER BY oi.order_date DESC
+    """, (current_user.id, current_user.id),
+        ['order_id', 'order_date', 'product_id', 'product_name', 'quantity',
+         'unit_price', 'subtotal', 'customer_id', 'status'],
+        fmt, 'sales')
+
+
+@app.route('/analytics')
+@login_required
+@role_required(['seller'])
+def analytics():
+    try:
+        # monthly_sales is kept current by refresh-analytics, never here
+        with DatabaseConnection(read_only=True) as cursor:
+            # Inventory by manufacturer (products carry no category column)
             cursor.execute("""
-                SELECT p.*, s.company_name as seller_name
-                FROM product p
-                JOIN seller s ON p.seller_id = s.seller_id
-                WHERE p.status = 'available'
-                AND p.stock_quantity > 0
-                ORDER BY p.name
-            """)
-            products = cursor.fetchall()
+                SELECT manufacturer as category,
+                       COUNT(*) as product_count,
+                       SUM(stock_quantity) as total_stock,
+                       AVG(unit_price) as avg_price
+                FROM product
+                WHERE seller_id = %s
+                GROUP BY manufacturer
+            """, (current_user.id,))
+            # Sorted here; one row per manufacturer is cheaper than a filesort
+            category_stats = sorted(cursor.fetchall(),
+                                    key=lambda row: row['product_count'],
+                                    reverse=True)
 
-            # Get customer's order history
+            # All-time best sellers straight from the sales rollup
             cursor.execute("""
-                SELECT 
-                    oi.*,
-                    p.name as product_name,
-                    s.company_name as seller_name
-                FROM order_item oi
-                JOIN product p ON oi.product_id = p.product_id
-                JOIN seller s ON oi.seller_id = s.seller_id
-                WHERE oi.customer_id = %s
-                ORDER BY oi.order_date DESC
+                SELECT s.company_name, p.name as product_name,
+                       r.order_count as times_ordered,
+                       r.total_quantity as total_quantity_sold
+                FROM product_sales_rollup r
+                JOIN product p ON r.product_id = p.product_id
+                JOIN seller s ON r.seller_id = s.seller_id
+                WHERE r.seller_id = %s
+                ORDER BY r.total_quantity DESC
+                LIMIT 10
+            """, (current_user.id,))
+            top_products = cursor.fetchall()
+
+            # Last twelve months from the monthly aggregate
+            cursor.execute("""
+                SELECT DATE_FORMAT(ms.month, '%%Y-%%m') as month,
+                       SUM(ms.order_count) as order_count,
+                       SUM(ms.total_sales) as total_sales
+                FROM monthly_sales ms
+                WHERE ms.seller_id = %s
+                AND ms.month >= DATE_FORMAT(CURDATE() - INTERVAL 11 MONTH, '%%Y-%%m-01')
+                GROUP BY ms.month
+                ORDER BY ms.month DESC
             """, (current_user.id,))
-            order_history = cursor.fetchall()
+            sales_trends = cursor.fetchall()
 
-            return render_template('orders.html',
-                                   products=products,
-                                   order_history=order_history,
-                                   cart=session.get('cart', []))
+            return render_template('analytics.html',
+                                   category_stats=category_stats,
+                                   top_products=top_products,
+                                   sales_trends=sales_trends)
     except Exception as e:
-        logger.error(f"Error loading orders page: {e}")
-        flash('Error loading orders page', 'error')
+        logger.error(f"Error loading analytics: {e}")
+        flash('Error loading analytics', 'error')
         return redirect(url_for('dashboard'))
 
 
@@ -685,22 +4416,13 @@ def add_to_cart():
     try:
         product_id = request.form['product_id']
         quantity = int(request.form['quantity'])
-        unit_price = float(request.form['unit_price'])
-        seller_id = request.form['seller_id']
-        subtotal = quantity * unit_price
-
-        cart_item = {
-            'product_id': product_id,
-            'quantity': quantity,
-            'unit_price': unit_price,
-            'subtotal': subtotal,
-            'seller_id': seller_id
-        }
+        if quantity <= 0:
+            raise ValueError(quantity)
 
-        cart = session.get('cart', [])
-        cart.append(cart_item)
-        session['cart'] = cart
-        session.modified = True
+        # Prices come from product when the cart is shown and at checkout
+        cart_store.add(current_user.id, product_id, quantity)
+        # Drop the list-valued cart left in cookies by older versions
+        session.pop('cart', None)
 
         flash('Product added to cart', 'success')
         return redirect(url_for('orders'))
@@ -708,6 +4430,9 @@ def add_to_cart():
     except ValueError:
         flash('Invalid quantity', 'error')
         return redirect(url_for('orders'))
+    except CartFull as e:
+        flash(str(e), 'error')
+        return redirect(url_for('orders'))
     except Exception as e:
         logger.error(f"Error adding to cart: {e}")
         flash('Error adding product to cart', 'error')
@@ -718,74 +4443,175 @@ def add_to_cart():
 @login_required
 @role_required(['customer'])
 def process_order():
-    if not session.get('cart'):
+    cart = cart_store.items(current_user.id)
+    if not cart:
         flash('Your cart is empty', 'error')
         return redirect(url_for('orders'))
 
     try:
         with DatabaseConnection() as cursor:
-            cursor.execute("START TRANSACTION")
-
             # Generate a unique order_id
-            order_id = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}"
-
-            for item in session['cart']:
-                product_id = item['product_id']
-                quantity = item['quantity']
-                unit_price = item['unit_price']
-                subtotal = item['subtotal']
-                seller_id = item['seller_id']
+            order_id = id_generator.new_id('ORD')
 
-                # Check stock availability
-                cursor.execute("""
-                    SELECT stock_quantity 
-                    FROM product 
-                    WHERE product_id = %s 
-                    FOR UPDATE
-                """, (product_id,))
-                current_stock = cursor.fetchone()
-
-                if not current_stock or current_stock['stock_quantity'] < quantity:
-                    raise Exception(
-                        f"Insufficient stock for product {product_id}")
-
-                # Update stock
-                cursor.execute("""
-                    UPDATE product 
-                    SET stock_quantity = stock_quantity - %s 
-                    WHERE product_id = %s
-                """, (quantity, product_id))
+            checkout = CartCheckout(
+                cursor, order_id, current_user.id,
+                shipping_address=request.form.get('shipping_address', '').strip() or None)
+            checkout.place(cart)
+            if checkout.hot_lines:
+                stock_rebalancer.ensure_started()
+            if checkout.sold_out:
+                catalog_changed()
 
-                # Add order item
-                cursor.execute("""
-                    INSERT INTO order_item (
-                        order_id, product_id, quantity, unit_price, subtotal, customer_id, seller_id, status
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, 'processing')
-                """, (
-                    order_id,
-                    product_id,
-                    quantity,
-                    unit_price,
-                    subtotal,
-                    current_user.id,
-                    seller_id
-                ))
+            logger.info(
+                f"Order {order_id}: {checkout.line_count} lines in "
+                f"{checkout.round_trips} round trips, "
+                f"locks held {checkout.lock_hold_ms:.1f} ms")
 
-            cursor.execute("COMMIT")
-            session.pop('cart', None)
-            flash('Order placed successfully', 'success')
-            return redirect(url_for('orders'))
+        cart_store.clear(current_user.id)
+        flash('Order placed successfully', 'success')
+        return redirect(url_for('orders'))
 
+    except CheckoutError as e:
+        logger.warning(f"Order rejected: {e}")
+        flash(str(e), 'error')
+        return redirect(url_for('orders'))
     except Exception as e:
-        cursor.execute("ROLLBACK")
         logger.error(f"Error processing order: {e}")
         flash('Error processing order', 'error')
         return redirect(url_for('orders'))
 
 
+def _prometheus_lines():
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text
+                         else f"{name} {value}")
+
+    def histogram(name, help_text, histograms):
+        samples = []
+        for labels, hist in histograms:
+            for bound, count in hist.cumulative():
+                le = '+Inf' if bound == float('inf') else bound
+                samples.append(({**labels, 'le': le}, count))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}_bucket{{{label_text}}} {value}")
+        for labels, hist in histograms:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}_sum{{{label_text}}} {hist.sum}")
+            lines.append(f"{name}_count{{{label_text}}} {hist.count}")
+
+    with request_metrics._lock:
+        histogram('pharmacy_request_duration_seconds', 'Request latency by route.',
+                  [({'route': route}, hist)
+                   for route, hist in request_metrics.latency.items()])
+        metric('pharmacy_requests_total', 'counter', 'Requests by route and status.',
+               [({'route': route, 'status': status}, count)
+                for (route, status), count in request_metrics.requests.items()])
+        metric('pharmacy_db_queries_total', 'counter', 'SQL statements by route.',
+               [({'route': route}, count)
+                for route, count in request_metrics.queries.items()])
+        metric('pharmacy_db_seconds_total', 'counter', 'Time spent in SQL by route.',
+               [({'route': route}, seconds)
+                for route, seconds in request_metrics.db_seconds.items()])
+        metric('pharmacy_db_rows_total', 'counter', 'Rows fetched by route.',
+               [({'route': route}, rows)
+                for route, rows in request_metrics.rows.items()])
+    metric('pharmacy_db_slow_queries_total', 'counter',
+           f'Statements slower than {SLOW_QUERY_MS:g} ms.',
+           [({}, request_metrics.slow_queries)])
+
+    pools = [('primary', connection_pool)]
+    if replica_pool is not None:
+        pools.append(('replica', replica_pool))
+    pool_stats = [(name, pool.stats()) for name, pool in pools]
+    for field in ('size', 'in_use', 'idle', 'waiters'):
+        metric(f'pharmacy_db_pool_{field}', 'gauge', f'Connection pool {field}.',
+               [({'pool': name}, stats[field]) for name, stats in pool_stats])
+    for field in ('acquired', 'timeouts', 'recycled'):
+        metric(f'pharmacy_db_pool_{field}_total', 'counter', f'Connection pool {field}.',
+               [({'pool': name}, stats[field]) for name, stats in pool_stats])
+    histogram('pharmacy_db_pool_wait_seconds', 'Time spent waiting for a connection.',
+              [({'pool': name}, pool._wait) for name, pool in pools])
+
+    caches = {'featured_products': featured_cache.stats(), 'users': user_cache.stats(),
+              'catalog_version': catalog_cache.stats(),
+              'fragments': fragment_cache.stats(),
+              'template_bytecode': template_bytecode_cache.stats()}
+    for field in ('hits', 'misses'):
+        metric(f'pharmacy_cache_{field}_total', 'counter', f'Cache {field}.',
+               [({'cache': name}, stats[field]) for name, stats in caches.items()])
+    metric('pharmacy_cache_hit_ratio', 'gauge', 'Cache hit ratio.',
+           [({'cache': name}, round(stats['hit_rate'], 4))
+            for name, stats in caches.items()])
+
+    fragments = sorted(fragment_cache.fragments.items())
+    for field in ('hits', 'misses'):
+        metric(f'pharmacy_fragment_{field}_total', 'counter',
+               f'Fragment cache {field}.',
+               [({'fragment': name}, stats[field]) for name, stats in fragments])
+    metric('pharmacy_fragment_render_seconds_total', 'counter',
+           'Time spent rendering fragments on misses, queries included.',
+           [({'fragment': name}, round(stats['render_seconds'], 6))
+            for name, stats in fragments])
+    metric('pharmacy_fragment_saved_seconds_total', 'counter',
+           'Render time saved by hits, at the cost of the cached render.',
+           [({'fragment': name}, round(stats['saved_seconds'], 6))
+            for name, stats in fragments])
+
+    # The sweeper runs in its own process, so its last run is read back
+    # from the database rather than from this worker's memory
+    try:
+        with DatabaseConnection(read_only=True) as cursor:
+            cursor.execute("""
+                SELECT TIMESTAMPDIFF(SECOND, started_at, NOW()) as lag_seconds,
+                       duration_ms, products_scanned, batches,
+                       low_stock, out_of_stock, expiring
+                FROM inventory_sweep
+                WHERE name = 'inventory_alert' AND finished_at IS NOT NULL
+            """)
+            sweep = cursor.fetchone()
+    except Exception as e:
+        logger.warning(f"Inventory sweep metrics unavailable: {e}")
+        sweep = None
+    if sweep:
+        metric('pharmacy_inventory_sweep_lag_seconds', 'gauge',
+               'Age of the inventory alerts (since the last completed sweep started).',
+               [({}, sweep['lag_seconds'])])
+        metric('pharmacy_inventory_sweep_duration_seconds', 'gauge',
+               'Duration of the last completed inventory sweep.',
+               [({}, sweep['duration_ms'] / 1000)])
+        metric('pharmacy_inventory_sweep_products', 'gauge',
+               'Products scanned by the last completed inventory sweep.',
+               [({}, sweep['products_scanned'])])
+        metric('pharmacy_inventory_sweep_batches', 'gauge',
+               'Batches of the last completed inventory sweep.',
+               [({}, sweep['batches'])])
+        metric('pharmacy_inventory_alerts', 'gauge', 'Open inventory alerts by kind.',
+               [({'kind': kind}, sweep[kind])
+                for kind in ('low_stock', 'out_of_stock', 'expiring')])
+    return lines
+
+
+@app.route('/metrics')
+def metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response("\n".join(_prometheus_lines()) + "\n",
+                    mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/logout')
 @login_required
 def logout():
+    user_cache.invalidate(current_user.role, current_user.id)
     logout_user()
     session.clear()
     flash('You have been logged out', 'info')
@@ -805,6 +4631,1420 @@ def internal_error(error):
     return render_template('500.html'), 500
 
 
+# Maintenance commands
+
+
+@app.cli.command('rebuild-sales-rollup')
+def rebuild_sales_rollup_command():
+    """Rebuild product_sales_rollup and seller_sales_rollup from all order lines."""
+    with DatabaseConnection() as cursor:
+        products, sellers = rebuild_sales_rollups(cursor)
+    logger.info(
+        f"Sales rollup rebuilt: {products} products, {sellers} sellers")
+
+
+@app.cli.command('refresh-analytics')
+@click.option('--loop', is_flag=True,
+              help='Keep refreshing every ANALYTICS_REFRESH_INTERVAL seconds.')
+def refresh_analytics_command(loop):
+    """Fold new order lines into the monthly sales aggregate."""
+    while loop:
+        try:
+            touched = try_refresh_monthly_sales()
+            if touched is None:
+                logger.info("Monthly sales refresh skipped: another refresh is running")
+            else:
+                logger.info(f"Monthly sales refreshed: {touched} aggregate rows touched")
+        except Exception as e:
+            logger.error(f"Monthly sales refresh failed: {e}")
+        time.sleep(ANALYTICS_REFRESH_INTERVAL)
+    touched = try_refresh_monthly_sales()
+    if touched is None:
+        raise click.ClickException('Another monthly sales refresh is running')
+    logger.info(f"Monthly sales refreshed: {touched} aggregate rows touched")
+
+
+@app.cli.command('sweep-inventory')
+@click.option('--loop', is_flag=True,
+              help='Keep sweeping every INVENTORY_SWEEP_INTERVAL seconds.')
+@click.option('--batch-size', default=INVENTORY_SWEEP_BATCH, show_default=True)
+@click.option('--expiry-days', default=EXPIRY_ALERT_DAYS, show_default=True)
+def sweep_inventory_command(loop, batch_size, expiry_days):
+    """Refresh inventory_alert (low stock, out of stock, near expiry)."""
+    sweeper = InventorySweeper(batch_size=batch_size, expiry_days=expiry_days)
+    if loop:
+        sweeper.run_forever()
+    stats = sweeper.run_once()
+    if stats is None:
+        raise click.ClickException('Another inventory sweep is running')
+    logger.info(f"Inventory sweep: {stats}")
+
+
+@app.cli.command('archive-orders')
+@click.option('--months', default=ORDER_ARCHIVE_MONTHS, show_default=True,
+              type=click.IntRange(min=ORDER_ARCHIVE_MONTHS),
+              help='Archive settled orders placed before the first of the '
+                   'month this many months back.')
+@click.option('--batch-size', default=ORDER_ARCHIVE_BATCH, show_default=True)
+def archive_orders_command(months, batch_size):
+    """Move old settled orders into order_item_archive and maintain the
+    monthly order_item partitions."""
+    stats = OrderArchiver(months=months, batch_size=batch_size).run_once()
+    if stats is None:
+        raise click.ClickException('Another order archive run is in progress')
+    logger.info(f"Order archive: {stats}")
+
+
+@app.cli.command('hot-stock')
+@click.argument('product_id')
+@click.option('--slots', default=HOT_STOCK_SLOTS, show_default=True,
+              type=click.IntRange(0, HOT_STOCK_MAX_SLOTS),
+              help='Sub-counters to split the stock over; 0 turns hot mode off.')
+def hot_stock_command(product_id, slots):
+    """Switch PRODUCT_ID in or out of hot-product stock mode."""
+    with DatabaseConnection() as cursor:
+        total = set_stock_slots(cursor, product_id, slots)
+    if total is None:
+        raise click.ClickException(f"Unknown product {product_id}")
+    click.echo(f"{product_id}: {total} in stock over {slots or 1} counter(s)")
+
+
+@app.cli.command('rebalance-stock')
+def rebalance_stock_command():
+    """Even out the stock sub-counters of every hot product once."""
+    products = stock_rebalancer.run_once()
+    if products is None:
+        raise click.ClickException('Another stock rebalance is running')
+    logger.info(f"Rebalanced stock of {products} hot products")
+
+
+@app.cli.command('import-products')
+@click.argument('seller_id')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS),
+              help='Input format (default: from the file extension).')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+def import_products_command(seller_id, path, fmt, batch_size):
+    """Bulk import or upsert products for SELLER_ID from a CSV/JSONL file."""
+    fmt = fmt or ('jsonl' if path.lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, encoding='utf-8', newline='') as stream:
+        report = ProductImporter(seller_id, batch_size).run(
+            iter_product_rows(stream, fmt))
+    catalog_changed()
+    click.echo(json.dumps(report, indent=2))
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending migrations from the migrations/ directory."""
+    with DatabaseConnection() as cursor:
+        applied = apply_migrations(cursor)
+        partitions = ensure_order_partitions(cursor)
+    logger.info(f"{len(applied)} migration(s) applied")
+    if partitions:
+        logger.info(f"order_item partitions added: {', '.join(partitions)}")
+
+
+@app.cli.command('bench-login')
+@click.option('--logins', default=200, show_default=True, help='Verifications to run.')
+@click.option('--concurrency', default=16, show_default=True, help='Request threads.')
+def bench_login_command(logins, concurrency):
+    """Measure password verification throughput through the hash pool."""
+    stored = password_hasher.hash('benchmark-password')
+    password_hasher.verify(stored, 'benchmark-password')  # warm the workers
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        results = list(threads.map(
+            lambda _: password_hasher.verify(stored, 'benchmark-password'),
+            range(logins)))
+    elapsed = time.perf_counter() - started
+
+    assert all(results)
+    throughput = logins / elapsed
+    click.echo(f"method={PASSWORD_HASH_METHOD} workers={HASH_WORKERS} "
+               f"concurrency={concurrency}")
+    click.echo(f"{logins} logins in {elapsed:.2f}s: {throughput:.1f}/s, "
+               f"{throughput / HASH_WORKERS:.1f}/s per core")
+
+
+def _generate_ids(args):
+    threads, count = args
+
+    def run(out):
+        out.extend(id_generator.new_id('ORD') for _ in range(count))
+
+    batches = [[] for _ in range(threads)]
+    workers = [threading.Thread(target=run, args=(batch,)) for batch in batches]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return batches
+
+
+@app.cli.command('stress-ids')
+@click.option('--processes', default=4, show_default=True)
+@click.option('--threads', default=8, show_default=True, help='Threads per process.')
+@click.option('--count', default=50000, show_default=True, help='IDs per thread.')
+def stress_ids_command(processes, threads, count):
+    """Generate IDs from many forked processes and threads; check for collisions."""
+    started = time.perf_counter()
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes) as pool:
+        per_process = pool.map(_generate_ids, [(threads, count)] * processes)
+    elapsed = time.perf_counter() - started
+
+    batches = [batch for process in per_process for batch in process]
+    ids = [new_id for batch in batches for new_id in batch]
+    collisions = len(ids) - len(set(ids))
+    unordered = sum(1 for batch in batches
+                    for a, b in zip(batch, batch[1:]) if a >= b)
+    too_long = sum(1 for new_id in ids if len(new_id) > 20)
+
+    click.echo(f"{len(ids)} ids in {elapsed:.2f}s ({len(ids) / elapsed:.0f}/s): "
+               f"{collisions} collisions, {unordered} out of order, "
+               f"{too_long} longer than 20 chars")
+    if collisions or unordered or too_long:
+        sys.exit(1)
+
+
+# Synthetic data generator and route benchmark
+
+MANUFACTURERS = ['Cipla', 'Sun Pharma', 'Lupin', 'Dr. Reddy\'s', 'Zydus',
+                 'Glenmark', 'Mankind', 'Alkem', 'Torrent', 'Abbott']
+INGREDIENTS = ['Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Azithromycin',
+               'Cetirizine', 'Metformin', 'Atorvastatin', 'Amlodipine',
+               'Omeprazole', 'Pantoprazole', 'Losartan', 'Montelukast',
+               'Diclofenac', 'Ciprofloxacin', 'Doxycycline', 'Levothyroxine',
+               'Salbutamol', 'Ranitidine', 'Loratadine', 'Clopidogrel',
+               'Aspirin', 'Vitamin C', 'Vitamin D3', 'Calcium', 'Zinc',
+               'Folic Acid', 'Iron', 'Ondansetron', 'Domperidone', 'Fluconazole']
+DOSAGE_FORMS = ['Tablets', 'Capsules', 'Syrup', 'Suspension', 'Injection',
+                'Cream', 'Ointment', 'Drops', 'Gel', 'Inhaler']
+BRAND_STEMS = ['Cal', 'Dol', 'Max', 'Neo', 'Pan', 'Zen', 'Vit', 'Flu', 'Ami',
+               'Cor', 'Lev', 'Mon', 'Ost', 'Rel', 'Ser', 'Tri', 'Ultra', 'Xen']
+BRAND_ENDINGS = ['ex', 'ol', 'ix', 'on', 'ra', 'vin', 'cet', 'fen', 'zole',
+                 'mox', 'dine', 'pro', 'lin', 'tex', 'sol', 'mab']
+ORDER_STATUSES = ['pending', 'processing', 'shipped', 'delivered', 'cancelled']
+
+
+def _bulk_insert(cursor, table, columns, rows):
+    values = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(rows))
+    cursor.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values}",
+        [value for row in rows for value in row])
+
+
+def _insert_in_batches(table, columns, rows, batch_size):
+    """Insert an iterable of rows with multi-row statements, one commit each."""
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with DatabaseConnection() as cursor:
+                _bulk_insert(cursor, table, columns, batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        with DatabaseConnection() as cursor:
+            _bulk_insert(cursor, table, columns, batch)
+        total += len(batch)
+    return total
+
+
+@app.cli.command('seed-data')
+@click.option('--sellers', default=50, show_default=True)
+@click.option('--customers', default=5000, show_default=True)
+@click.option('--products', default=20000, show_default=True,
+              type=click.IntRange(min=1))
+@click.option('--order-lines', default=1000000, show_default=True)
+@click.option('--days', default=730, show_default=True, help='Spread orders over this many days.')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--seed', default=42, show_default=True)
+def seed_data_command(sellers, customers, products, order_lines, days, batch_size, seed):
+    """Fill the schema with synthetic sellers, customers, products and orders.
+
+    Every generated user has the password "password". Rollups and the
+    monthly aggregate are rebuilt at the end.
+    """
+    rng = random.Random(seed)
+    password = password_hasher.hash('password')
+    now = datetime.now()
+    started = time.perf_counter()
+
+    seller_ids = [f"S{i:07d}" for i in range(sellers)]
+    _insert_in_batches(
+        'seller',
+        ['seller_id', 'password', 'company_name', 'license_number',
+         'email', 'phone', 'address', 'status'],
+        ((sid, password, f"Pharma Co {i}", f"LIC{i:08d}",
+          f"seller{i}@example.com", f"555{i:07d}", f"{i} Market Road", 'active')
+         for i, sid in enumerate(seller_ids)),
+        batch_size)
+
+    customer_ids = [f"C{i:08d}" for i in range(customers)]
+    _insert_in_batches(
+        'customer',
+        ['customer_id', 'password', 'first_name', 'last_name',
+         'email', 'phone', 'address', 'membership_level'],
+        ((cid, password, f"First{i}", f"Last{i}", f"customer{i}@example.com",
+          f"444{i:07d}", f"{i} Park Street",
+          rng.choice(['basic', 'silver', 'gold', 'platinum']))
+         for i, cid in enumerate(customer_ids)),
+        batch_size)
+
+    catalog = []
+
+    def product_rows():
+        for i in range(products):
+            seller_id = rng.choice(seller_ids)
+            price = Decimal(rng.randint(50, 50000)) / 100
+            stock = rng.randint(0, 500)
+            min_stock = rng.randint(5, 50)
+            mfg_date = now.date() - timedelta(days=rng.randint(0, 365))
+            exp_date = mfg_date + timedelta(days=rng.randint(180, 1095))
+            status = 'out_of_stock' if stock == 0 else \
+                'low_stock' if stock <= min_stock else 'available'
+            product_id = f"P{i:010d}"
+            catalog.append((product_id, seller_id, price))
+            ingredient = rng.choice(INGREDIENTS)
+            form = rng.choice(DOSAGE_FORMS)
+            strength = rng.choice([5, 10, 25, 50, 100, 250, 500, 650, 1000])
+            brand = rng.choice(BRAND_STEMS) + rng.choice(BRAND_ENDINGS)
+            yield (product_id, seller_id, f"{brand} {ingredient} {strength}mg {form}",
+                   f"{ingredient} {strength} mg {form.lower()}, pack {i % 97 + 1}",
+                   rng.choice(MANUFACTURERS),
+                   mfg_date, exp_date, price, stock, min_stock, status)
+
+    _insert_in_batches(
+        'product',
+        ['product_id', 'seller_id', 'name', 'description', 'manufacturer',
+         'mfg_date', 'exp_date', 'unit_price', 'stock_quantity',
+         'min_stock_level', 'status'],
+        product_rows(), batch_size)
+
+    headers = []
+
+    def order_rows():
+        produced = 0
+        order_number = 0
+        while produced < order_lines:
+            order_number += 1
+            order_id = f"SEED{order_number:012d}"
+            customer_id = rng.choice(customer_ids)
+            order_date = now - timedelta(seconds=rng.randint(0, days * 86400))
+            status = rng.choices(ORDER_STATUSES, weights=[5, 10, 10, 70, 5])[0]
+            # A catalog smaller than five products caps the lines per order
+            lines = min(rng.randint(1, 5), order_lines - produced, len(catalog))
+            total = 0
+            for product_id, seller_id, price in rng.sample(catalog, lines):
+                quantity = rng.randint(1, 5)
+                total += price * quantity
+                yield (order_id, product_id, quantity, price, price * quantity,
+                       customer_id, seller_id, order_date, status)
+            headers.append((order_id, customer_id, order_date, lines, total))
+            produced += lines
+
+    with DatabaseConnection() as cursor:
+        ensure_order_partitions(cursor)
+    lines = _insert_in_batches(
+        'order_item',
+        ['order_id', 'product_id', 'quantity', 'unit_price', 'subtotal',
+         'customer_id', 'seller_id', 'order_date', 'status'],
+        order_rows(), batch_size)
+    _insert_in_batches(
+        'orders',
+        ['order_id', 'customer_id', 'order_date', 'line_count', 'total'],
+        headers, batch_size)
+
+    # The seeded lines are backdated, mostly behind any existing watermark
+    with DatabaseConnection() as cursor:
+        rebuild_sales_rollups(cursor)
+        rebuild_monthly_sales(cursor)
+
+    elapsed = time.perf_counter() - started
+    click.echo(f"Seeded {sellers} sellers, {customers} customers, {products} products, "
+               f"{lines} order lines in {elapsed:.1f}s ({lines / elapsed:.0f} lines/s)")
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _logged_in_client(role, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = f"{role}:{user_id}"
+        sess['_fresh'] = True
+    return client
+
+
+@app.cli.command('bench-routes')
+@click.option('--concurrency', default='1,4,16', show_default=True,
+              help='Comma-separated concurrency levels to run.')
+@click.option('--duration', default=10.0, show_default=True, help='Seconds per level.')
+@click.option('--users', default=20, show_default=True,
+              help='Sellers and customers sampled to log in as.')
+@click.option('--checkout/--no-checkout', default=True, show_default=True,
+              help='Include add_to_cart + process_order (writes orders).')
+@click.option('--output', default='bench_results.json', show_default=True)
+def bench_routes_command(concurrency, duration, users, checkout, output):
+    """Drive the real routes with logged-in sessions and report latencies.
+
+    Requests go through the WSGI app in-process, one test client per
+    thread, against the configured database.
+    """
+    with DatabaseConnection(read_only=True) as cursor:
+        cursor.execute("SELECT seller_id FROM seller LIMIT %s", (users,))
+        sellers = [row['seller_id'] for row in cursor.fetchall()]
+        cursor.execute("SELECT customer_id FROM customer LIMIT %s", (users,))
+        customers = [row['customer_id'] for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT product_id FROM product
+            WHERE status = 'available' ORDER BY name, product_id LIMIT 500
+        """)
+        catalog = cursor.fetchall()
+
+    scenarios = [
+        ('seller_dashboard', 'seller', 'GET', '/seller_dashboard'),
+        ('products', 'seller', 'GET', '/products'),
+        ('orders', 'customer', 'GET', '/orders'),
+        ('customer_dashboard', 'customer', 'GET', '/customer_dashboard'),
+    ]
+    if checkout:
+        scenarios.append(('process_order', 'customer', 'POST', '/process_order'))
+
+    def worker(index, deadline, samples):
+        rng = random.Random(index)
+        clients = {
+            'seller': _logged_in_client('seller', sellers[index % len(sellers)]),
+            'customer': _logged_in_client('customer', customers[index % len(customers)]),
+        }
+        position = index
+        while time.perf_counter() < deadline:
+            name, role, method, path = scenarios[position % len(scenarios)]
+            position += 1
+            client = clients[role]
+            started = time.perf_counter()
+            if name == 'process_order':
+                product = rng.choice(catalog)
+                client.post('/add_to_cart', data={
+                    'product_id': product['product_id'], 'quantity': '1'})
+                response = client.post(path)
+            else:
+                response = client.open(path, method=method)
+            elapsed = time.perf_counter() - started
+            # Successful posts redirect; pages render with 200
+            ok = response.status_code == 200 or (
+                method == 'POST' and response.status_code == 302)
+            samples.append((name, elapsed, ok))
+
+    results = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'duration_seconds': duration,
+        'levels': {},
+    }
+    for level in [int(value) for value in concurrency.split(',')]:
+        samples = []
+        deadline = time.perf_counter() + duration
+        threads = [threading.Thread(target=worker, args=(i, deadline, samples))
+                   for i in range(level)]
+        wall_started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - wall_started
+
+        routes = {}
+        for name in sorted({sample[0] for sample in samples}):
+            latencies = sorted(s[1] for s in samples if s[0] == name)
+            errors = sum(1 for s in samples if s[0] == name and not s[2])
+            routes[name] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'throughput_rps': round(len(latencies) / wall, 2),
+                'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+                'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2),
+                'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+            }
+        results['levels'][str(level)] = {
+            'requests': len(samples),
+            'throughput_rps': round(len(samples) / wall, 2),
+            'routes': routes,
+        }
+
+        click.echo(f"concurrency={level}: {len(samples) / wall:.1f} req/s")
+        for name, stats in routes.items():
+            click.echo(f"  {name:20} {stats['throughput_rps']:8.1f} req/s  "
+                       f"p50 {stats['p50_ms']:8.1f}  p95 {stats['p95_ms']:8.1f}  "
+                       f"p99 {stats['p99_ms']:8.1f} ms  errors {stats['errors']}")
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    click.echo(f"Results written to {output}")
+
+
+@app.cli.command('bench-search')
+@click.option('--requests', 'count', default=2000, show_default=True,
+              help='Requests per endpoint.')
+@click.option('--concurrency', default=4, show_default=True)
+@click.option('--search-p99-ms', default=150.0, show_default=True)
+@click.option('--autocomplete-p99-ms', default=30.0, show_default=True)
+@click.option('--seed', default=7, show_default=True)
+def bench_search_command(count, concurrency, search_p99_ms, autocomplete_p99_ms, seed):
+    """Latency of /products/search and /products/autocomplete against p99 targets.
+
+    Queries are drawn from the seed-data vocabulary; run it on a catalog of
+    a million products (seed-data --products 1000000) for meaningful numbers.
+    """
+    with DatabaseConnection(read_only=True) as cursor:
+        cursor.execute("SELECT COUNT(*) as products FROM product")
+        products = cursor.fetchone()['products']
+        cursor.execute("SELECT seller_id FROM seller LIMIT 20")
+        sellers = [row['seller_id'] for row in cursor.fetchall()]
+        cursor.execute("SELECT customer_id FROM customer LIMIT %s", (concurrency,))
+        customers = [row['customer_id'] for row in cursor.fetchall()]
+    if not sellers or not customers:
+        raise click.ClickException('Needs sellers and customers (see seed-data)')
+    if products < 1000000:
+        click.echo(f"warning: catalog has {products} products, targets assume 1M")
+
+    rng = random.Random(seed)
+    words = INGREDIENTS + DOSAGE_FORMS + MANUFACTURERS
+
+    def search_path():
+        terms = [rng.choice(words)]
+        if rng.random() < 0.5:
+            terms.append(rng.choice(DOSAGE_FORMS + ['500mg', '250mg', '10mg']))
+        path = '/products/search?q=' + '+'.join(t.replace(' ', '+') for t in terms)
+        if rng.random() < 0.3:
+            low = rng.randint(1, 200)
+            path += f"&min_price={low}&max_price={low + rng.randint(10, 200)}"
+        if rng.random() < 0.2:
+            path += f"&seller_id={rng.choice(sellers)}"
+        return path
+
+    def autocomplete_path():
+        word = rng.choice(words + [stem + ending for stem in BRAND_STEMS
+                                   for ending in BRAND_ENDINGS[:3]])
+        path = '/products/autocomplete?q=' + word[:rng.randint(2, 6)]
+        if rng.random() < 0.2:
+            path += f"&seller_id={rng.choice(sellers)}"
+        return path
+
+    failed = False
+    for name, make_path, target in (('search', search_path, search_p99_ms),
+                                    ('autocomplete', autocomplete_path, autocomplete_p99_ms)):
+        paths = [make_path() for _ in range(count)]
+        latencies, errors = [], []
+
+        def worker(index):
+            client = _logged_in_client('customer', customers[index % len(customers)])
+            for path in paths[index::concurrency]:
+                started = time.perf_counter()
+                response = client.get(path)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors.append(path)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        wall_started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - wall_started
+
+        latencies.sort()
+        p99 = _percentile(latencies, 0.99) * 1000
+        verdict = 'ok' if p99 <= target and not errors else 'FAIL'
+        failed = failed or verdict != 'ok'
+        click.echo(f"{name:12} {len(latencies) / wall:8.1f} req/s  "
+                   f"p50 {_percentile(latencies, 0.50) * 1000:7.1f}  "
+                   f"p95 {_percentile(latencies, 0.95) * 1000:7.1f}  "
+                   f"p99 {p99:7.1f} ms (target {target:.0f})  "
+                   f"errors {len(errors)}  {verdict}")
+    if failed:
+        sys.exit(1)
+
+
+@app.cli.command('bench-stock')
+@click.option('--concurrency', default=32, show_default=True)
+@click.option('--orders', default=2000, show_default=True, help='Orders per mode.')
+@click.option('--slots', default=HOT_STOCK_SLOTS, show_default=True,
+              type=click.IntRange(1, HOT_STOCK_MAX_SLOTS))
+def bench_stock_command(concurrency, orders, slots):
+    """Checkout throughput on a single product, with and without hot mode.
+
+    Checkouts run with the sales rollups maintained as in production, and
+    the rollups are checked afterwards. Every thread has its own connection
+    so the pool size does not cap the concurrency. The benchmark product
+    and its orders are removed afterwards.
+    """
+    with DatabaseConnection(read_only=True) as cursor:
+        cursor.execute("SELECT seller_id FROM seller LIMIT 1")
+        seller = cursor.fetchone()
+        cursor.execute("SELECT customer_id FROM customer LIMIT 1")
+        customer = cursor.fetchone()
+    if not seller or not customer:
+        raise click.ClickException('Needs at least one seller and one customer (see seed-data)')
+    seller_id, customer_id = seller['seller_id'], customer['customer_id']
+
+    product_id = id_generator.new_id('P')
+    initial_stock = orders * 2
+    today = datetime.now().date()
+    with DatabaseConnection() as cursor:
+        cursor.execute("""
+            INSERT INTO product (
+                product_id, seller_id, name, description, manufacturer,
+                mfg_date, exp_date, unit_price, stock_quantity, min_stock_level, status
+            ) VALUES (%s, %s, 'Benchmark SKU', 'bench-stock', 'Benchmark',
+                      %s, %s, 1.00, %s, 0, 'available')
+        """, (product_id, seller_id, today, today + timedelta(days=365), initial_stock))
+
+    placed = 0
+
+    def run():
+        remaining = iter(range(orders))
+        claim = threading.Lock()
+        latencies, errors = [], []
+
+        def worker():
+            conn = mysql.connector.connect(**dbconfig)
+            cursor = conn.cursor(dictionary=True)
+            try:
+                while True:
+                    with claim:
+                        if next(remaining, None) is None:
+                            return
+                    started = time.perf_counter()
+                    try:
+                        CartCheckout(cursor, id_generator.new_id('ORD'), customer_id).place(
+                            [{'product_id': product_id, 'quantity': 1}])
+                        latencies.append(time.perf_counter() - started)
+                    except Exception as e:
+                        conn.rollback()
+                        errors.append(str(e))
+            finally:
+                cursor.close()
+                conn.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        wall_started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - wall_started
+        latencies.sort()
+        return len(latencies), wall, latencies, errors
+
+    try:
+        for label, mode_slots in (('single row', 0), (f'{slots} slots', slots)):
+            with DatabaseConnection() as cursor:
+                set_stock_slots(cursor, product_id, mode_slots)
+            ok, wall, latencies, errors = run()
+            placed += ok
+            click.echo(f"{label:12} {ok / wall:8.1f} orders/s  "
+                       f"p50 {_percentile(latencies, 0.50) * 1000:7.1f}  "
+                       f"p99 {_percentile(latencies, 0.99) * 1000:7.1f} ms  "
+                       f"errors {len(errors)}")
+            if errors:
+                click.echo(f"  first error: {errors[0]}")
+
+        # Every placed order must be reflected in the stock and, once the
+        # slots are folded in, in the product's sales rollup exactly once
+        with DatabaseConnection() as cursor:
+            remaining_stock = rebalance_hot_stock(cursor, product_id)
+            cursor.execute("""
+                SELECT total_quantity, order_count FROM product_sales_rollup
+                WHERE product_id = %s
+            """, (product_id,))
+            rollup = cursor.fetchone() or {'total_quantity': 0, 'order_count': 0}
+        if remaining_stock != initial_stock - placed:
+            raise click.ClickException(
+                f"Stock drift: {remaining_stock} left, expected {initial_stock - placed}")
+        if (rollup['total_quantity'], rollup['order_count']) != (placed, placed):
+            raise click.ClickException(
+                f"Rollup drift: {rollup['order_count']} orders and "
+                f"{rollup['total_quantity']} units counted, expected {placed}")
+        click.echo(f"Stock and rollups consistent: {placed} orders, "
+                   f"{remaining_stock} left")
+    finally:
+        with DatabaseConnection() as cursor:
+            # Fold what the slots still hold so the seller count below is exact
+            rebalance_hot_stock(cursor, product_id)
+            cursor.execute("""
+                DELETE FROM orders WHERE order_id IN (
+                    SELECT order_id FROM order_item WHERE product_id = %s
+                )
+            """, (product_id,))
+            cursor.execute("DELETE FROM order_item WHERE product_id = %s", (product_id,))
+            cursor.execute("""
+                UPDATE seller_sales_rollup SET order_count = order_count - %s
+                WHERE seller_id = %s
+            """, (placed, seller_id))
+            # Only there if an analytics refresh ran during the benchmark
+            cursor.execute("""
+                DELETE FROM monthly_sales WHERE seller_id = %s AND product_id = %s
+            """, (seller_id, product_id))
+            cursor.execute("DELETE FROM product WHERE product_id = %s", (product_id,))
+
+
+@app.cli.command('bench-order-status')
+@click.option('--lines', default=100000, show_default=True,
+              help='Order lines to create (two per order).')
+@click.option('--chunk', default=BULK_STATUS_CHUNK, show_default=True)
+@click.option('--cancel-share', default=0.1, show_default=True,
+              type=click.FloatRange(0, 1), help='Share of orders cancelled.')
+def bench_order_status_command(lines, chunk, cancel_share):
+    """Bulk-transition synthetic order lines through the whole lifecycle.
+
+    The lines belong to a throwaway seller with two products, one of them
+    in hot stock mode, so the seller-wide transitions touch nothing else.
+    The seller, its products and its lines are removed afterwards.
+    """
+    with DatabaseConnection(read_only=True) as cursor:
+        cursor.execute("SELECT customer_id FROM customer LIMIT 1")
+        customer = cursor.fetchone()
+    if not customer:
+        raise click.ClickException('Needs at least one customer (see seed-data)')
+    customer_id = customer['customer_id']
+
+    seller_id = id_generator.new_id('S')
+    cold_id, hot_id = id_generator.new_id('P'), id_generator.new_id('P')
+    orders = max(1, lines // 2)
+    order_ids = [id_generator.new_id('ORD') for _ in range(orders)]
+    initial_stock = orders
+    today = datetime.now().date()
+    with DatabaseConnection() as cursor:
+        cursor.execute("""
+            INSERT INTO seller (
+                seller_id, password, company_name, license_number,
+                email, phone, address
+            ) VALUES (%s, '!', 'Benchmark Seller', %s, %s, '0', '-')
+        """, (seller_id, seller_id, f"{seller_id}@bench.invalid"))
+        for product_id in (cold_id, hot_id):
+            cursor.execute("""
+                INSERT INTO product (
+                    product_id, seller_id, name, description, manufacturer,
+                    mfg_date, exp_date, unit_price, stock_quantity, min_stock_level, status
+                ) VALUES (%s, %s, %s, 'bench-order-status', 'Benchmark',
+                          %s, %s, 1.00, %s, 0, 'available')
+            """, (product_id, seller_id, f"Benchmark SKU {product_id}",
+                  today, today + timedelta(days=365), initial_stock))
+        set_stock_slots(cursor, hot_id, HOT_STOCK_SLOTS)
+
+    try:
+        started = time.perf_counter()
+        placed_at = datetime.now() - timedelta(seconds=orders)
+        for start in range(0, orders, 500):
+            batch = order_ids[start:start + 500]
+            params = []
+            for offset, order_id in enumerate(batch):
+                order_date = placed_at + timedelta(seconds=start + offset)
+                for product_id in (cold_id, hot_id):
+                    params.extend((order_id, product_id, customer_id,
+                                   seller_id, order_date))
+            with DatabaseConnection() as cursor:
+                cursor.execute(f"""
+                    INSERT INTO order_item (
+                        order_id, product_id, quantity, unit_price, subtotal,
+                        customer_id, seller_id, order_date, status
+                    ) VALUES {", ".join(["(%s, %s, 1, 1.00, 1.00, %s, %s, %s, 'pending')"] * len(batch) * 2)}
+                """, params)
+        click.echo(f"Inserted {orders * 2} lines in {time.perf_counter() - started:.1f}s")
+
+        cancelled = order_ids[:int(orders * cancel_share)]
+        stages = (
+            ('processing', 'pending', None),
+            ('cancelled', None, cancelled),
+            ('shipped', 'processing', None),
+            ('delivered', 'shipped', None),
+        )
+        for status, from_status, selected in stages:
+            update = OrderStatusUpdate(seller_id, status, chunk_size=chunk, pause=0)
+            report = update.run_for_orders(selected) if selected is not None \
+                else update.run_for_status(from_status)
+            click.echo(f"{from_status or 'by order id':>11} -> {status:<10} "
+                       f"{report['updated']:>8} lines  "
+                       f"{report['lines_per_second']:>10.0f} lines/s  "
+                       f"{report['chunks']:>5} chunks  "
+                       f"max chunk {report['max_chunk_ms']:7.1f} ms")
+
+        # Every cancelled line must have gone back into stock exactly once
+        expected = initial_stock + len(cancelled)
+        with DatabaseConnection() as cursor:
+            hot_stock = rebalance_hot_stock(cursor, hot_id)
+            cursor.execute("SELECT stock_quantity FROM product WHERE product_id = %s",
+                           (cold_id,))
+            cold_stock = cursor.fetchone()['stock_quantity']
+        if (cold_stock, hot_stock) != (expected, expected):
+            raise click.ClickException(
+                f"Stock drift: cold {cold_stock}, hot {hot_stock}, expected {expected}")
+        click.echo(f"Stock consistent: {len(cancelled)} cancelled orders restocked")
+    finally:
+        while True:
+            with DatabaseConnection() as cursor:
+                cursor.execute("DELETE FROM order_item WHERE seller_id = %s LIMIT 10000",
+                               (seller_id,))
+                if cursor.rowcount < 10000:
+                    break
+        with DatabaseConnection() as cursor:
+            # Cancellations subtract from months an analytics refresh folded in
+            cursor.execute("DELETE FROM monthly_sales WHERE seller_id = %s",
+                           (seller_id,))
+            cursor.execute("DELETE FROM product WHERE seller_id = %s", (seller_id,))
+            cursor.execute("DELETE FROM data_version WHERE scope = %s",
+                           (f"seller:{seller_id}",))
+            cursor.execute("DELETE FROM seller WHERE seller_id = %s", (seller_id,))
+
+
+# Query plan regression check
+
+# Full scans that are deliberate: (table, statement fragment) -> reason. An
+# entry only covers scans of that table in statements containing the fragment
+PLAN_SCAN_EXEMPTIONS = {
+    ('product_sales_rollup', 'SELECT AVG(total_quantity) FROM product_sales_rollup'):
+        'global sales average over one row per sold product',
+    ('product_sales_rollup', 'DELETE FROM product_sales_rollup'):
+        'rebuild-sales-rollup recomputes every row',
+    ('seller_sales_rollup', 'DELETE FROM seller_sales_rollup'):
+        'rebuild-sales-rollup recomputes every row',
+    ('order_item', 'INSERT INTO product_sales_rollup'):
+        'rebuild-sales-rollup reads every order line',
+    ('order_item_archive', 'INSERT INTO product_sales_rollup'):
+        'rebuild-sales-rollup reads every order line',
+    ('order_item', 'INSERT INTO seller_sales_rollup'):
+        'rebuild-sales-rollup reads every order line',
+    ('order_item_archive', 'INSERT INTO seller_sales_rollup'):
+        'rebuild-sales-rollup reads every order line',
+    ('product_stock_slot', 'WHERE sold_lines <> 0 OR seller_orders <> 0'):
+        'rebuild-sales-rollup clears the unfolded hot sales',
+    ('order_item', 'SELECT 1 FROM order_item PARTITION'):
+        'emptiness probe of one partition, stops at the first row',
+}
+
+
+def scan_exemption(table, operation):
+    sql = " ".join(operation.split())
+    for (exempt_table, fragment), reason in PLAN_SCAN_EXEMPTIONS.items():
+        if table == exempt_table and fragment in sql:
+            return reason
+    return None
+
+
+class _RecordingCursor:
+    """Cursor proxy that records statements and never lets a COMMIT or an
+    ALTER TABLE through."""
+
+    def __init__(self, cursor, statements):
+        self._cursor = cursor
+        self._statements = statements
+
+    def execute(self, operation, params=None, **kwargs):
+        sql = " ".join(operation.split())
+        self._statements.setdefault(sql, (operation, params))
+        # DDL would commit implicitly and change the partitioning
+        if sql.upper() == 'COMMIT' or sql.upper().startswith('ALTER '):
+            return None
+        return self._cursor.execute(operation, params, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _RecordingConnection:
+    """Dedicated-connection proxy for the background jobs: recording
+    cursors, and a rollback wherever the job would commit."""
+
+    def __init__(self, conn, statements):
+        self._conn = conn
+        self._statements = statements
+
+    def cursor(self, *args, **kwargs):
+        return _RecordingCursor(self._conn.cursor(*args, **kwargs), self._statements)
+
+    def commit(self):
+        self._conn.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+@contextmanager
+def recording_statements():
+    """Collect the SQL issued inside the block, rolling back every write.
+
+    Pooled connections are rolled back instead of committed, and the
+    dedicated connections of the background jobs roll back wherever the job
+    would commit, so write paths can be exercised against a seeded database
+    without changing it. Caches are swapped for empty ones so no query
+    hides behind a cached result.
+    """
+    statements = {}
+    original_enter = DatabaseConnection.__enter__
+    original_exit = DatabaseConnection.__exit__
+    original_connect = mysql.connector.connect
+
+    def recording_enter(self):
+        return _RecordingCursor(original_enter(self), statements)
+
+    def rollback_exit(self, exc_type, exc_val, exc_tb):
+        return original_exit(self, exc_type or RuntimeError,
+                             exc_val or RuntimeError('plan check rollback'),
+                             exc_tb)
+
+    def recording_connect(*args, **kwargs):
+        return _RecordingConnection(original_connect(*args, **kwargs), statements)
+
+    DatabaseConnection.__enter__ = recording_enter
+    DatabaseConnection.__exit__ = rollback_exit
+    # Only the jobs' dedicated connections come through this name; the
+    # pools use ConnectionPool.connect, so no proxy is left in them
+    mysql.connector.connect = recording_connect
+    backends = (fragment_cache.backend, featured_cache.backend,
+                catalog_cache.backend)
+    fragment_cache.backend = MemoryCacheBackend()
+    featured_cache.backend = MemoryCacheBackend()
+    catalog_cache.backend = MemoryCacheBackend()
+    try:
+        yield statements
+    finally:
+        DatabaseConnection.__enter__ = original_enter
+        DatabaseConnection.__exit__ = original_exit
+        mysql.connector.connect = original_connect
+        (fragment_cache.backend, featured_cache.backend,
+         catalog_cache.backend) = backends
+
+
+def capture_route_statements(seller_id, customer_id, product_id):
+    """Drive every route once; run inside recording_statements()."""
+    future = (datetime.now().date() + timedelta(days=1)).isoformat()
+    later = (datetime.now().date() + timedelta(days=400)).isoformat()
+
+    anonymous = app.test_client()
+    for path in ('/', '/api/catalog/version'):
+        anonymous.get(path).get_data()
+    anonymous.post('/login', data={
+        'user_id': seller_id, 'password': '', 'role': 'seller'})
+    anonymous.post('/login', data={
+        'user_id': customer_id, 'password': '', 'role': 'customer'})
+    anonymous.post('/register_seller', data={
+        'seller_id': 'PLANCHECK', 'company_name': 'Plan Check',
+        'license_number': 'PLANCHECK', 'email': 'plan@check.invalid',
+        'phone': '0', 'address': '-', 'password': 'x'})
+    anonymous.post('/register_customer', data={
+        'customer_id': 'PLANCHECK', 'first_name': 'Plan',
+        'last_name': 'Check', 'email': 'plan@check.invalid',
+        'phone': '0', 'address': '-', 'password': 'x'})
+
+    seller = _logged_in_client('seller', seller_id)
+    for path in ('/seller_dashboard', '/products', '/analytics', '/sales/export'):
+        seller.get(path).get_data()
+    seller.post('/products', data={
+        'name': 'Plan Check Product', 'manufacturer': 'Plan Check',
+        'mfg_date': future, 'exp_date': later,
+        'unit_price': '1.00', 'stock_quantity': '1'})
+    seller.post(f'/update_product/{product_id}', data={'stock_quantity': '1'})
+    seller.post(f'/delete_product/{product_id}')
+
+    customer = _logged_in_client('customer', customer_id)
+    for path in ('/customer_dashboard', '/orders', '/orders/export',
+                 '/orders?q=tablet', '/products/autocomplete?q=ta',
+                 '/products/search?q=tablet&min_price=1&max_price=100',
+                 f'/products/autocomplete?q=ta&seller_id={seller_id}',
+                 '/api/catalog', '/api/catalog?per_page=2&after=' + encode_cursor([product_id])):
+        customer.get(path).get_data()
+    customer.post('/add_to_cart', data={
+        'product_id': product_id, 'quantity': '1'})
+    # The cart lines are priced from product
+    customer.get('/orders').get_data()
+    customer.post('/process_order')
+    seller.post('/orders/status', json={
+        'status': 'shipped', 'from_status': 'processing'})
+    seller.post('/orders/status', json={
+        'status': 'cancelled', 'from_status': 'processing'})
+
+
+def capture_job_statements(seller_id, product):
+    """Run the importer and the maintenance jobs once; run inside
+    recording_statements()."""
+    future = (datetime.now().date() + timedelta(days=1)).isoformat()
+    later = (datetime.now().date() + timedelta(days=400)).isoformat()
+    fields = {'manufacturer': 'Plan Check', 'mfg_date': future,
+              'exp_date': later, 'unit_price': '1.00', 'stock_quantity': '1'}
+    # One row updating an existing product, one inserting a new one
+    ProductImporter(seller_id).run([
+        (1, dict(fields, name=product['name'])),
+        (2, dict(fields, name='Plan Check Import'))])
+
+    with DatabaseConnection() as cursor:
+        set_stock_slots(cursor, product['product_id'], 2)
+        rebalance_hot_stock(cursor, product['product_id'])
+        rebalance_hot_stock(cursor, product['product_id'], total=1)
+    with DatabaseConnection() as cursor:
+        rebuild_sales_rollups(cursor)
+    with DatabaseConnection() as cursor:
+        refresh_monthly_sales(cursor)
+    for job in (InventorySweeper(pause=0), OrderArchiver(pause=0),
+                stock_rebalancer):
+        if job.run_once() is None:
+            click.echo(f"SKIP {type(job).__name__}: another run holds its lock")
+
+
+def plan_problems(cursor, operation, params):
+    """EXPLAIN one statement and describe any full scan or filesort."""
+    cursor.execute("EXPLAIN " + operation, params)
+    problems = []
+    for row in cursor.fetchall():
+        table = row.get('table') or ''
+        if row.get('select_type') == 'INSERT' or table.startswith('<'):
+            continue
+        extra = row.get('Extra') or ''
+        if row.get('type') == 'ALL' and not scan_exemption(table, operation):
+            problems.append(f"full table scan on {table}")
+        # Relevance ranking has to sort the FULLTEXT matches
+        if 'Using filesort' in extra and row.get('type') != 'fulltext':
+            problems.append(f"filesort on {table}")
+    return problems
+
+
+@app.cli.command('check-query-plans')
+@click.option('--seller', 'seller_id', help='Seller to drive seller routes as.')
+@click.option('--customer', 'customer_id', help='Customer to drive customer routes as.')
+def check_query_plans_command(seller_id, customer_id):
+    """EXPLAIN every statement the routes, the importer and the maintenance
+    jobs issue; fail on scans or filesorts.
+
+    Run against a seeded database: on near-empty tables the optimizer
+    legitimately prefers full scans and the check becomes meaningless.
+    """
+    with DatabaseConnection() as cursor:
+        if not seller_id:
+            cursor.execute("SELECT seller_id FROM seller ORDER BY seller_id LIMIT 1")
+            seller_id = cursor.fetchone()['seller_id']
+        if not customer_id:
+            cursor.execute("SELECT customer_id FROM customer ORDER BY customer_id LIMIT 1")
+            customer_id = cursor.fetchone()['customer_id']
+        cursor.execute("""
+            SELECT product_id, name FROM product
+            WHERE seller_id = %s AND status = 'available'
+            LIMIT 1
+        """, (seller_id,))
+        product = cursor.fetchone()
+
+    with recording_statements() as recorded:
+        capture_route_statements(seller_id, customer_id, product['product_id'])
+        capture_job_statements(seller_id, product)
+    statements = list(recorded.values())
+
+    failures = 0
+    with DatabaseConnection() as cursor:
+        for operation, params in statements:
+            keyword = operation.split(None, 1)[0].upper()
+            if keyword not in ('SELECT', 'UPDATE', 'DELETE') and \
+                    'SELECT' not in operation.upper():
+                continue
+            # Data dictionary lookups have no plan of ours to regress
+            if 'INFORMATION_SCHEMA' in operation.upper():
+                continue
+            problems = plan_problems(cursor, operation, params)
+            if problems:
+                failures += 1
+                click.echo(f"FAIL {' '.join(operation.split())[:120]}")
+                for problem in problems:
+                    click.echo(f"     {problem}")
+
+    click.echo(f"{len(statements)} statements checked, {failures} with plan regressions")
+    if failures:
+        sys.exit(1)
+
+
+# Application factory and pre-fork production server
+#
+# Routes are registered on the module-level app, so the factory configures
+# that app and rebuilds the pools, caches and cart store from the new
+# settings rather than building a new app. None of them connects or starts
+# threads before first use, and the register_at_fork hooks above reset
+# them in forked children.
+
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', os.cpu_count() or 2))
+SERVE_THREADS = int(os.getenv('SERVE_THREADS', 8))
+SERVE_GRACEFUL_TIMEOUT = float(os.getenv('SERVE_GRACEFUL_TIMEOUT', 30))
+WARM_UP_CONNECTIONS = int(os.getenv('WARM_UP_CONNECTIONS', 2))
+WARM_UP_PATHS = ('/', '/login', '/api/catalog/version')
+
+
+def create_app(config=None):
+    """Return the configured application; does not touch the database.
+
+    config keys override the environment for every setting() read, e.g.
+    DB_HOST, DB_POOL_SIZE, CACHE_BACKEND, CACHE_DIR, CART_BACKEND or ID_HOST.
+    """
+    global dbconfig, connection_pool, replica_pool
+    global featured_cache, catalog_cache, cart_store
+    if config:
+        app.config.update(config)
+        dbconfig = database_config()
+        connection_pool, replica_pool = create_pools()
+        featured_cache = Cache(make_cache_backend('featured'))
+        catalog_cache = Cache(make_cache_backend('catalog'))
+        fragment_cache.backend = make_cache_backend(
+            'fragments', max_entries=FRAGMENT_CACHE_ENTRIES)
+        cart_store = make_cart_store()
+        id_generator.reseed()
+        # Sized from the pools just replaced
+        _create_query_executor()
+    return app
+
+
+def warm_up(application, paths=WARM_UP_PATHS, connections=WARM_UP_CONNECTIONS):
+    """Open pool connections and render a few pages before taking traffic.
+
+    Failures are logged, not raised: a worker that cannot reach the
+    database yet should still come up and serve what it can.
+    """
+    started = time.perf_counter()
+    try:
+        opened = connection_pool.warm(connections)
+    except Exception as e:
+        opened = 0
+        logger.warning(f"Warm-up could not open database connections: {e}")
+    client = application.test_client()
+    for path in paths:
+        try:
+            client.get(path)
+        except Exception as e:
+            logger.warning(f"Warm-up request to {path} failed: {e}")
+    logger.info(f"Worker {os.getpid()} warmed up in "
+                f"{(time.perf_counter() - started) * 1000:.0f} ms "
+                f"({opened} connections)")
+
+
+def preload_templates(application):
+    """Compile every template once, before workers are forked."""
+    env = application.jinja_env
+    for name in env.list_templates(extensions=['html']):
+        env.get_template(name)
+
+
+class _WorkerRequestHandler(WSGIRequestHandler):
+    # One request per connection: a keep-alive client would otherwise hold
+    # a worker thread between requests
+    protocol_version = 'HTTP/1.0'
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug WSGI server handling requests on a bounded thread pool."""
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, host, port, application, threads, fd):
+        super().__init__(host, port, application,
+                         handler=_WorkerRequestHandler, fd=fd)
+        # Every worker accepts from the same socket; the losers of a race
+        # for a connection must not block in accept()
+        self.socket.setblocking(False)
+        self._executor = ThreadPoolExecutor(max_workers=threads,
+                                            thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            request.setblocking(True)
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        logger.exception(f"Error handling request from {client_address}")
+
+    def drain(self):
+        """Wait for in-flight requests after serve_forever has returned."""
+        self._executor.shutdown(wait=True)
+        self.server_close()
+
+
+class PreforkServer:
+    """Master process supervising pre-forked WSGI workers.
+
+    The master binds the socket, imports the app once and forks workers
+    that share it; dead workers are replaced. SIGTERM/SIGINT stop the
+    workers after their in-flight requests. SIGHUP re-executes the master
+    with the socket inherited, so new code is loaded and its workers are
+    warm before the old ones are told to finish.
+    """
+
+    LISTEN_FD_ENV = 'PHARMACY_LISTEN_FD'
+    RETIRING_ENV = 'PHARMACY_RETIRING_WORKERS'
+
+    def __init__(self, application, host, port, workers=SERVE_WORKERS,
+                 threads=SERVE_THREADS, graceful_timeout=SERVE_GRACEFUL_TIMEOUT,
+                 warm=True):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.worker_count = max(1, workers)
+        self.threads = max(1, threads)
+        self.graceful_timeout = graceful_timeout
+        self.warm = warm
+        self.socket = None
+        self.workers = {}
+        self.retiring = set()
+        self._stopping = False
+        self._reloading = False
+
+    def _listen(self):
+        inherited = os.environ.pop(self.LISTEN_FD_ENV, None)
+        if inherited is not None:
+            sock = socket.socket(fileno=int(inherited))
+        else:
+            sock = socket.create_server((self.host, self.port), backlog=2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def run(self):
+        self.socket = self._listen()
+        self.retiring = {int(pid) for pid in
+                         os.environ.pop(self.RETIRING_ENV, '').split(',') if pid}
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        host, port = self.socket.getsockname()[:2]
+        logger.info(f"Serving on {host}:{port} with {self.worker_count} workers "
+                    f"x {self.threads} threads (master {os.getpid()})")
+
+        # Workers inherit the compiled templates (and the on-disk bytecode
+        # cache is filled for the next restart)
+        preload_templates(self.application)
+        self._wait_ready([self._spawn() for _ in range(self.worker_count)])
+        for pid in self.retiring:
+            self._signal(pid, signal.SIGTERM)
+
+        while not self._stopping:
+            if self._reloading:
+                self._reexec()
+            self._reap()
+            time.sleep(0.2)
+        self._shutdown()
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reloading = True
+
+    def _spawn(self):
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 1
+            try:
+                self._work(ready_w)
+                code = 0
+            except Exception:
+                logger.exception("Worker failed")
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        self.workers[pid] = time.time()
+        return pid, ready_r
+
+    def _work(self, ready_fd):
+        server = _PooledWSGIServer(self.host, self.port, self.application,
+                                   self.threads, self.socket.fileno())
+
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever, so it cannot run on the
+            # thread that is inside it
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        if self.warm:
+            warm_up(self.application)
+        try:
+            os.write(ready_fd, b'1')
+            os.close(ready_fd)
+        except OSError:
+            pass
+        server.serve_forever()
+        server.drain()
+
+    def _wait_ready(self, spawned):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid, ready_fd in spawned:
+            remaining = max(0.0, deadline - time.monotonic())
+            if select.select([ready_fd], [], [], remaining)[0]:
+                os.read(ready_fd, 1)
+            else:
+                logger.warning(f"Worker {pid} not ready after warm-up timeout")
+            os.close(ready_fd)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.retiring.discard(pid)
+            if self.workers.pop(pid, None) is not None and not self._stopping:
+                logger.warning(f"Worker {pid} exited with status {status}, "
+                               "starting a replacement")
+                _, ready_fd = self._spawn()
+                os.close(ready_fd)
+
+    @staticmethod
+    def _signal(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reexec(self):
+        logger.info("Reloading: re-executing the master")
+        os.environ[self.LISTEN_FD_ENV] = str(self.socket.fileno())
+        os.environ[self.RETIRING_ENV] = ','.join(
+            str(pid) for pid in (*self.workers, *self.retiring))
+        # The re-executed master still owns these workers as its children
+        os.execv(sys.executable, [sys.executable, *sys.orig_argv[1:]])
+
+    def _shutdown(self):
+        logger.info("Stopping workers")
+        children = set(self.workers) | self.retiring
+        for pid in children:
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while (self.workers or self.retiring) and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in set(self.workers) | self.retiring:
+            logger.warning(f"Worker {pid} did not stop in time, killing it")
+            self._signal(pid, signal.SIGKILL)
+        self._reap()
+        self.socket.close()
+
+
+@app.cli.command('serve')
+@click.option('--host', default=os.getenv('SERVE_HOST', '0.0.0.0'), show_default=True)
+@click.option('--port', default=int(os.getenv('PORT', 5000)), show_default=True)
+@click.option('--workers', default=SERVE_WORKERS, show_default=True,
+              help='Worker processes.')
+@click.option('--threads', default=SERVE_THREADS, show_default=True,
+              help='Request threads per worker.')
+@click.option('--graceful-timeout', default=SERVE_GRACEFUL_TIMEOUT, show_default=True,
+              help='Seconds workers get to finish in-flight requests.')
+@click.option('--warm-up/--no-warm-up', 'warm', default=True, show_default=True,
+              help='Open connections and render pages before taking traffic.')
+def serve_command(host, port, workers, threads, graceful_timeout, warm):
+    """Run the pre-forked production server (HUP reloads, TERM stops)."""
+    config = {}
+    if workers > 1:
+        # Memory backends are per process: a cart filled in one worker would
+        # be empty at checkout in another, and invalidations would reach
+        # only the worker that made them
+        if setting('CACHE_BACKEND', CACHE_BACKEND) == 'memory':
+            config['CACHE_BACKEND'] = 'file'
+        if setting('CART_BACKEND') == 'memory':
+            config['CART_BACKEND'] = 'file'
+        if config:
+            logger.warning(
+                f"{workers} workers cannot share memory-backed carts and caches; "
+                f"using the file backend in {setting('CACHE_DIR', CACHE_DIR)}")
+    PreforkServer(create_app(config), host, port, workers, threads,
+                  graceful_timeout, warm).run()
+
+
+_STARTUP_PROBE = """
+import time
+started = time.perf_counter()
+import {module} as module
+imported = time.perf_counter()
+application = module.create_app({{'TESTING': True}})
+created = time.perf_counter()
+status = application.test_client().get('/login').status_code
+responded = time.perf_counter()
+print(imported - started, created - imported, responded - created, status)
+"""
+
+
+@app.cli.command('bench-startup')
+@click.option('--runs', default=5, show_default=True)
+@click.option('--serve/--no-serve', 'through_server', default=False, show_default=True,
+              help='Also time `serve` from launch to its first HTTP response.')
+@click.option('--port', default=5099, show_default=True, help='Port for --serve.')
+def bench_startup_command(runs, through_server, port):
+    """Time import to first response in fresh interpreters.
+
+    The probe request is /login, which needs no database, so this also
+    checks that the app imports and answers without one.
+    """
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    probe = _STARTUP_PROBE.format(module=module)
+
+    samples, statuses = [], set()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', probe], cwd=app_dir,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise click.ClickException(result.stderr.strip().splitlines()[-1])
+        *timings, status = result.stdout.split()[-4:]
+        statuses.add(status)
+        samples.append([float(value) for value in timings])
+
+    def median(values):
+        values = sorted(values)
+        return values[len(values) // 2]
+
+    import_s, create_s, first_s = (median(column) for column in zip(*samples))
+    click.echo(f"{'import':<16}{import_s * 1000:>9.1f} ms")
+    click.echo(f"{'create_app':<16}{create_s * 1000:>9.1f} ms")
+    click.echo(f"{'first response':<16}{first_s * 1000:>9.1f} ms")
+    click.echo(f"{'total':<16}{(import_s + create_s + first_s) * 1000:>9.1f} ms"
+               f"  (median of {runs}, /login answered {', '.join(sorted(statuses))})")
+
+    if through_server:
+        url = f"http://127.0.0.1:{port}/login"
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'flask', '--app', module, 'serve',
+             '--host', '127.0.0.1', '--port', str(port), '--workers', '2'],
+            cwd=app_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if server.poll() is not None:
+                    raise click.ClickException("serve exited before answering")
+                try:
+                    with urllib.request.urlopen(url, timeout=1):
+                        break
+                except urllib.error.HTTPError:
+                    break
+                except OSError:
+                    time.sleep(0.01)
+            click.echo(f"{'serve to first':<16}"
+                       f"{(time.perf_counter() - started) * 1000:>9.1f} ms")
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=SERVE_GRACEFUL_TIMEOUT + 5)
+
+
 if __name__ == '__main__':
     app.run(
         debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true',
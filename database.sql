@@ -39,10 +39,55 @@ CREATE TABLE product (
     stock_quantity INT NOT NULL,
     min_stock_level INT DEFAULT 10,
     status ENUM('available', 'low_stock', 'out_of_stock') DEFAULT 'available',
+    stock_slots TINYINT UNSIGNED NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_product_seller_status (seller_id, status),
+    INDEX idx_product_seller_created (seller_id, created_at),
+    INDEX idx_product_status_name (status, name),
+    INDEX idx_product_seller_lower_name (seller_id, (LOWER(name))),
+    INDEX idx_product_stock_slots (stock_slots),
+    FULLTEXT INDEX idx_product_name_text (name),
+    FULLTEXT INDEX idx_product_search_text (name, description, manufacturer),
     FOREIGN KEY (seller_id) REFERENCES seller(seller_id) ON DELETE CASCADE
 );
 
+-- Stock of hot products (product.stock_slots > 0), split into sub-counters
+-- so concurrent checkouts of the same product do not queue on one row
+CREATE TABLE product_stock_slot (
+    product_id VARCHAR(20) NOT NULL,
+    slot TINYINT UNSIGNED NOT NULL,
+    quantity INT NOT NULL,
+    -- Hot sales not yet folded into the sales rollups by the rebalancer
+    sold_quantity INT NOT NULL DEFAULT 0,
+    sold_lines INT NOT NULL DEFAULT 0,
+    sold_revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    sold_price_sum DECIMAL(14,2) NOT NULL DEFAULT 0,
+    seller_orders INT NOT NULL DEFAULT 0,
+    last_sold_at TIMESTAMP NULL,
+    PRIMARY KEY (product_id, slot),
+    FOREIGN KEY (product_id) REFERENCES product(product_id) ON DELETE CASCADE
+);
+
+-- One header per order; the lines below stay per seller and per status
+CREATE TABLE orders (
+    order_id VARCHAR(20) PRIMARY KEY,
+    customer_id VARCHAR(20),
+    order_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    line_count INT NOT NULL DEFAULT 0,
+    total DECIMAL(12,2) NOT NULL DEFAULT 0,
+    shipping_address TEXT NULL,
+    archived TINYINT(1) NOT NULL DEFAULT 0,
+    INDEX idx_orders_customer_archived_date (customer_id, archived, order_date),
+    INDEX idx_orders_archived_date (archived, order_date),
+    FOREIGN KEY (customer_id) REFERENCES customer(customer_id)
+);
+
+-- Partitioned by month so recent reads prune to a few partitions;
+-- partitioned tables cannot carry foreign keys (delete_product checks
+-- idx_order_item_product instead), and order_date has to be part of the
+-- primary key. flask migrate splits the monthly partitions off pmax from
+-- the current date; archive-orders adds the months ahead and drops
+-- emptied old ones.
 CREATE TABLE order_item (
     order_id VARCHAR(20),
     product_id VARCHAR(20),
@@ -51,14 +96,147 @@ CREATE TABLE order_item (
     subtotal DECIMAL(10,2) NOT NULL,
     customer_id VARCHAR(20),
     seller_id VARCHAR(20),
-    order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    order_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     status ENUM('pending', 'processing', 'shipped', 'delivered', 'cancelled') DEFAULT 'pending',
+    PRIMARY KEY (order_id, product_id, order_date),
+    INDEX idx_order_item_customer_date (customer_id, order_date),
+    INDEX idx_order_item_seller_date (seller_id, order_date),
+    INDEX idx_order_item_date (order_date),
+    INDEX idx_order_item_product (product_id)
+)
+PARTITION BY RANGE (UNIX_TIMESTAMP(order_date)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Lines of delivered orders older than the archive horizon, moved out of
+-- order_item by archive-orders and still read by the order history
+CREATE TABLE order_item_archive (
+    order_id VARCHAR(20) NOT NULL,
+    product_id VARCHAR(20) NOT NULL,
+    quantity INT NOT NULL,
+    unit_price DECIMAL(10,2) NOT NULL,
+    subtotal DECIMAL(10,2) NOT NULL,
+    customer_id VARCHAR(20),
+    seller_id VARCHAR(20),
+    order_date TIMESTAMP NOT NULL,
+    status ENUM('pending', 'processing', 'shipped', 'delivered', 'cancelled') NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (order_id, product_id),
-    FOREIGN KEY (product_id) REFERENCES product(product_id),
-    FOREIGN KEY (customer_id) REFERENCES customer(customer_id),
-    FOREIGN KEY (seller_id) REFERENCES seller(seller_id)
+    INDEX idx_order_item_archive_customer_date (customer_id, order_date),
+    INDEX idx_order_item_archive_seller_date (seller_id, order_date),
+    INDEX idx_order_item_archive_product (product_id)
+) ROW_FORMAT=COMPRESSED;
+
+-- Per-product sales rollup, maintained in the same transaction as order
+-- inserts so dashboards never have to re-aggregate order_item
+CREATE TABLE product_sales_rollup (
+    product_id VARCHAR(20) PRIMARY KEY,
+    seller_id VARCHAR(20) NOT NULL,
+    total_quantity INT NOT NULL DEFAULT 0,
+    order_count INT NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    unit_price_sum DECIMAL(14,2) NOT NULL DEFAULT 0,
+    last_order_date TIMESTAMP NULL,
+    INDEX idx_rollup_seller_quantity (seller_id, total_quantity),
+    FOREIGN KEY (product_id) REFERENCES product(product_id) ON DELETE CASCADE,
+    FOREIGN KEY (seller_id) REFERENCES seller(seller_id) ON DELETE CASCADE
+);
+
+-- Distinct orders per seller (an order may hold several of its products)
+CREATE TABLE seller_sales_rollup (
+    seller_id VARCHAR(20) PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (seller_id) REFERENCES seller(seller_id) ON DELETE CASCADE
 );
 
+-- Monthly sales per seller x product, folded in incrementally past the
+-- watermark in aggregate_watermark so history is never re-aggregated
+CREATE TABLE monthly_sales (
+    seller_id VARCHAR(20) NOT NULL,
+    product_id VARCHAR(20) NOT NULL,
+    month DATE NOT NULL,
+    order_count INT NOT NULL DEFAULT 0,
+    total_quantity INT NOT NULL DEFAULT 0,
+    total_sales DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, month, product_id)
+);
+
+CREATE TABLE aggregate_watermark (
+    name VARCHAR(50) PRIMARY KEY,
+    high_water TIMESTAMP NULL
+);
+
+INSERT INTO aggregate_watermark (name, high_water) VALUES ('monthly_sales', NULL);
+
+-- Low-stock, out-of-stock and near-expiry alerts, kept current by the
+-- inventory sweeper (flask sweep-inventory) and read by the dashboards
+CREATE TABLE inventory_alert (
+    product_id VARCHAR(20) NOT NULL,
+    kind ENUM('low_stock', 'out_of_stock', 'expiring') NOT NULL,
+    seller_id VARCHAR(20) NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    stock_quantity INT NOT NULL,
+    min_stock_level INT NOT NULL,
+    exp_date DATE NOT NULL,
+    detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sweep_id INT NOT NULL,
+    PRIMARY KEY (product_id, kind),
+    INDEX idx_inventory_alert_seller_kind (seller_id, kind, exp_date),
+    FOREIGN KEY (product_id) REFERENCES product(product_id) ON DELETE CASCADE
+);
+
+-- Progress and cost of the last completed sweep
+CREATE TABLE inventory_sweep (
+    name VARCHAR(50) PRIMARY KEY,
+    sweep_id INT NOT NULL DEFAULT 0,
+    started_at TIMESTAMP NULL,
+    finished_at TIMESTAMP NULL,
+    duration_ms INT NOT NULL DEFAULT 0,
+    products_scanned INT NOT NULL DEFAULT 0,
+    batches INT NOT NULL DEFAULT 0,
+    low_stock INT NOT NULL DEFAULT 0,
+    out_of_stock INT NOT NULL DEFAULT 0,
+    expiring INT NOT NULL DEFAULT 0
+);
+
+INSERT INTO inventory_sweep (name) VALUES ('inventory_alert');
+
+-- Catalog version counter behind the /api/catalog ETags; bumped in the
+-- same transaction as every product write the catalog can show
+CREATE TABLE catalog_version (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalog_version (name, version) VALUES ('catalog', 1);
+
+-- Per-seller and per-customer data versions keying the cached page
+-- fragments; bumped in the same transaction as every write they show
+CREATE TABLE data_version (
+    scope VARCHAR(50) PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0
+);
+
+-- Versioned schema migrations (see migrations/); this file already
+-- contains everything up to the last recorded version
+CREATE TABLE schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO schema_migrations (version, name) VALUES
+    (1, '001_sales_rollups.sql'),
+    (2, '002_monthly_sales.sql'),
+    (3, '003_hot_path_indexes.sql'),
+    (4, '004_hot_stock_slots.sql'),
+    (5, '005_product_search.sql'),
+    (6, '006_inventory_alerts.sql'),
+    (7, '007_catalog_version.sql'),
+    (8, '008_data_versions.sql'),
+    (9, '009_order_partitions.sql'),
+    (10, '010_hot_stock_sales.sql');
+
 -- Triggers
 DELIMITER //
 
@@ -96,7 +274,7 @@ BEGIN
 END//
 
 -- Stored Procedures
--- Procedure to get low stock products
+-- Procedure to get low stock products, as of the last inventory sweep
 CREATE PROCEDURE get_low_stock_products(IN seller_id_param VARCHAR(20))
 BEGIN
     SELECT 
@@ -104,10 +282,11 @@ BEGIN
         name,
         stock_quantity,
         min_stock_level,
-        status
-    FROM product
+        kind as status
+    FROM inventory_alert
     WHERE seller_id = seller_id_param 
-    AND (status = 'low_stock' OR status = 'out_of_stock');
+    AND kind IN ('low_stock', 'out_of_stock')
+    ORDER BY stock_quantity, product_id;
 END//
 
 -- Procedure to process order
@@ -154,10 +333,42 @@ BEGIN
             'processing'
         );
         
+        INSERT INTO orders (order_id, customer_id, line_count, total)
+        VALUES (p_order_id, p_customer_id, 1, v_unit_price * p_quantity)
+        ON DUPLICATE KEY UPDATE
+            line_count = line_count + 1,
+            total = total + VALUES(total);
+
         -- Update stock
         UPDATE product 
         SET stock_quantity = stock_quantity - p_quantity
         WHERE product_id = p_product_id;
+
+        -- Keep the sales rollups in step with the new order line
+        INSERT INTO product_sales_rollup (
+            product_id, seller_id, total_quantity, order_count,
+            total_revenue, unit_price_sum, last_order_date
+        ) VALUES (
+            p_product_id, v_seller_id, p_quantity, 1,
+            v_unit_price * p_quantity, v_unit_price, NOW()
+        )
+        ON DUPLICATE KEY UPDATE
+            total_quantity = total_quantity + VALUES(total_quantity),
+            order_count = order_count + 1,
+            total_revenue = total_revenue + VALUES(total_revenue),
+            unit_price_sum = unit_price_sum + VALUES(unit_price_sum),
+            last_order_date = VALUES(last_order_date);
+
+        IF NOT EXISTS (
+            SELECT 1 FROM order_item
+            WHERE order_id = p_order_id
+            AND seller_id = v_seller_id
+            AND product_id <> p_product_id
+        ) THEN
+            INSERT INTO seller_sales_rollup (seller_id, order_count)
+            VALUES (v_seller_id, 1)
+            ON DUPLICATE KEY UPDATE order_count = order_count + 1;
+        END IF;
         
         COMMIT;
     ELSE
@@ -0,0 +1,37 @@
+-- Per-product and per-seller sales rollups read by the seller dashboards.
+-- Backfilled from existing order lines; checkout keeps them current.
+
+CREATE TABLE product_sales_rollup (
+    product_id VARCHAR(20) PRIMARY KEY,
+    seller_id VARCHAR(20) NOT NULL,
+    total_quantity INT NOT NULL DEFAULT 0,
+    order_count INT NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    unit_price_sum DECIMAL(14,2) NOT NULL DEFAULT 0,
+    last_order_date TIMESTAMP NULL,
+    INDEX idx_rollup_seller_quantity (seller_id, total_quantity),
+    FOREIGN KEY (product_id) REFERENCES product(product_id) ON DELETE CASCADE,
+    FOREIGN KEY (seller_id) REFERENCES seller(seller_id) ON DELETE CASCADE
+);
+
+CREATE TABLE seller_sales_rollup (
+    seller_id VARCHAR(20) PRIMARY KEY,
+    order_count INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (seller_id) REFERENCES seller(seller_id) ON DELETE CASCADE
+);
+
+INSERT INTO product_sales_rollup (
+    product_id, seller_id, total_quantity, order_count,
+    total_revenue, unit_price_sum, last_order_date
+)
+SELECT p.product_id, p.seller_id, SUM(oi.quantity), COUNT(*),
+       SUM(oi.subtotal), SUM(oi.unit_price), MAX(oi.order_date)
+FROM order_item oi
+JOIN product p ON oi.product_id = p.product_id
+GROUP BY p.product_id, p.seller_id;
+
+INSERT INTO seller_sales_rollup (seller_id, order_count)
+SELECT seller_id, COUNT(DISTINCT order_id)
+FROM order_item
+WHERE seller_id IS NOT NULL
+GROUP BY seller_id;
@@ -0,0 +1,19 @@
+-- Monthly seller x product sales aggregate behind /analytics, filled
+-- incrementally past the watermark by refresh_monthly_sales.
+
+CREATE TABLE monthly_sales (
+    seller_id VARCHAR(20) NOT NULL,
+    product_id VARCHAR(20) NOT NULL,
+    month DATE NOT NULL,
+    order_count INT NOT NULL DEFAULT 0,
+    total_quantity INT NOT NULL DEFAULT 0,
+    total_sales DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_id, month, product_id)
+);
+
+CREATE TABLE aggregate_watermark (
+    name VARCHAR(50) PRIMARY KEY,
+    high_water TIMESTAMP NULL
+);
+
+INSERT INTO aggregate_watermark (name, high_water) VALUES ('monthly_sales', NULL);
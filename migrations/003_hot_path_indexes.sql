@@ -0,0 +1,13 @@
+-- Indexes for the filters and sort orders used by app.py.
+-- The functional index on LOWER(name) needs MySQL 8.0.13 or later.
+
+ALTER TABLE order_item
+    ADD INDEX idx_order_item_customer_date (customer_id, order_date),
+    ADD INDEX idx_order_item_seller_date (seller_id, order_date),
+    ADD INDEX idx_order_item_date (order_date);
+
+ALTER TABLE product
+    ADD INDEX idx_product_seller_status (seller_id, status),
+    ADD INDEX idx_product_seller_created (seller_id, created_at),
+    ADD INDEX idx_product_status_name (status, name),
+    ADD INDEX idx_product_seller_lower_name (seller_id, (LOWER(name)));
@@ -0,0 +1,15 @@
+-- Hot-product stock mode: stock_slots > 0 means the stock lives in that
+-- many product_stock_slot rows, decremented by CartCheckout without a
+-- locking read and evened out by the stock rebalancer.
+
+ALTER TABLE product
+    ADD COLUMN stock_slots TINYINT UNSIGNED NOT NULL DEFAULT 0,
+    ADD INDEX idx_product_stock_slots (stock_slots);
+
+CREATE TABLE product_stock_slot (
+    product_id VARCHAR(20) NOT NULL,
+    slot TINYINT UNSIGNED NOT NULL,
+    quantity INT NOT NULL,
+    PRIMARY KEY (product_id, slot),
+    FOREIGN KEY (product_id) REFERENCES product(product_id) ON DELETE CASCADE
+);
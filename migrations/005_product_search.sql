@@ -0,0 +1,9 @@
+-- FULLTEXT indexes behind /products/search and /products/autocomplete.
+-- Each MATCH() needs an index over exactly its column list: the name-only
+-- index weights name hits in the ranking and serves autocomplete.
+-- InnoDB builds one FULLTEXT index per ALTER TABLE.
+
+ALTER TABLE product ADD FULLTEXT INDEX idx_product_name_text (name);
+
+ALTER TABLE product
+    ADD FULLTEXT INDEX idx_product_search_text (name, description, manufacturer);
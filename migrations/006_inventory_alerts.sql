@@ -0,0 +1,42 @@
+-- Low-stock, out-of-stock and near-expiry alerts, kept current by the
+-- inventory sweeper (flask sweep-inventory) and read by the dashboards.
+
+CREATE TABLE inventory_alert (
+    product_id VARCHAR(20) NOT NULL,
+    kind ENUM('low_stock', 'out_of_stock', 'expiring') NOT NULL,
+    seller_id VARCHAR(20) NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    stock_quantity INT NOT NULL,
+    min_stock_level INT NOT NULL,
+    exp_date DATE NOT NULL,
+    detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sweep_id INT NOT NULL,
+    PRIMARY KEY (product_id, kind),
+    INDEX idx_inventory_alert_seller_kind (seller_id, kind, exp_date),
+    FOREIGN KEY (product_id) REFERENCES product(product_id) ON DELETE CASCADE
+);
+
+-- Progress and cost of the last completed sweep
+CREATE TABLE inventory_sweep (
+    name VARCHAR(50) PRIMARY KEY,
+    sweep_id INT NOT NULL DEFAULT 0,
+    started_at TIMESTAMP NULL,
+    finished_at TIMESTAMP NULL,
+    duration_ms INT NOT NULL DEFAULT 0,
+    products_scanned INT NOT NULL DEFAULT 0,
+    batches INT NOT NULL DEFAULT 0,
+    low_stock INT NOT NULL DEFAULT 0,
+    out_of_stock INT NOT NULL DEFAULT 0,
+    expiring INT NOT NULL DEFAULT 0
+);
+
+INSERT INTO inventory_sweep (name) VALUES ('inventory_alert');
+
+DROP PROCEDURE IF EXISTS get_low_stock_products;
+
+CREATE PROCEDURE get_low_stock_products(IN seller_id_param VARCHAR(20))
+    SELECT product_id, name, stock_quantity, min_stock_level, kind as status
+    FROM inventory_alert
+    WHERE seller_id = seller_id_param
+    AND kind IN ('low_stock', 'out_of_stock')
+    ORDER BY stock_quantity, product_id;
@@ -0,0 +1,9 @@
+-- Catalog version counter behind the /api/catalog ETags; bumped in the
+-- same transaction as every product write the catalog can show.
+
+CREATE TABLE catalog_version (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalog_version (name, version) VALUES ('catalog', 1);
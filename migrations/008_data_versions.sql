@@ -0,0 +1,8 @@
+-- Per-seller and per-customer data versions ('seller:<id>', 'customer:<id>')
+-- keying the cached page fragments; bumped in the same transaction as every
+-- write the fragments show.
+
+CREATE TABLE data_version (
+    scope VARCHAR(50) PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0
+);
@@ -0,0 +1,62 @@
+-- Order headers, monthly range partitions on order_item and the archive
+-- that archive-orders moves old, fully delivered orders into. Lines keep
+-- customer_id and order_date: they are the partition key and the prefix of
+-- the per-customer index inside every partition.
+
+UPDATE order_item SET order_date = CURRENT_TIMESTAMP WHERE order_date IS NULL;
+
+CREATE TABLE orders (
+    order_id VARCHAR(20) PRIMARY KEY,
+    customer_id VARCHAR(20),
+    order_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    line_count INT NOT NULL DEFAULT 0,
+    total DECIMAL(12,2) NOT NULL DEFAULT 0,
+    shipping_address TEXT NULL,
+    archived TINYINT(1) NOT NULL DEFAULT 0,
+    INDEX idx_orders_customer_archived_date (customer_id, archived, order_date),
+    INDEX idx_orders_archived_date (archived, order_date),
+    FOREIGN KEY (customer_id) REFERENCES customer(customer_id)
+);
+
+INSERT INTO orders (order_id, customer_id, order_date, line_count, total)
+SELECT order_id, MIN(customer_id), MIN(order_date), COUNT(*), SUM(subtotal)
+FROM order_item
+GROUP BY order_id;
+
+-- Partitioned tables cannot have foreign keys, and every unique key must
+-- contain the partitioning column. delete_product checks
+-- idx_order_item_product instead of the old product foreign key.
+ALTER TABLE order_item
+    DROP FOREIGN KEY order_item_ibfk_1,
+    DROP FOREIGN KEY order_item_ibfk_2,
+    DROP FOREIGN KEY order_item_ibfk_3;
+
+ALTER TABLE order_item
+    MODIFY order_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (order_id, product_id, order_date),
+    ADD INDEX idx_order_item_product (product_id);
+
+-- Starts with the catch-all partition only: flask migrate (and every
+-- archive-orders run) splits monthly partitions off it from the current date
+ALTER TABLE order_item
+    PARTITION BY RANGE (UNIX_TIMESTAMP(order_date)) (
+        PARTITION pmax VALUES LESS THAN MAXVALUE
+    );
+
+CREATE TABLE order_item_archive (
+    order_id VARCHAR(20) NOT NULL,
+    product_id VARCHAR(20) NOT NULL,
+    quantity INT NOT NULL,
+    unit_price DECIMAL(10,2) NOT NULL,
+    subtotal DECIMAL(10,2) NOT NULL,
+    customer_id VARCHAR(20),
+    seller_id VARCHAR(20),
+    order_date TIMESTAMP NOT NULL,
+    status ENUM('pending', 'processing', 'shipped', 'delivered', 'cancelled') NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (order_id, product_id),
+    INDEX idx_order_item_archive_customer_date (customer_id, order_date),
+    INDEX idx_order_item_archive_seller_date (seller_id, order_date),
+    INDEX idx_order_item_archive_product (product_id)
+) ROW_FORMAT=COMPRESSED;
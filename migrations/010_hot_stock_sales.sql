@@ -0,0 +1,12 @@
+-- Sales of hot products are counted on the stock slot a checkout already
+-- holds locked, and the stock rebalancer folds them into the sales
+-- rollups, so hot checkouts never queue on the product's rollup row, the
+-- seller's rollup row or the seller's data_version row.
+
+ALTER TABLE product_stock_slot
+    ADD COLUMN sold_quantity INT NOT NULL DEFAULT 0,
+    ADD COLUMN sold_lines INT NOT NULL DEFAULT 0,
+    ADD COLUMN sold_revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    ADD COLUMN sold_price_sum DECIMAL(14,2) NOT NULL DEFAULT 0,
+    ADD COLUMN seller_orders INT NOT NULL DEFAULT 0,
+    ADD COLUMN last_sold_at TIMESTAMP NULL;
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as pharmacy  # noqa: E402
+
+
+@pytest.fixture
+def make_app():
+    """create_app, with app.config and the rebuilt globals restored after."""
+    saved = dict(pharmacy.app.config)
+    yield pharmacy.create_app
+    pharmacy.app.config.clear()
+    pharmacy.app.config.update(saved)
+    pharmacy.create_app({'TESTING': True})
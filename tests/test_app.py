@@ -0,0 +1,50 @@
+"""create_app() builds the app from settings without touching the database."""
+import app as pharmacy
+
+
+def test_create_app_opens_no_connections(make_app):
+    application = make_app({'DB_HOST': 'db.invalid', 'DB_POOL_SIZE': 3})
+
+    assert application is pharmacy.app
+    assert pharmacy.dbconfig['host'] == 'db.invalid'
+    stats = pharmacy.connection_pool.stats()
+    assert stats['size'] == 3
+    assert stats['in_use'] == stats['idle'] == stats['acquired'] == 0
+    assert pharmacy.replica_pool is None
+
+
+def test_config_overrides_environment(make_app, monkeypatch):
+    monkeypatch.setenv('CART_MAX_ITEMS', '7')
+    make_app({'CART_MAX_ITEMS': 3, 'DB_REPLICA_HOST': 'replica.invalid'})
+
+    assert pharmacy.cart_store.max_items == 3
+    assert pharmacy.replica_pool.stats()['acquired'] == 0
+
+
+def test_file_backends_use_cache_dir(make_app, tmp_path):
+    root = tmp_path / 'cache'
+    make_app({'CACHE_BACKEND': 'file', 'CACHE_DIR': str(root)})
+
+    for backend in (pharmacy.featured_cache.backend,
+                    pharmacy.catalog_cache.backend,
+                    pharmacy.fragment_cache.backend,
+                    pharmacy.cart_store.backend):
+        assert isinstance(backend, pharmacy.FileCacheBackend)
+        assert backend.directory.startswith(str(root))
+    assert pharmacy.cart_store.backend.drop_expired
+
+
+def test_file_backend_bounds_and_expires_entries(tmp_path):
+    backend = pharmacy.FileCacheBackend(
+        str(tmp_path / 'carts'), str(tmp_path), max_entries=150,
+        drop_expired=True)
+    now = pharmacy.time.time()
+    for i in range(50):
+        backend.set(f"expired{i}", i, now - 10)
+    for i in range(250):
+        backend.set(f"live{i}", i, now + 100 + i)
+
+    assert len(list((tmp_path / 'carts').glob('*.pickle'))) == 150
+    assert backend.get('expired0') is None
+    assert backend.get('live0') is None
+    assert backend.get('live249')[0] == 249
@@ -0,0 +1,48 @@
+"""IdGenerator: unique and time-ordered across threads and forked workers."""
+import multiprocessing
+
+import pytest
+
+import app as pharmacy
+
+
+def test_ids_sort_by_creation_and_fit_the_columns():
+    generator = pharmacy.IdGenerator()
+    ids = [generator.new_id('ORD') for _ in range(20000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert all(len(new_id) == 20 for new_id in ids)
+
+
+def test_node_is_host_and_process_id(monkeypatch):
+    monkeypatch.setenv('ID_HOST', '5')
+    generator = pharmacy.IdGenerator()
+    assert generator.node >> generator.PID_BITS == 5
+    assert generator.node & ((1 << generator.PID_BITS) - 1) == \
+        pharmacy.os.getpid() & ((1 << generator.PID_BITS) - 1)
+
+
+@pytest.mark.parametrize('host', ['-1', '32'])
+def test_host_out_of_range_is_refused(monkeypatch, host):
+    monkeypatch.setenv('ID_HOST', host)
+    with pytest.raises(ValueError):
+        pharmacy.IdGenerator()
+
+
+def test_no_collisions_across_forks():
+    context = multiprocessing.get_context('fork')
+    with context.Pool(4) as pool:
+        per_process = pool.map(pharmacy._generate_ids, [(4, 5000)] * 4)
+
+    batches = [batch for process in per_process for batch in process]
+    ids = [new_id for batch in batches for new_id in batch]
+    assert len(ids) == 4 * 4 * 5000
+    assert len(set(ids)) == len(ids)
+    assert all(batch == sorted(batch) for batch in batches)
+
+
+def test_stress_ids_command():
+    result = pharmacy.app.test_cli_runner().invoke(args=[
+        'stress-ids', '--processes', '2', '--threads', '2', '--count', '2000'])
+    assert result.exit_code == 0, result.output
+    assert '0 collisions' in result.output
@@ -0,0 +1,62 @@
+"""Migration files and the statement splitter that applies them."""
+import os
+import re
+
+import app as pharmacy
+
+
+def migration_files():
+    return sorted(name for name in os.listdir(pharmacy.MIGRATIONS_DIR)
+                  if name.endswith('.sql'))
+
+
+def test_split_sql_drops_comments_and_empty_statements():
+    script = """
+        -- create the table
+        CREATE TABLE t (id INT);
+          -- indented comment
+        INSERT INTO t VALUES (1);;
+
+        UPDATE t SET id = 2
+    """
+    assert pharmacy.split_sql(script) == [
+        'CREATE TABLE t (id INT)',
+        'INSERT INTO t VALUES (1)',
+        'UPDATE t SET id = 2',
+    ]
+
+
+def test_split_sql_keeps_multiline_statements_whole():
+    script = "ALTER TABLE t\n    ADD COLUMN a INT,\n    ADD COLUMN b INT;\n"
+    assert pharmacy.split_sql(script) == [
+        "ALTER TABLE t\n    ADD COLUMN a INT,\n    ADD COLUMN b INT"]
+
+
+def test_migrations_are_numbered_without_gaps():
+    versions = [int(name.split('_', 1)[0]) for name in migration_files()]
+    assert versions == list(range(1, len(versions) + 1))
+
+
+def test_migrations_split_into_plain_statements():
+    for name in migration_files():
+        with open(os.path.join(pharmacy.MIGRATIONS_DIR, name)) as f:
+            statements = pharmacy.split_sql(f.read())
+        assert statements, name
+        for statement in statements:
+            assert not statement.upper().startswith('DELIMITER'), name
+
+
+def test_schema_records_every_migration():
+    # A database loaded from database.sql must not apply them again
+    with open(os.path.join(os.path.dirname(pharmacy.MIGRATIONS_DIR),
+                           'database.sql')) as f:
+        recorded = re.findall(r"\((\d+), '([^']+\.sql)'\)", f.read())
+    assert [name for _, name in recorded] == migration_files()
+
+
+def test_recording_leaves_pool_connections_alone():
+    connect = pharmacy.mysql.connector.connect
+    with pharmacy.recording_statements():
+        assert pharmacy.mysql.connector.connect is not connect
+        assert pharmacy.ConnectionPool.connect is connect
+    assert pharmacy.mysql.connector.connect is connect
@@ -0,0 +1,67 @@
+"""Checks that need a MySQL server; opt in with PHARMACY_TEST_DB.
+
+PHARMACY_TEST_DB names a scratch database loaded from database.sql on the
+server given by DB_HOST, DB_USER and DB_PASSWORD. The tests migrate it and,
+if it has no products yet, seed it with seed-data. check-query-plans rolls
+its writes back, and bench-routes runs without checkout.
+"""
+import os
+
+import pytest
+
+import app as pharmacy
+
+pytestmark = pytest.mark.skipif(
+    not os.getenv('PHARMACY_TEST_DB'),
+    reason='set PHARMACY_TEST_DB to a scratch MySQL database')
+
+
+@pytest.fixture(scope='module')
+def cli():
+    saved = dict(pharmacy.app.config)
+    pharmacy.create_app({'DB_NAME': os.environ['PHARMACY_TEST_DB']})
+    runner = pharmacy.app.test_cli_runner()
+    result = runner.invoke(args=['migrate'])
+    assert result.exit_code == 0, result.output
+
+    with pharmacy.DatabaseConnection() as cursor:
+        cursor.execute("SELECT 1 FROM product LIMIT 1")
+        seeded = bool(cursor.fetchall())
+    if not seeded:
+        # Big enough that the optimizer has no reason to prefer full scans
+        result = runner.invoke(args=[
+            'seed-data', '--sellers', '20', '--customers', '500',
+            '--products', '5000', '--order-lines', '50000', '--days', '365'])
+        assert result.exit_code == 0, result.output
+
+    yield runner
+    pharmacy.app.config.clear()
+    pharmacy.app.config.update(saved)
+    pharmacy.create_app({'TESTING': True})
+
+
+def test_migrate_is_idempotent(cli):
+    with pharmacy.DatabaseConnection() as cursor:
+        assert pharmacy.pending_migrations(cursor) == []
+    result = cli.invoke(args=['migrate'])
+    assert result.exit_code == 0, result.output
+
+
+def test_query_plans(cli):
+    result = cli.invoke(args=['check-query-plans'])
+    assert result.exit_code == 0, result.output
+
+
+def test_bench_routes(cli, tmp_path):
+    output = tmp_path / 'bench.json'
+    result = cli.invoke(args=[
+        'bench-routes', '--concurrency', '1,2', '--duration', '1',
+        '--users', '2', '--no-checkout', '--output', str(output)])
+    assert result.exit_code == 0, result.output
+
+    with open(output) as f:
+        levels = pharmacy.json.load(f)['levels']
+    assert set(levels) == {'1', '2'}
+    for level in levels.values():
+        assert level['requests'] > 0
+        assert all(route['errors'] == 0 for route in level['routes'].values())
@@ -0,0 +1,41 @@
+"""Keyset cursors: opaque tokens that restart from page one when invalid."""
+from datetime import datetime
+
+import pytest
+
+import app as pharmacy
+
+
+def test_cursor_round_trip():
+    token = pharmacy.encode_cursor(['Paracetamol 500', 'P0001'])
+    assert pharmacy.decode_cursor(token, 2) == ['Paracetamol 500', 'P0001']
+
+
+def test_dates_come_back_as_strings():
+    token = pharmacy.encode_cursor([datetime(2024, 5, 1, 12, 30), 'ORD1', 'P1'])
+    assert pharmacy.decode_cursor(token, 3) == ['2024-05-01 12:30:00', 'ORD1', 'P1']
+
+
+@pytest.mark.parametrize('token', [
+    None, '', 'not base64!', 'bm90IGpzb24=',
+    pharmacy.encode_cursor({'a': 1}), pharmacy.encode_cursor(['only one']),
+])
+def test_malformed_cursor_restarts(token):
+    assert pharmacy.decode_cursor(token, 2) is None
+
+
+def test_keyset_page_cursor_points_past_last_row():
+    rows = [{'name': n, 'product_id': f"P{i}"}
+            for i, n in enumerate(['a', 'b', 'c'])]
+    page, cursor = pharmacy.keyset_page(rows, 2, ('name', 'product_id'))
+    assert page == rows[:2]
+    assert pharmacy.decode_cursor(cursor, 2) == ['b', 'P1']
+    assert pharmacy.keyset_page(rows, 3, ('name', 'product_id')) == (rows, None)
+
+
+@pytest.mark.parametrize('token, offset', [
+    (pharmacy.encode_cursor([40]), 40), (pharmacy.encode_cursor([-1]), 0),
+    (pharmacy.encode_cursor(['40']), 0), (None, 0),
+])
+def test_search_offset(token, offset):
+    assert pharmacy.search_offset(token) == offset
@@ -0,0 +1,32 @@
+"""Building FULLTEXT boolean-mode queries from free text."""
+import app as pharmacy
+
+
+def test_single_term_is_a_required_prefix():
+    assert pharmacy.fulltext_query(['para']) == '+para*'
+
+
+def test_short_terms_are_optional_next_to_others():
+    terms = pharmacy.search_terms('Vitamin D3')
+    assert pharmacy.fulltext_query(terms) == '+vitamin* d3*'
+
+
+def test_short_single_term_is_still_required():
+    assert pharmacy.fulltext_query(['d3']) == '+d3*'
+
+
+def test_boolean_operators_do_not_survive():
+    terms = pharmacy.search_terms('+para -"cold" (flu) ~x <y> @3')
+    assert terms == ['para', 'cold', 'flu', 'x', 'y', '3']
+    query = pharmacy.fulltext_query(terms)
+    assert set(query) <= set('abcdefghijklmnopqrstuvwxyz0123456789+* ')
+
+
+def test_terms_are_capped():
+    terms = pharmacy.search_terms(' '.join(f"word{i}" for i in range(20)))
+    assert len(terms) == pharmacy.SEARCH_MAX_TERMS
+
+
+def test_empty_text_has_no_terms():
+    assert pharmacy.search_terms(None) == []
+    assert pharmacy.search_terms('  ') == []